@@ -1,20 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, get_flashed_messages, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, get_flashed_messages, jsonify, g, Response
 from flask_migrate import Migrate
-import subprocess
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, event, func, select, update, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, load_only
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES
 import time
 import os
-import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
+import base64
+import binascii
+import functools
+import heapq
+import atexit
+import sqlite3
+import click
 import requests
 import redis
-import ipaddress
 import pytz # 导入 pytz 库用于时区处理
 
 # 从 models.py 导入 db 对象和模型
-from models import db, TargetServer, PingResult, TracerouteResult, TestResult
+from models import db, TargetServer, PingResult, TracerouteResult, TraceroutePath, RouteChangeEvent, ProbeRun, PingRollup, BackfillProgress, CacheGeneration
+from parsers import parse_traceroute_output, ping_result_fields
+from geo_cache import TTLLRUCache, MISSING
+from geo_offline import OfflineGeoDB, build_database
+from rollups import PingRollupAccumulator
+from persistence import ResultQueue
+from paths import PathInterner, result_hops
+from ip_classification import is_global, display_label, classify as classify_ip, LOOPBACK
+from route_changes import RouteChangeDetector
+from result_versions import ResultVersionTracker
+from live_feed import ResultBroadcaster, RESET, format_sse
+from response_encoding import FastJSONProvider, LocalTimeFormatter, compress, compress_response, negotiate_encoding, variant_etag
+from legacy_backfill import backfill_legacy_results, PROGRESS_NAME as LEGACY_BACKFILL_NAME
+from retention import build_policies, run_retention, compact_legacy_rows
+from series import SERIES_BUCKETS, DEFAULT_SERIES_POINTS, choose_bucket, downsample_columns, query_ping_series
+from probe_engine import ProbeCycle, ProbeScheduler, PROBE_RUNNERS, NativePingRunner, TimedProbeRunner, probe_outcome, run_traceroute_streaming_async
+from metrics import MetricsRegistry, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 from dotenv import load_dotenv
 
@@ -22,6 +45,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 app = Flask(__name__)
+# jsonify 使用 orjson 序列化 (已安装时)
+app.json = FastJSONProvider(app)
 # 从环境变量中获取 SECRET_KEY
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'a_default_secret_key_if_not_set')
 # 配置数据库 URI，从环境变量 DATABASE_URL 获取，如果未设置则使用默认值
@@ -31,6 +56,31 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # 从环境变量获取测试间隔，如果未设置或无效，默认为 300 秒  
 TEST_INTERVAL_SECONDS = int(os.getenv('TEST_INTERVAL_SECONDS', 300)) if os.getenv('TEST_INTERVAL_SECONDS', '').isdigit() else 300
+# 调度方式: 'per-server' 按服务器分别调度并错开启动时间 (默认)，'cycle' 每个间隔对所有服务器执行一轮测试
+SCHEDULER_MODE = os.getenv('SCHEDULER_MODE', 'per-server').lower()
+# 按服务器调度时首次启动时间的随机抖动，占每个时间片的比例 (0~1)，默认为 0.1
+SCHEDULER_JITTER = float(os.getenv('SCHEDULER_JITTER', 0.1))
+# 按服务器调度时重新加载服务器列表和间隔的周期，单位秒，默认为 30
+SCHEDULER_SYNC_SECONDS = int(os.getenv('SCHEDULER_SYNC_SECONDS', 30)) if os.getenv('SCHEDULER_SYNC_SECONDS', '').isdigit() else 30
+# 同时运行的探测子进程数量上限，默认为 50
+PROBE_CONCURRENCY = int(os.getenv('PROBE_CONCURRENCY', 50)) if os.getenv('PROBE_CONCURRENCY', '').isdigit() else 50
+# 测试结果每累积多少条批量写入一次数据库，默认为 200
+RESULT_FLUSH_BATCH_SIZE = int(os.getenv('RESULT_FLUSH_BATCH_SIZE', 200)) if os.getenv('RESULT_FLUSH_BATCH_SIZE', '').isdigit() else 200
+# 测试结果写入队列的容量，队列满时探测流程等待写入线程，默认为 10000
+RESULT_QUEUE_SIZE = int(os.getenv('RESULT_QUEUE_SIZE', 10000)) if os.getenv('RESULT_QUEUE_SIZE', '').isdigit() else 10000
+# 探测周期台账中记录的耗时最长的探测数量
+RUN_LEDGER_SLOWEST_TARGETS = int(os.getenv('RUN_LEDGER_SLOWEST_TARGETS', 10)) if os.getenv('RUN_LEDGER_SLOWEST_TARGETS', '').isdigit() else 10
+# SQLite 忙等待超时 (毫秒) 和同步模式 (WAL 模式下 NORMAL 即可保证一致性)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)) if os.getenv('SQLITE_BUSY_TIMEOUT_MS', '').isdigit() else 5000
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+# Ping 探测方式: 'subprocess' 调用系统 ping 命令 (默认)，'native' 使用进程内 ICMP 套接字
+PING_BACKEND = os.getenv('PING_BACKEND', 'subprocess').lower()
+# 是否使用流式 Traceroute (逐行解析，到达目标或连续多跳无响应时提前结束)，默认开启
+TRACEROUTE_STREAMING = os.getenv('TRACEROUTE_STREAMING', 'True').lower() in ['true', '1']
+# 流式 Traceroute 连续多少跳无响应后提前结束，默认为 3，设置为 0 表示不提前结束
+TRACEROUTE_MAX_SILENT_HOPS = int(os.getenv('TRACEROUTE_MAX_SILENT_HOPS', 3)) if os.getenv('TRACEROUTE_MAX_SILENT_HOPS', '').isdigit() else 3
 
 # 从环境变量获取应用时区
 APP_TIMEZONE_STR = os.getenv('TIMEZONE', 'UTC') # 默认为 UTC
@@ -46,6 +96,54 @@ REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_LOCATION_CACHE_TTL = int(os.getenv('REDIS_LOCATION_CACHE_TTL', 2592000)) # 默认一个月
 
+# ip-api 批量查询接口，可指向本地兼容服务；每次请求最多 100 个 IP
+IP_API_BATCH_URL = os.getenv('IP_API_BATCH_URL', 'http://ip-api.com/batch')
+IP_API_BATCH_SIZE = 100
+
+# IP 地理位置数据源: 'ip-api' 使用 ip-api.com 在线查询 (默认)，'offline' 使用本地离线区间库
+GEO_PROVIDER = os.getenv('GEO_PROVIDER', 'ip-api').lower()
+# 离线区间库文件路径 (由 flask build-geo-db 命令生成)
+GEO_OFFLINE_DB_PATH = os.getenv('GEO_OFFLINE_DB_PATH', 'instance/geo.db')
+
+# 进程内地理位置缓存 (位于 Redis 之前) 的容量和过期时间，单位秒
+GEO_LOCAL_CACHE_SIZE = int(os.getenv('GEO_LOCAL_CACHE_SIZE', 10000))
+GEO_LOCAL_CACHE_TTL = int(os.getenv('GEO_LOCAL_CACHE_TTL', 3600))
+# 查询失败的 IP 的负缓存过期时间，单位秒
+GEO_NEGATIVE_CACHE_TTL = int(os.getenv('GEO_NEGATIVE_CACHE_TTL', 300))
+
+# 数据保留策略，单位天，0 表示永久保留
+# 原始命令输出 (raw_output) 的保留天数，过期后只清空原始输出，保留结构化字段
+RETENTION_RAW_OUTPUT_DAYS = int(os.getenv('RETENTION_RAW_OUTPUT_DAYS', 0))
+# Ping / Traceroute 结果整行的保留天数 (路由变化事件同 Traceroute，之后删除不再被引用的路径)
+RETENTION_PING_DAYS = int(os.getenv('RETENTION_PING_DAYS', 0))
+RETENTION_TRACEROUTE_DAYS = int(os.getenv('RETENTION_TRACEROUTE_DAYS', 0))
+# 分钟/小时汇总的保留天数 (天汇总始终保留)
+RETENTION_MINUTE_ROLLUP_DAYS = int(os.getenv('RETENTION_MINUTE_ROLLUP_DAYS', 0))
+RETENTION_HOUR_ROLLUP_DAYS = int(os.getenv('RETENTION_HOUR_ROLLUP_DAYS', 0))
+# 每批删除的行数和后台清理任务的执行间隔 (秒)
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 1000))
+RETENTION_INTERVAL_SECONDS = int(os.getenv('RETENTION_INTERVAL_SECONDS', 3600))
+
+# /api/results 响应缓存的最大页面数和过期时间 (秒)，缓存键包含最新结果的版本，有新结果提交后旧页面自动失效
+RESULTS_CACHE_SIZE = int(os.getenv('RESULTS_CACHE_SIZE', 256)) if os.getenv('RESULTS_CACHE_SIZE', '').isdigit() else 256
+RESULTS_CACHE_TTL = int(os.getenv('RESULTS_CACHE_TTL', 300)) if os.getenv('RESULTS_CACHE_TTL', '').isdigit() else 300
+# 每隔多少秒检查其他进程 (另一个 Web 进程、flask 命令) 写入或删除的结果，默认为 5
+RESULTS_VERSION_CHECK_SECONDS = int(os.getenv('RESULTS_VERSION_CHECK_SECONDS', 5)) if os.getenv('RESULTS_VERSION_CHECK_SECONDS', '').isdigit() else 5
+
+# /api/stream 实时推送: 无新结果时发送保活注释的间隔 (秒)，断线重连补发的最近事件数，每个连接最多积压的事件数
+STREAM_KEEPALIVE_SECONDS = int(os.getenv('STREAM_KEEPALIVE_SECONDS', 15)) if os.getenv('STREAM_KEEPALIVE_SECONDS', '').isdigit() else 15
+STREAM_HISTORY_SIZE = int(os.getenv('STREAM_HISTORY_SIZE', 1000)) if os.getenv('STREAM_HISTORY_SIZE', '').isdigit() else 1000
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 1000)) if os.getenv('STREAM_QUEUE_SIZE', '').isdigit() else 1000
+
+# 是否按 Accept-Encoding 压缩 JSON 响应 (gzip，安装了 brotli 时优先 br)，默认开启；小于最小字节数的响应不压缩
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', 'True').lower() in ['true', '1']
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', 1024)) if os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', '').isdigit() else 1024
+
+# /metrics 接口的访问令牌 (请求头 Authorization: Bearer <令牌>)，为空时只允许本机访问
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# 未配置令牌时是否允许任意来源匿名访问 /metrics，默认关闭
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', 'False').lower() in ['true', '1']
+
 migrate = Migrate(app, db)
 
 # 初始化 Redis 客户端
@@ -58,9 +156,183 @@ except redis.exceptions.ConnectionError as e:
     print(f"Redis 连接失败: {e}")
     redis_client = None # 如果连接失败，将客户端设置为 None
 
+# 加载离线地理位置库，加载失败时回退到 ip-api
+offline_geo_db = None
+if GEO_PROVIDER == 'offline':
+    try:
+        offline_geo_db = OfflineGeoDB(GEO_OFFLINE_DB_PATH)
+        print(f"已加载离线地理位置库 {GEO_OFFLINE_DB_PATH}: IPv4 区间 {offline_geo_db.v4_count} 个，IPv6 区间 {offline_geo_db.v6_count} 个。")
+    except (OSError, ValueError) as e:
+        print(f"加载离线地理位置库失败，将使用 ip-api: {e}")
+
+# 进程内地理位置缓存，减少对 Redis 的网络往返
+local_location_cache = TTLLRUCache(maxsize=GEO_LOCAL_CACHE_SIZE, ttl=GEO_LOCAL_CACHE_TTL)
+
+# 数据保留策略
+retention_policies = build_policies(
+    raw_output_days=RETENTION_RAW_OUTPUT_DAYS,
+    ping_days=RETENTION_PING_DAYS,
+    traceroute_days=RETENTION_TRACEROUTE_DAYS,
+    minute_rollup_days=RETENTION_MINUTE_ROLLUP_DAYS,
+    hour_rollup_days=RETENTION_HOUR_ROLLUP_DAYS,
+)
+
+# Traceroute 路径去重，进程内记录已保存的路径
+path_interner = PathInterner()
+
+# 路由变化检测，进程内记录每台服务器最近的路径
+route_detector = RouteChangeDetector()
+
+def latest_result_id_loader(model):
+    """返回读取结果表当前最大 ID 的函数 (使用独立连接，不影响调用方会话的事务)"""
+    def load():
+        with db.engine.connect() as connection:
+            return connection.execute(select(func.max(model.id))).scalar() or 0
+    return load
+
+# 结果接口缓存在 cache_generation 表中的名称
+RESULTS_CACHE_GENERATION = 'results'
+
+def load_results_cache_generation():
+    """读取多个进程共享的结果缓存代数"""
+    with db.engine.connect() as connection:
+        return connection.execute(
+            select(CacheGeneration.generation).where(CacheGeneration.name == RESULTS_CACHE_GENERATION)
+        ).scalar() or 0
+
+def bump_results_cache_generation():
+    """递增共享的结果缓存代数，其他进程下次检查时使结果接口的缓存失效"""
+    with db.engine.begin() as connection:
+        updated = connection.execute(
+            update(CacheGeneration).where(CacheGeneration.name == RESULTS_CACHE_GENERATION)
+            .values(generation=CacheGeneration.generation + 1)
+        ).rowcount
+        if not updated:
+            connection.execute(insert(CacheGeneration).values(name=RESULTS_CACHE_GENERATION, generation=1))
+
+# 各服务器和测试类型已提交结果的版本，用于 /api/results 的 ETag 和响应缓存
+result_versions = ResultVersionTracker({
+    'ping': latest_result_id_loader(PingResult),
+    'traceroute': latest_result_id_loader(TracerouteResult),
+}, load_generation=load_results_cache_generation, bump_generation=bump_results_cache_generation,
+   check_seconds=RESULTS_VERSION_CHECK_SECONDS)
+# /api/results 的响应缓存: ETag -> 响应正文
+results_response_cache = TTLLRUCache(maxsize=RESULTS_CACHE_SIZE, ttl=RESULTS_CACHE_TTL)
+
+# 新结果的实时推送，写入线程提交后分发给所有 /api/stream 连接
+result_broadcaster = ResultBroadcaster(history_size=STREAM_HISTORY_SIZE, subscriber_queue_size=STREAM_QUEUE_SIZE)
+
+def invalidate_results_cache():
+    """结果被删除或改写、服务器信息变化后调用 (也会通知其他进程)"""
+    result_versions.invalidate()
+    results_response_cache.clear()
+
+def reset_result_state():
+    """写入回滚后清除路径去重、路由变化检测、结果版本和待推送事件的进程内状态"""
+    path_interner.clear()
+    route_detector.clear()
+    result_versions.discard()
+    result_broadcaster.discard()
+
+# 运行指标，由 /metrics 以 Prometheus 文本格式导出
+metrics = MetricsRegistry()
+PROBE_DURATION = metrics.histogram('pting_probe_duration_seconds', '单次探测耗时 (秒)', ['test_type'],
+                                   buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60))
+PROBE_RESULTS = metrics.counter('pting_probe_results_total', '探测次数，按结果分类 (ok/failed/timeout)', ['test_type', 'outcome'])
+CYCLE_DURATION = metrics.histogram('pting_cycle_duration_seconds', 'SCHEDULER_MODE=cycle 时每轮探测的耗时 (秒)',
+                                   buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600))
+CYCLE_OVERRUNS = metrics.counter('pting_cycle_overruns_total', 'SCHEDULER_MODE=cycle 时每轮探测耗时超过测试间隔的次数')
+SCHEDULER_SWEEP_DURATION = metrics.histogram(
+    'pting_scheduler_sweep_duration_seconds',
+    'SCHEDULER_MODE=per-server 时每轮 (TEST_INTERVAL_SECONDS 内开始的探测) 从开始到全部结束的耗时 (秒)，正常略大于测试间隔',
+    buckets=(30, 60, 120, 300, 330, 360, 450, 600, 900, 1200, 1800, 3600))
+SCHEDULER_RUN_DURATION = metrics.histogram(
+    'pting_scheduler_run_duration_seconds', 'SCHEDULER_MODE=per-server 时每次执行 (探测并将结果交给写入线程) 的耗时 (秒)',
+    ['test_type'], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+CYCLE_SKIPPED = metrics.counter('pting_cycle_skipped_total', '上一轮探测尚未结束而跳过的轮数 (SCHEDULER_MODE=cycle)')
+GEO_REDIS_LOOKUPS = metrics.counter('pting_geo_redis_lookups_total', 'Redis 地理位置缓存查询次数，按是否命中分类', ['result'])
+GEO_API_REQUESTS = metrics.counter('pting_geo_api_requests_total', '地理位置 API 请求次数', ['endpoint'])
+GEO_API_IPS = metrics.counter('pting_geo_api_ips_total', '通过地理位置 API 查询的 IP 数')
+GEO_API_ERRORS = metrics.counter('pting_geo_api_errors_total', '地理位置 API 请求失败次数', ['endpoint'])
+REDIS_ERRORS = metrics.counter('pting_redis_errors_total', 'Redis 操作出错次数', ['operation'])
+DB_FLUSH_DURATION = metrics.histogram('pting_db_flush_duration_seconds', '每批测试结果写入并提交的耗时 (秒)',
+                                      buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+DB_ROWS_WRITTEN = metrics.counter('pting_db_rows_written_total', '批量写入的测试结果行数')
+HTTP_REQUEST_DURATION = metrics.histogram('pting_http_request_duration_seconds', '请求处理耗时 (秒)，按视图函数分类', ['endpoint'])
+metrics.counter_callback('pting_geo_local_cache_lookups_total', '进程内地理位置缓存查询次数，按结果分类',
+                         lambda: {(result,): local_location_cache.stats()[key] for result, key in
+                                  (('hit', 'hits'), ('negative_hit', 'negative_hits'), ('miss', 'misses'))},
+                         ['result'])
+metrics.counter_callback('pting_geo_local_cache_evictions_total', '进程内地理位置缓存淘汰的条目数',
+                         lambda: {(): local_location_cache.stats()['evictions']})
+metrics.gauge_callback('pting_geo_local_cache_size', '进程内地理位置缓存的条目数', lambda: {(): len(local_location_cache)})
+metrics.gauge_callback('pting_result_queue_depth', '写入队列中等待的任务数', lambda: {(): result_queue.qsize()})
+metrics.gauge_callback('pting_stream_subscribers', '/api/stream 的连接数', lambda: {(): result_broadcaster.subscriber_count()})
+metrics.counter_callback('pting_stream_events_total', '/api/stream 发布的新结果事件数', lambda: {(): result_broadcaster.published})
+metrics.counter_callback('pting_result_tasks_failed_total', '执行失败 (回滚丢弃) 的写入任务数', lambda: {(): result_queue.tasks_failed})
+
+def record_probe(test_type, seconds, outcome):
+    """记录一次探测的耗时和结果分类 (由 TimedProbeRunner 调用)"""
+    PROBE_DURATION.observe(seconds, test_type=test_type)
+    PROBE_RESULTS.inc(test_type=test_type, outcome=outcome)
+
+def record_db_flush(rows, seconds):
+    """记录一批测试结果的写入耗时，更新结果版本并推送新结果 (由写入线程在提交后调用)"""
+    DB_FLUSH_DURATION.observe(seconds)
+    DB_ROWS_WRITTEN.inc(rows)
+    result_versions.commit()
+    result_broadcaster.commit()
+
+# 测试结果写入队列，由唯一的写入线程分批写入数据库
+result_queue = ResultQueue(app, db.session, rollups_factory=PingRollupAccumulator, on_rollback=reset_result_state,
+                           on_flush=record_db_flush, maxsize=RESULT_QUEUE_SIZE, batch_size=RESULT_FLUSH_BATCH_SIZE)
+atexit.register(result_queue.stop)
+
+# 根据配置选择各测试类型的探测函数
+probe_runners = dict(PROBE_RUNNERS)
+if PING_BACKEND == 'native':
+    probe_runners['ping'] = NativePingRunner()
+if TRACEROUTE_STREAMING:
+    probe_runners['traceroute'] = functools.partial(run_traceroute_streaming_async, max_silent_hops=TRACEROUTE_MAX_SILENT_HOPS)
+# 记录每次探测的耗时和结果
+probe_runners = {test_type: TimedProbeRunner(test_type, runner, record_probe) for test_type, runner in probe_runners.items()}
+
 # 将 db 对象与 Flask 应用绑定
 db.init_app(app)
 
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    SQLite 连接建立时启用 WAL 模式，读操作不会被写事务阻塞 (写入线程提交时页面查询仍可进行)，
+    并设置忙等待超时，避免并发写入时立即报 "database is locked"。
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+# 记录每个请求的处理耗时
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint not in (None, 'static'):
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=request.endpoint)
+    return response
+
+@app.after_request
+def compress_json_response(response):
+    """按 Accept-Encoding 压缩 JSON 响应 (/api/results 自行压缩并缓存压缩后的正文)"""
+    if RESPONSE_COMPRESSION:
+        compress_response(response, request.accept_encodings, RESPONSE_COMPRESSION_MIN_SIZE)
+    return response
+
 # 简单的登录验证函数
 def is_authenticated():
     return 'authenticated' in session and session['authenticated']
@@ -125,6 +397,11 @@ def logout():
     flash('您已退出登录。', 'info')
     return redirect(url_for('login'))
 
+def parse_interval_field(name):
+    """读取表单中的测试间隔 (秒)，为空或无效时返回 None，表示使用默认的 TEST_INTERVAL_SECONDS"""
+    value = request.form.get(name, type=int)
+    return value if value and value > 0 else None
+
 @app.route('/add_server', methods=['GET', 'POST'])
 @login_required
 def add_server():
@@ -134,7 +411,12 @@ def add_server():
         description = request.form.get('description')
         
         # 创建新的 TargetServer 实例
-        new_server = TargetServer(hostname=hostname, description=description)
+        new_server = TargetServer(
+            hostname=hostname,
+            description=description,
+            ping_interval_seconds=parse_interval_field('ping_interval_seconds'),
+            traceroute_interval_seconds=parse_interval_field('traceroute_interval_seconds'),
+        )
         
         # 添加到数据库会话并保存
         db.session.add(new_server)
@@ -144,7 +426,7 @@ def add_server():
         return redirect(url_for('manage_servers'))
     
     # GET 请求时显示表单
-    return render_template('add_server.html')
+    return render_template('add_server.html', default_interval=TEST_INTERVAL_SECONDS)
 
 @app.route('/edit_server/<int:server_id>', methods=['GET', 'POST'])
 @login_required
@@ -156,15 +438,19 @@ def edit_server(server_id):
         # 更新服务器信息
         server.hostname = request.form.get('hostname')
         server.description = request.form.get('description')
+        server.ping_interval_seconds = parse_interval_field('ping_interval_seconds')
+        server.traceroute_interval_seconds = parse_interval_field('traceroute_interval_seconds')
         
         # 提交保存到数据库
         db.session.commit()
+        # 结果中包含服务器的主机名和描述
+        invalidate_results_cache()
         
         # 重定向到主页
         return redirect(url_for('manage_servers'))
 
     # GET 请求时显示编辑表单
-    return render_template('edit_server.html', server=server)
+    return render_template('edit_server.html', server=server, default_interval=TEST_INTERVAL_SECONDS)
 
 @app.route('/delete_server/<int:server_id>', methods=['POST'])
 @login_required
@@ -175,6 +461,8 @@ def delete_server(server_id):
     # 从数据库中删除服务器
     db.session.delete(server)
     db.session.commit()
+    route_detector.forget(server_id)
+    invalidate_results_cache()
     
     # 重定向到主页
     return redirect(url_for('manage_servers'))
@@ -182,160 +470,273 @@ def delete_server(server_id):
 @app.route('/results/<int:server_id>')
 @login_required
 def view_results(server_id):
+    """
+    单台服务器的测试结果页 (无需 JavaScript)，Ping 和 Traceroute 结果分别分页 (ping_page / traceroute_page 参数)。
+    读取 PingResult / TracerouteResult，旧的 TestResult 数据需先通过 flask backfill-legacy-results 转换。
+    """
     # 根据 ID 从数据库获取服务器，如果不存在则返回 404 错误
     server = TargetServer.query.get_or_404(server_id)
-    
-    # 获取该服务器的所有测试结果，按时间倒序排序
-    all_results = TestResult.query.filter_by(target_server_id=server.id).order_by(TestResult.test_time.desc()).all()
-
-    # 将结果按测试类型分开
-    ping_results = [r for r in all_results if r.test_type == 'ping']
-    traceroute_results = [r for r in all_results if r.test_type == 'traceroute']
-
-    # 解析 Ping 结果
-    parsed_ping_results = []
-    for result in ping_results:
-        parsed_data = parse_ping_output(result.result_output)
-        # 将原始结果和解析后的数据一起存储，方便在模板中访问
-        parsed_ping_results.append({'raw': result, 'parsed': parsed_data})
-
-    # 解析 Traceroute 结果
-    parsed_traceroute_results = []
-    for result in traceroute_results:
-        parsed_data = parse_traceroute_output(result.result_output)
-        # 将原始结果和解析后的数据一起存储，方便在模板中访问
-        parsed_traceroute_results.append({'raw': result, 'parsed': parsed_data})
-
-    # 处理 Ping 结果并转换为本地时区
-    final_ping_results = []
-    for result_data in parsed_ping_results:
-        raw_result = result_data['raw']
-        # 将 UTC 时间转换为应用配置的本地时区
-        # 假设数据库中的 test_time 是 UTC 或 naive 时间，我们先将其视为 UTC
-        if raw_result.test_time.tzinfo is None: # 如果是 naive 时间
-             utc_time = pytz.utc.localize(raw_result.test_time) # 视为 UTC 并转换为 timezone-aware
-        else:
-             utc_time = raw_result.test_time.astimezone(pytz.utc) # 如果已经是 timezone-aware，确保是 UTC
-             
-        local_time = utc_time.astimezone(APP_TIMEZONE) # 转换为本地时区
-        
-        final_ping_results.append({
-            'raw': raw_result,
-            'parsed': result_data['parsed'],
-            'local_test_time': local_time # 添加本地时间字段
-        })
-
-    # 处理 Traceroute 结果并添加地理位置或私有IP标识，同时转换为本地时区
-    processed_traceroute_results = []
-    for result in traceroute_results:
-        processed_data = {'raw': result}
-
-        # 将 UTC 时间转换为应用配置的本地时区
-        if result.test_time.tzinfo is None: # 如果是 naive 时间
-             utc_time = pytz.utc.localize(result.test_time) # 视为 UTC 并转换为 timezone-aware
-        else:
-             utc_time = result.test_time.astimezone(pytz.utc) # 如果已经是 timezone-aware，确保是 UTC
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+
+    # 列表不显示原始输出，不加载 raw_output
+    ping_pagination = PingResult.query.options(load_only(
+        PingResult.test_time, PingResult.packets_transmitted, PingResult.packets_received, PingResult.packet_loss_percent,
+        PingResult.min_rtt_ms, PingResult.avg_rtt_ms, PingResult.max_rtt_ms,
+    )).filter_by(target_server_id=server.id).order_by(PingResult.test_time.desc()).paginate(
+        page=request.args.get('ping_page', 1, type=int), per_page=per_page, error_out=False)
+    traceroute_pagination = TracerouteResult.query.options(
+        load_only(TracerouteResult.test_time, TracerouteResult.path_id, TracerouteResult.hop_rtts,
+                  TracerouteResult.processed_hops_with_location),
+        joinedload(TracerouteResult.path),
+    ).filter_by(target_server_id=server.id).order_by(TracerouteResult.test_time.desc()).paginate(
+        page=request.args.get('traceroute_page', 1, type=int), per_page=per_page, error_out=False)
+
+    # 将 UTC 时间转换为应用配置的本地时区，跳点中的非公网 IP 添加显示分类
+    ping_results = [
+        {'result': result, 'local_test_time': pytz.utc.localize(result.test_time).astimezone(APP_TIMEZONE)}
+        for result in ping_pagination.items
+    ]
+    traceroute_results = [
+        {'result': result, 'local_test_time': pytz.utc.localize(result.test_time).astimezone(APP_TIMEZONE),
+         'hops': labeled_result_hops(result) or []}
+        for result in traceroute_pagination.items
+    ]
 
-        processed_data['local_test_time'] = utc_time.astimezone(APP_TIMEZONE) # 添加本地时间字段
-        
-        # 优先使用带地理位置的结构化数据
-        if result.traceroute_hops_with_location:
-            # 使用新的辅助函数处理跳点数据
-            processed_data['processed_hops_with_location'] = process_traceroute_hops(result.traceroute_hops_with_location)
-        elif result.result_output:
-             # 如果没有结构化数据，但有原始输出，则解析原始输出作为回退
-             parsed_data = parse_traceroute_output(result.result_output)
-             # 对于回退的解析结果，也使用新的辅助函数处理
-             processed_data['fallback_processed_hops'] = process_traceroute_hops(parsed_data)
+    # 渲染模板并传递数据
+    return render_template('view_results.html', server=server, per_page=per_page,
+                           ping_pagination=ping_pagination, ping_results=ping_results,
+                           traceroute_pagination=traceroute_pagination, traceroute_results=traceroute_results)
 
-        processed_traceroute_results.append(processed_data)
+def encode_cursor(result, time_attr='test_time'):
+    """将结果行的 (时间, id) 编码为不透明的分页游标"""
+    payload = json.dumps([getattr(result, time_attr).isoformat(), result.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
 
+def decode_cursor(cursor):
+    """解析分页游标，返回 (test_time, id)；格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        test_time_str, result_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(test_time_str), int(result_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"无效的游标: {cursor}") from e
 
-    # 渲染模板并传递数据
-    return render_template('view_results.html', server=server, ping_results=final_ping_results, traceroute_results=processed_traceroute_results) # 传递处理后的数据
+def paginate_keyset(query, model, cursor, per_page, time_attr='test_time'):
+    """
+    游标 (keyset) 分页：按 (时间, id) 倒序，从游标位置之后开始读取 per_page 条。
+    不计算总数也不使用 OFFSET，借助 (target_server_id, 时间) 索引，翻到多深的页响应时间都保持不变。
+    per_page 限制在 1..100 之间。返回 (本页结果列表, 下一页游标或 None, 实际使用的 per_page)。
+    """
+    per_page = max(1, min(per_page, 100))
+    time_column = getattr(model, time_attr)
+    query = query.order_by(time_column.desc(), model.id.desc())
+    if cursor:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            time_column < cursor_time,
+            and_(time_column == cursor_time, model.id < cursor_id)
+        ))
+    # 多取一条用于判断是否还有下一页
+    rows = query.limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = None
+    if has_next:
+        # 查询可能带有 join 的其他实体 (例如 (PingResult, TargetServer))，取其中的结果对象
+        last = rows[-1] if isinstance(rows[-1], model) else rows[-1][0]
+        next_cursor = encode_cursor(last, time_attr)
+    return rows, next_cursor, per_page
 
 @app.route('/api/results/<string:test_type>', defaults={'server_id': None})
 @app.route('/api/results/<int:server_id>/<string:test_type>')
 @login_required
 def api_results(server_id, test_type):
-    """提供测试结果的 API 接口"""
+    """
+    提供测试结果的 API 接口。
+    响应带有根据该服务器和类型最新结果版本及请求参数生成的 ETag，以及最新结果的提交时间 (Last-Modified)；
+    浏览器重新验证时若没有新结果返回 304，相同页面的正文在进程内缓存，有新结果提交后自动失效。
+    """
     if test_type not in ['ping', 'traceroute']:
         return jsonify({'error': '无效的测试类型'}), 400
 
+    _, modified_at = result_versions.get(test_type, server_id)
+    # 压缩后的正文是不同的表示，按压缩方式区分 ETag 和缓存
+    encoding = negotiate_encoding(request.accept_encodings) if RESPONSE_COMPRESSION else None
+    etag = variant_etag(result_versions.etag(test_type, server_id, sorted(request.args.items(multi=True))), encoding)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        cached = results_response_cache.get(etag)
+        if cached is MISSING:
+            response = app.make_response(query_results(server_id, test_type))
+            if response.status_code != 200:
+                return response
+            body, content_encoding = response.get_data(), None
+            if encoding and len(body) >= RESPONSE_COMPRESSION_MIN_SIZE:
+                body, content_encoding = compress(body, encoding), encoding
+            results_response_cache.set(etag, (body, content_encoding))
+        else:
+            body, content_encoding = cached
+        response = app.response_class(body, mimetype='application/json')
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.last_modified = pytz.utc.localize(modified_at)
+    # 需要登录的数据只允许浏览器缓存，且每次使用前都要重新验证
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/stream')
+@login_required
+def api_stream():
+    """
+    以 Server-Sent Events 推送新提交的测试结果，可用 server_id 参数只接收某台服务器的结果。
+    事件在写入线程提交后由进程内广播分发，不查询数据库；断线重连时根据 Last-Event-ID 补发错过的事件，
+    无法补发 (错过太多、积压溢出或事件ID 来自重启前的进程) 时发送 reset 事件，客户端应重新加载数据。
+    """
+    server_id = request.args.get('server_id', type=int)
+    last_event_id = request.headers.get('Last-Event-ID')
+    subscription = result_broadcaster.subscribe(server_id, last_event_id)
+
+    def generate():
+        try:
+            # 断线后浏览器 5 秒重连
+            yield 'retry: 5000\n\n'
+            while True:
+                item = subscription.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                # 保活注释，同时让服务器及时发现已断开的连接
+                if item is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield format_sse(item, result_broadcaster.latest_event_id() if item is RESET else None)
+        finally:
+            result_broadcaster.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # 禁止 Nginx 等反向代理缓冲事件流
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# /api/results 的可选字段: 字段名 -> (需要从结果表加载的列, 取值函数 (结果, 服务器, 本地时间格式化函数))
+# 只加载所选字段需要的列，未选择 raw_output 等大字段时不会读取 (和解压) 它们
+RESULT_FIELDS = {
+    'ping': {
+        'id': ((), lambda result, server, local_time: result.id),
+        'server_id': ((PingResult.target_server_id,), lambda result, server, local_time: result.target_server_id),
+        'test_time': ((), lambda result, server, local_time: local_time(result.test_time)),
+        'raw_output': ((PingResult.raw_output,), lambda result, server, local_time: result.raw_output),
+        'packets_transmitted': ((PingResult.packets_transmitted,), lambda result, server, local_time: result.packets_transmitted),
+        'packets_received': ((PingResult.packets_received,), lambda result, server, local_time: result.packets_received),
+        'packet_loss_percent': ((PingResult.packet_loss_percent,), lambda result, server, local_time: result.packet_loss_percent),
+        'min_rtt_ms': ((PingResult.min_rtt_ms,), lambda result, server, local_time: result.min_rtt_ms),
+        'avg_rtt_ms': ((PingResult.avg_rtt_ms,), lambda result, server, local_time: result.avg_rtt_ms),
+        'max_rtt_ms': ((PingResult.max_rtt_ms,), lambda result, server, local_time: result.max_rtt_ms),
+        'server_hostname': ((), lambda result, server, local_time: server.hostname),
+        'server_description': ((), lambda result, server, local_time: server.description),
+    },
+    'traceroute': {
+        'id': ((), lambda result, server, local_time: result.id),
+        'server_id': ((TracerouteResult.target_server_id,), lambda result, server, local_time: result.target_server_id),
+        'test_time': ((), lambda result, server, local_time: local_time(result.test_time)),
+        'raw_output': ((TracerouteResult.raw_output,), lambda result, server, local_time: result.raw_output),
+        'path_id': ((TracerouteResult.path_id,), lambda result, server, local_time: result.path_id), # 路径ID相同表示路径未变化
+        # 跳点数据由去重保存的路径和本次测试的 RTT 还原，旧数据直接使用保存的结构化数据
+        'processed_hops': ((TracerouteResult.path_id, TracerouteResult.hop_rtts, TracerouteResult.processed_hops_with_location),
+                           lambda result, server, local_time: labeled_result_hops(result)),
+    },
+}
+# 需要服务器信息 (join TargetServer) 的 Ping 字段
+PING_SERVER_FIELDS = {'server_hostname', 'server_description'}
+
+def parse_result_fields(test_type):
+    """
+    解析 fields 参数 (逗号分隔的字段名)，未提供时返回全部字段。id 始终返回，以便按 ID 获取原始输出。
+    包含未知字段时抛出 ValueError。
+    """
+    available = RESULT_FIELDS[test_type]
+    fields_arg = request.args.get('fields')
+    if fields_arg is None:
+        return list(available)
+    fields = ['id']
+    for name in fields_arg.split(','):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in available:
+            raise ValueError(f"未知字段: {name}，可选字段: {', '.join(available)}")
+        fields.append(name)
+    return fields
+
+def query_results(server_id, test_type):
+    """查询并格式化一页测试结果，返回 JSON 响应 (fields 参数可只返回部分字段)"""
     # 获取分页参数
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int) # 默认每页10条
+    # 请求中带有 cursor 参数 (第一页可为空) 时使用游标分页，返回 next_cursor 而不计算 total/pages
+    cursor = request.args.get('cursor')
+    keyset_mode = cursor is not None
+    next_cursor = None
 
-    if test_type == 'ping':
-        # 从 PingResult 表中查询数据并分页
-        # Join with TargetServer to get hostname and description
-        query = db.session.query(PingResult, TargetServer).join(TargetServer)
-        query = query.order_by(PingResult.test_time.desc())
+    try:
+        fields = parse_result_fields(test_type)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    field_specs = [(name, RESULT_FIELDS[test_type][name]) for name in fields]
 
+    if test_type == 'ping':
+        model = PingResult
+        # 只在需要主机名或描述时 join TargetServer
+        if PING_SERVER_FIELDS.intersection(fields):
+            query = db.session.query(PingResult, TargetServer).join(TargetServer)
+        else:
+            query = db.session.query(PingResult)
         if server_id is not None:
             # Filter by target_server_id
             query = query.filter(PingResult.target_server_id == server_id)
-            
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        # results = pagination.items
-
-        # 格式化 Ping 结果
-        formatted_results = []
-        # Iterate over pairs of PingResult and TargetServer objects
-        for ping_result, target_server in pagination.items:
-            # 将 UTC 时间转换为应用配置的本地时区
-            if ping_result.test_time.tzinfo is None: # 如果是 naive 时间
-                 utc_time = pytz.utc.localize(ping_result.test_time) # 视为 UTC 并转换为 timezone-aware
-            else:
-                 utc_time = ping_result.test_time.astimezone(pytz.utc) # 如果已经是 timezone-aware，确保是 UTC
-                 
-            local_time = utc_time.astimezone(APP_TIMEZONE) # 转换为本地时区
-            
-            formatted_results.append({
-                'id': ping_result.id,
-                'server_id': ping_result.target_server_id,
-                'test_time': local_time.isoformat(), # Format datetime as ISO string in local timezone
-                'raw_output': ping_result.raw_output,
-                'packets_transmitted': ping_result.packets_transmitted,
-                'packets_received': ping_result.packets_received,
-                'packet_loss_percent': ping_result.packet_loss_percent,
-                'min_rtt_ms': ping_result.min_rtt_ms,
-                'avg_rtt_ms': ping_result.avg_rtt_ms,
-                'max_rtt_ms': ping_result.max_rtt_ms,
-                'server_hostname': target_server.hostname, # Add server hostname
-                'server_description': target_server.description, # Add server description
-            })
-
-    elif test_type == 'traceroute':
-        # 从 TracerouteResult 表中查询数据并分页
-        query = TracerouteResult.query.order_by(TracerouteResult.test_time.desc())
+    else:
+        model = TracerouteResult
+        query = TracerouteResult.query
+        if 'processed_hops' in fields:
+            # 预先加载路径，避免逐条查询
+            query = query.options(joinedload(TracerouteResult.path))
         if server_id is not None:
             query = query.filter_by(target_server_id=server_id)
-            
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        results = pagination.items
-
-        # 格式化 Traceroute 结果
-        formatted_results = []
-        for result in results:
-             # 将 UTC 时间转换为应用配置的本地时区
-             if result.test_time.tzinfo is None: # 如果是 naive 时间
-                  utc_time = pytz.utc.localize(result.test_time) # 视为 UTC 并转换为 timezone-aware
-             else:
-                  utc_time = result.test_time.astimezone(pytz.utc) # 如果已经是 timezone-aware，确保是 UTC
 
-             local_time = utc_time.astimezone(APP_TIMEZONE) # 转换为本地时区
+    # 只加载所选字段需要的列 (id 和时间用于排序和游标，始终加载)
+    columns = {model.id, model.test_time}
+    for _, (field_columns, _) in field_specs:
+        columns.update(field_columns)
+    query = query.options(load_only(*columns))
 
-             # TracerouteResult 的 processed_hops_with_location 字段已经包含了处理后的数据
-             # 只需要直接返回即可，但需要确保时间已转换为本地时区
-             # 注意：processed_hops_with_location 中的时间是字符串，这里只处理顶层test_time
-             formatted_results.append({
-                 'id': result.id,
-                 'server_id': result.target_server_id,
-                 'test_time': local_time.isoformat(), # Format datetime as ISO string in local timezone
-                 'raw_output': result.raw_output,
-                 'processed_hops': result.processed_hops_with_location # 直接使用存储的结构化数据
-             })
+    if keyset_mode:
+        try:
+            rows, next_cursor, per_page = paginate_keyset(query, model, cursor, per_page)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        pagination = query.order_by(model.test_time.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        rows = pagination.items
+
+    # 格式化结果，查询带有 TargetServer 时每行为 (结果, 服务器)
+    pairs = [(row, None) if isinstance(row, model) else (row[0], row[1]) for row in rows]
+    # 整页的本地时区换算只做一次 (跨越夏令时切换时逐条换算)
+    local_time = LocalTimeFormatter(APP_TIMEZONE, [result.test_time for result, _ in pairs])
+    formatted_results = [
+        {name: getter(result, server, local_time) for name, (_, getter) in field_specs}
+        for result, server in pairs
+    ]
+
+    if keyset_mode:
+        # 游标分页只返回下一页游标
+        return jsonify({
+            'items': formatted_results,
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+            'has_next': next_cursor is not None
+        })
 
     # 返回分页结果和元数据
     return jsonify({
@@ -348,63 +749,174 @@ def api_results(server_id, test_type):
         'has_prev': pagination.has_prev
     })
 
-def is_private_ip(ip_address):
-    """检查一个 IP 地址是否属于私有网络范围 (支持 IPv4 和 IPv6)"""
-    if not ip_address or ip_address == 'N/A' or ip_address == '*':
-        return False
+@app.route('/api/results/<string:test_type>/<int:result_id>/raw')
+@login_required
+def api_result_raw(test_type, result_id):
+    """返回单条测试结果的原始命令输出，供报表页打开详情时按需获取 (已被保留策略清理时为 null)"""
+    models = {'ping': PingResult, 'traceroute': TracerouteResult}
+    if test_type not in models:
+        return jsonify({'error': '无效的测试类型'}), 400
+    model = models[test_type]
+    result = db.session.query(model).options(load_only(model.id, model.raw_output)).filter(model.id == result_id).first()
+    if result is None:
+        return jsonify({'error': '结果不存在'}), 404
+    response = jsonify({'id': result.id, 'raw_output': result.raw_output})
+    # 单条结果写入后不再变化 (仅可能被保留策略清理)，允许浏览器短时间缓存
+    response.cache_control.private = True
+    response.cache_control.max_age = 300
+    return response
+
+@app.route('/api/route_changes', defaults={'server_id': None})
+@app.route('/api/route_changes/<int:server_id>')
+@login_required
+def api_route_changes(server_id):
+    """
+    路由变化事件接口，按检测时间倒序，使用游标分页。
+    参数: cursor 上一页返回的 next_cursor (第一页省略)，per_page 每页条数 (默认 20)。
+    """
+    per_page = request.args.get('per_page', 20, type=int)
+    query = db.session.query(RouteChangeEvent, TargetServer).join(TargetServer)
+    if server_id is not None:
+        query = query.filter(RouteChangeEvent.target_server_id == server_id)
+    try:
+        rows, next_cursor, per_page = paginate_keyset(query, RouteChangeEvent, request.args.get('cursor'), per_page, time_attr='detected_at')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    items = []
+    for change_event, target_server in rows:
+        items.append({
+            'id': change_event.id,
+            'server_id': change_event.target_server_id,
+            'server_hostname': target_server.hostname,
+            'detected_at': pytz.utc.localize(change_event.detected_at).astimezone(APP_TIMEZONE).isoformat(),
+            'old_path_id': change_event.old_path_id,
+            'new_path_id': change_event.new_path_id,
+            'diff': change_event.diff,
+        })
+    return jsonify({
+        'items': items,
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None
+    })
 
+@app.route('/api/runs')
+@login_required
+def api_runs():
+    """
+    探测周期台账，按开始时间倒序，使用游标分页。SCHEDULER_MODE=cycle 时每轮 perform_tests 一条；
+    per-server 时每 TEST_INTERVAL_SECONDS 内开始的探测为一条，在这些探测全部结束后写入，探测耗时为各项探测耗时之和。
+    每条包含调度方式、各阶段耗时和耗时最长的探测。参数: cursor 上一页返回的 next_cursor (第一页省略)，per_page 每页条数 (默认 20)。
+    """
+    per_page = request.args.get('per_page', 20, type=int)
     try:
-        # 尝试解析为 IPv4 地址
-        parts_v4 = ip_address.split('.')
-        if len(parts_v4) == 4:
-            # IPv4 地址检查
-            parts = list(map(int, parts_v4))
-            # 10.0.0.0/8
-            if parts[0] == 10:
-                return True
-            # 172.16.0.0/12
-            if parts[0] == 172 and 16 <= parts[1] <= 31:
-                return True
-            # 192.168.0.0/16
-            if parts[0] == 192 and parts[1] == 168:
-                return True
-            # 环回地址
-            if ip_address == '127.0.0.1':
-                return True
-       
-        # 尝试解析为 IPv6 地址
-        # 使用 ipaddress 模块进行更准确的 IPv6 地址类型判断
-        try:
-            ip = ipaddress.ip_address(ip_address)
-            # 检查是否为私有地址 (ULA)
-            if ip.is_private:
-                return True
-            # 检查是否为链路本地地址
-            if ip.is_link_local:
-                return True
-            # 检查是否为环回地址
-            if ip.is_loopback:
-                return True
-        except ValueError:
-            # 如果不是有效的 IPv4 或 IPv6 地址
-            return False
+        runs, next_cursor, per_page = paginate_keyset(ProbeRun.query, ProbeRun, request.args.get('cursor'), per_page, time_attr='started_at')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    items = []
+    for run in runs:
+        items.append({
+            'id': run.id,
+            'started_at': pytz.utc.localize(run.started_at).astimezone(APP_TIMEZONE).isoformat(),
+            'finished_at': pytz.utc.localize(run.finished_at).astimezone(APP_TIMEZONE).isoformat() if run.finished_at else None,
+            'duration_seconds': (run.finished_at - run.started_at).total_seconds() if run.finished_at else None,
+            'scheduler_mode': run.scheduler_mode,
+            'server_count': run.server_count,
+            'probe_count': run.probe_count,
+            'failed_count': run.failed_count,
+            'timeout_count': run.timeout_count,
+            'stages': {
+                'probe_seconds': run.probe_seconds,
+                'parse_seconds': run.parse_seconds,
+                'geo_seconds': run.geo_seconds,
+                'db_write_seconds': run.db_write_seconds,
+            },
+            'slowest_targets': run.slowest_targets or [],
+        })
+    return jsonify({
+        'items': items,
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    以 Prometheus 文本格式导出运行指标 (不需要登录)。
+    配置了 METRICS_TOKEN 时需要 Bearer 令牌；未配置时默认只允许本机 (环回地址) 访问，
+    设置 METRICS_PUBLIC=True 可允许任意来源匿名访问。位于同机反向代理之后时请求均来自本机，应配置令牌。
+    """
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            return Response('unauthorized\n', status=401, mimetype='text/plain')
+    elif not METRICS_PUBLIC and classify_ip(request.remote_addr or '') != LOOPBACK:
+        return Response('forbidden: set METRICS_TOKEN to scrape remotely\n', status=403, mimetype='text/plain')
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/scheduler')
+@login_required
+def api_scheduler():
+    """调度器和写入队列的运行统计，包括调度延迟 (计划执行时间到实际开始执行的秒数)"""
+    return jsonify({
+        'mode': SCHEDULER_MODE,
+        'scheduler': probe_scheduler.stats() if SCHEDULER_MODE == 'per-server' else None,
+        'result_queue': result_queue.stats(),
+    })
 
+def parse_time_param(value):
+    """
+    解析查询参数中的时间 (Unix 秒级时间戳或 ISO 8601 字符串)，返回 naive UTC 时间。
+    不带时区的 ISO 时间按应用配置的时区解释；格式错误时抛出 ValueError。
+    """
+    if value.isdigit():
+        return datetime.utcfromtimestamp(int(value))
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = APP_TIMEZONE.localize(parsed)
+    return parsed.astimezone(pytz.utc).replace(tzinfo=None)
+
+@app.route('/api/series/<int:server_id>/ping')
+@login_required
+def api_ping_series(server_id):
+    """
+    Ping 时间序列接口，返回列式数组 (时间戳、平均/最小/最大 RTT、丢包率；使用汇总表时还有 p50/p95/p99 RTT)。
+    参数: from/to 时间范围 (默认最近 24 小时)，bucket 分桶 (raw/minute/hour/day，默认按范围自动选择)，
+    points 最大点数 (默认 500，超过时使用 LTTB 降采样)。
+    """
+    TargetServer.query.get_or_404(server_id)
+    try:
+        end = parse_time_param(request.args['to']) if request.args.get('to') else datetime.utcnow()
+        start = parse_time_param(request.args['from']) if request.args.get('from') else end - timedelta(days=1)
     except ValueError:
-        # 处理部分不是整数的情况 (主要针对 IPv4 解析)
-        return False
-    except ImportError:
-        # 如果没有安装 ipaddress 模块，则只进行基本的 IPv4 私有地址检查
-        print("警告: 未安装 'ipaddress' 模块，IPv6 私有地址检查将受限。")
-        # 基本的 IPv6 私有地址前缀检查 (不完全，但能覆盖常见情况)
-        if ip_address.lower().startswith('fc') or ip_address.lower().startswith('fe80:') or ip_address == '::1':
-             return True
-        return False # 如果发生导入错误，且不是基本的 IPv6 私有前缀，则返回 False
-
-    return False # 既不是 IPv4 私有也不是 IPv6 私有
+        return jsonify({'error': '无效的时间参数'}), 400
+    if start >= end:
+        return jsonify({'error': '开始时间必须早于结束时间'}), 400
+
+    bucket = request.args.get('bucket') or choose_bucket(start, end)
+    if bucket not in SERIES_BUCKETS:
+        return jsonify({'error': '无效的分桶方式'}), 400
+    points = request.args.get('points', DEFAULT_SERIES_POINTS, type=int)
+
+    columns = query_ping_series(db.session, server_id, start, end, bucket)
+    total_points = len(columns['timestamps'])
+    if points and points > 0:
+        columns = downsample_columns(columns, points)
+
+    return jsonify({
+        'server_id': server_id,
+        'bucket': bucket,
+        'from': int(pytz.utc.localize(start).timestamp() * 1000),
+        'to': int(pytz.utc.localize(end).timestamp() * 1000),
+        'total_points': total_points,
+        **columns
+    })
 
 def process_traceroute_hops(hops_list):
     """
-    处理 Traceroute 跳点列表，检查私有 IP 并添加 display_location 字段。
+    处理 Traceroute 跳点列表，为没有地理位置的非公网 IP (局域网、运营商内网、链路本地等) 添加 display_location 字段。
     参数:
         hops_list: 从 parse_traceroute_output 或 result.traceroute_hops_with_location 得到的跳点列表。
     返回:
@@ -420,377 +932,523 @@ def process_traceroute_hops(hops_list):
             # 复制 detail 字典以避免修改原始数据
             processed_detail = detail.copy()
             ip = processed_detail.get('ip')
-            # 如果没有 location 数据（仅存在于 structured data），且 IP 是私有 IP，则设置 display_location
-            # is_private_ip 函数已经处理了 'N/A', '*' 等非 IP 值
-            if not processed_detail.get('location') and ip and is_private_ip(ip):
-                 processed_detail['display_location'] = '局域网'
-            # 如果不是私有 IP 且没有获取到 location (structured data)，或者处理的是 fallback data，
-            # 且 display_location 还没设置，这里也可以根据需要设置默认值或保持 None/N/A。
-            # 当前逻辑只在是私有 IP 且没有 location 时设置 '局域网'。
+            # 如果没有 location 数据（仅存在于 structured data），且 IP 不是公网地址，则按地址分类设置 display_location
+            # 'N/A', '*' 等非 IP 值的分类为无效地址，不设置
+            if not processed_detail.get('location'):
+                label = display_label(ip)
+                if label:
+                    processed_detail['display_location'] = label
             processed_details.append(processed_detail)
         # 确保 hop_number 存在，即使 detail 列表为空
         processed_hops.append({'hop_number': hop.get('hop_number', 'N/A'), 'details': processed_details})
 
     return processed_hops
 
-def get_ip_location(ip_address):
-    """使用 ip-api.com 获取 IP 地址的地理位置信息"""
-    if ip_address == 'N/A' or ip_address == '*':
-        return None
-    
-    # 检查是否为环回地址
-    if ip_address == '127.0.0.1': # TODO: Consider IPv6 loopback ::1 as well
-        return None
+def labeled_result_hops(result):
+    """返回 TracerouteResult 的跳点列表，非公网 IP 带有 display_location"""
+    hops = result_hops(result)
+    return process_traceroute_hops(hops) if hops else hops
 
-    # 检查是否为私有 IPv4 地址范围 (手动检查) - 移除冗余检查，依赖 get_cached_or_fetch_location 中的 is_private_ip
-    # parts = list(map(int, ip_address.split('.'))) if '.' in ip_address else None
-    
-    # if parts and len(parts) == 4:
-    #     # 10.0.0.0/8
-    #     if parts[0] == 10:
-    #         print(f"跳过私有 IP 的位置查询: {ip_address}")
-    #         return None
-    #     # 172.16.0.0/12
-    #     if parts[0] == 172 and 16 <= parts[1] <= 31:
-    #          print(f"跳过私有 IP 的位置查询: {ip_address}")
-    #          return None
-    #     # 192.168.0.0/16
-    #     if parts[0] == 192 and parts[1] == 168:
-    #          print(f"跳过私有 IP 的位置查询: {ip_address}")
-    #          return None
-    # 注意: 为了简化，这里不检查 IPv6 私有地址范围 (ULA, link-local)
-    # 且 traceroute -n 主要返回 IPv4 地址。
-
-    # 如果不是已知的非IP/环回地址，则继续进行 API 调用
-    api_url = f"http://ip-api.com/json/{ip_address}"
-    try:
-        response = requests.get(api_url, timeout=5) # 为 API 请求添加超时
-        response.raise_for_status() # 对于不良状态码抛出异常
-        data = response.json()
-        if data.get('status') == 'success':
-            # 返回相关的地理位置数据
-            return {
-                'country': data.get('country'),
-                'city': data.get('city'),
-                'lat': data.get('lat'),
-                'lon': data.get('lon')
-            }
-        else:
-            # API 返回的状态不是 success (例如，fail, limited)
-            print(f"IP 地理位置 API 返回状态: {data.get('status')}，IP: {ip_address}。消息: {data.get('message')}")
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"获取 IP {ip_address} 的位置时出错: {e}")
-        return None
-    except json.JSONDecodeError:
-         print(f"解码 IP {ip_address} 的 JSON 响应时出错")
-         return None
-    except Exception as e:
-        print(f"获取 IP {ip_address} 的地理位置时发生未知错误: {e}")
+def decode_cached_location(cached_data):
+    """解析 Redis 中缓存的地理位置，失败标记 {'status': 'failed'} 返回 None"""
+    location_data = json.loads(cached_data)
+    if location_data.get('status') == 'failed':
         return None
+    return location_data
 
-def get_cached_or_fetch_location(ip_address):
+def store_location(ip_address, location_data, pipe=None):
     """
-    从 Redis 缓存获取 IP 地址的地理位置信息，如果缓存中没有或已过期，则调用外部 API 获取并存入缓存。
+    将地理位置写入两级缓存。location_data 为 None 时写入短 TTL 的负缓存，避免短时间内重复请求失败的 IP。
+    pipe 不为空时只把 Redis 写操作加入该 pipeline，由调用方统一执行。
     """
+    ttl = REDIS_LOCATION_CACHE_TTL if location_data else GEO_NEGATIVE_CACHE_TTL
+    local_location_cache.set(ip_address, location_data, ttl=min(ttl, GEO_LOCAL_CACHE_TTL))
     if not redis_client:
-        print("Redis 客户端未初始化，跳过缓存。直接调用 API 获取位置。")
-        return get_ip_location(ip_address) # 如果 Redis 未连接，回退到直接调用 API
-
-    # 检查是否为私有 IP，如果是则不进行查询
-    if is_private_ip(ip_address):
-        # print(f"IP {ip_address} 是私有 IP，跳过位置查询和缓存。")
-        return None # 私有 IP 不查询也不缓存
-
-    cache_key = f"ip_location:{ip_address}"
+        return
+    value = json.dumps(location_data if location_data else {'status': 'failed'})
     try:
-        # 尝试从 Redis 获取缓存数据
-        cached_data = redis_client.get(cache_key)
-        if cached_data:
-            # print(f"从 Redis 缓存获取到 IP {ip_address} 的位置信息。")
-            return json.loads(cached_data) # 缓存命中，返回解析后的 JSON 数据
-
-        # 缓存未命中或已过期，调用外部 API
-        # print(f"Redis 缓存未命中或已过期，为 IP {ip_address} 调用外部 API 获取位置。")
-        location_data = get_ip_location(ip_address)
-
-        if location_data:
-            # 将获取到的位置信息存入 Redis 缓存
-            redis_client.set(cache_key, json.dumps(location_data), ex=REDIS_LOCATION_CACHE_TTL)
-            # print(f"已将 IP {ip_address} 的位置信息存入 Redis 缓存，过期时间: {REDIS_LOCATION_CACHE_TTL} 秒。")
-            return location_data
-        else:
-            # 如果 API 没有返回有效位置数据，也可以选择在 Redis 中标记一下，避免短时间内重复请求失败的 IP
-            # 例如，设置一个很短的过期时间，表示最近尝试过但失败了
-            # redis_client.set(cache_key, json.dumps({'status': 'failed'}), ex=60) # 标记失败 60 秒
-            return None # API 未返回有效数据
-
+        (pipe or redis_client).set(f"ip_location:{ip_address}", value, ex=ttl)
     except redis.exceptions.RedisError as e:
+        REDIS_ERRORS.inc(operation='set')
         print(f"Redis 操作出错 ({e.__class__.__name__}): {e}")
-        # Redis 操作失败时，回退到直接调用 API
-        return get_ip_location(ip_address)
-    except json.JSONDecodeError:
-        print(f"解码 Redis 缓存数据时出错 for IP {ip_address}")
-        # 解码失败也回退到直接调用 API
-        return get_ip_location(ip_address)
-    except Exception as e:
-        print(f"get_cached_or_fetch_location 发生未知错误 for IP {ip_address}: {e}")
-        return get_ip_location(ip_address)
-
-def run_ping_test(hostname, count=4):
-    """执行 Ping 测试并返回结果字符串"""
-    try:
-        # 构建 ping 命令，-c 指定次数
-        command = ['ping', '-c', str(count), hostname]
-        # 执行命令并捕获输出
-        # capture_output=True 捕获 stdout 和 stderr
-        # text=True 将输出解码为文本
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        # 如果命令执行失败 (例如，主机不可达)
-        return f"Ping 测试失败: {e.stderr}"
-    except FileNotFoundError:
-        return "错误: 未找到 ping 命令。请确保已安装 ping。"
-    except Exception as e:
-        return f"发生未知错误: {e}"
-
-def run_traceroute_test(hostname):
-    """执行 Traceroute 测试并返回结果字符串"""
-    try:
-        # 构建 traceroute 命令，-n 避免反向 DNS 查询，加快速度
-        # 在某些系统上可能是 traceroute，在其他系统上可能是 tracert (Windows)
-        # 我们先尝试 traceroute
-        command = ['traceroute', '-n', hostname]
-        # 执行命令并捕获输出
-        result = subprocess.run(command, capture_output=True, text=True, check=True, timeout=60)
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        return f"Traceroute 测试失败: {e.stderr}"
-    except FileNotFoundError:
-        return "错误: 未找到 traceroute 命令。请确保已安装 traceroute。"
-    except subprocess.TimeoutExpired:
-        return "Traceroute 测试超时。"
-    except Exception as e:
-        return f"发生未知错误: {e}"
-
-def parse_ping_output(output):
-    """解析 Ping 命令输出并提取关键信息"""
-    stats = {
-        'packets_transmitted': 0,
-        'packets_received': 0,
-        'packet_loss': 'N/A',
-        'min_rtt': 'N/A',
-        'avg_rtt': 'N/A',
-        'max_rtt': 'N/A',
-    }
-
-    if not output:
-        return stats
-
-    # 尝试匹配丢包率信息
-    loss_match = re.search(r'(\d+)% packet loss', output)
-    if loss_match:
-        stats['packet_loss'] = f"{loss_match.group(1)}%"
-
-    # 尝试匹配发送和接收的包数量
-    packets_match = re.search(r'(\d+) packets transmitted, (\d+) packets received', output)
-    if packets_match:
-        stats['packets_transmitted'] = int(packets_match.group(1))
-        stats['packets_received'] = int(packets_match.group(2))
-
-    # 尝试匹配 RTT 统计信息 (min/avg/max)
-    rtt_match = re.search(r'rtt min/avg/max/mdev = (\d+\.?\d+)/(\d+\.?\d+)/(\d+\.?\d+)/\d+\.?\d+ ms', output)
-    if rtt_match:
-        stats['min_rtt'] = f"{rtt_match.group(1)} ms"
-        stats['avg_rtt'] = f"{rtt_match.group(2)} ms"
-        stats['max_rtt'] = f"{rtt_match.group(3)} ms"
-
-    return stats
-
-def parse_traceroute_output(output):
-    """解析 Traceroute 命令输出并提取关键信息"""
-    hops = []
-    if not output:
-        return hops
-
-    # 按行分割输出
-    lines = output.strip().split('\n')
-
-    # 遍历每一行，跳过头部信息
-    # 头部信息通常是 "traceroute to example.com (x.x.x.x), 30 hops max, 60 byte packets"
-    # 实际的跳信息从第二行或第三行开始，具体取决于输出格式
-    # 我们尝试从包含跳数 (数字) 开头的行开始解析
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        # 尝试匹配以数字开头的行 (跳数)
-        hop_match = re.match(r'^\s*(\d+)\s+(.*)', line)
-        if hop_match:
-            hop_number = int(hop_match.group(1))
-            hop_data_str = hop_match.group(2)
-
-            # 解析跳的详细信息 (IP/域名, 延迟)
-            # 格式可能像 "hostname (IP)  time1 ms  time2 ms ..." 或 "IP  time1 ms ..." 或 "* * *"
-            details = []
-            current_detail = {}
-            parts = hop_data_str.split()
-
-            i = 0
-            while i < len(parts):
-                part = parts[i]
-                if part == '*':
-                    details.append({'host': '*', 'ip': 'N/A', 'rtt': 'N/A'})
-                    # 如果是 *, 跳过接下来的 * *
-                    while i + 1 < len(parts) and parts[i+1] == '*':
-                         i += 1
-                elif part.endswith('ms'):
-                     # 匹配延迟，通常前面是数字
-                     if i > 0 and parts[i-1].replace('.', '', 1).isdigit():
-                          details.append({'host': current_detail.get('host', 'N/A'), 'ip': current_detail.get('ip', 'N/A'), 'rtt': f"{parts[i-1]} {part}"})
-                          current_detail = {} # 重置 detail for next entry
-                          i += 1 # 跳过 ms
-                     else:
-                          # 如果格式不符合预期，作为原始部分处理
-                          details.append({'host': 'N/A', 'ip': 'N/A', 'rtt': part})
-
-                elif re.match(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', part):
-                    # 匹配 IP 地址
-                    current_detail['ip'] = part
-                    current_detail['host'] = part # 默认主机名就是IP
-
-                elif part.endswith(')'):
-                    # 匹配主机名 (IP) 格式
-                    if i > 0 and parts[i-1].endswith('('):
-                         host_name = parts[i-2] if i > 1 else 'N/A' # 主机名在括号前
-                         ip_address = part.strip('()')
-                         current_detail['host'] = host_name
-                         current_detail['ip'] = ip_address
-                         i += 1 # 跳过 )
-                    else:
-                        # 如果格式不符合预期，作为原始部分处理
-                        current_detail['host'] = part
-                        current_detail['ip'] = 'N/A' # 无法确定IP
 
+def get_ip_locations_batch(ip_addresses):
+    """
+    使用 ip-api.com 的批量接口获取多个 IP 的地理位置信息。
+    返回 {ip: 位置字典}，查询失败的 IP 不包含在结果中。
+    """
+    locations = {}
+    for start in range(0, len(ip_addresses), IP_API_BATCH_SIZE):
+        chunk = ip_addresses[start:start + IP_API_BATCH_SIZE]
+        payload = [{'query': ip, 'fields': 'status,message,country,city,lat,lon,as,query'} for ip in chunk]
+        GEO_API_REQUESTS.inc(endpoint='batch')
+        GEO_API_IPS.inc(len(chunk))
+        try:
+            response = requests.post(IP_API_BATCH_URL, json=payload, timeout=10)
+            response.raise_for_status()
+            for data in response.json():
+                if data.get('status') == 'success':
+                    locations[data.get('query')] = {
+                        'country': data.get('country'),
+                        'city': data.get('city'),
+                        'lat': data.get('lat'),
+                        'lon': data.get('lon'),
+                        'asn': data.get('as') or None # 例如 "AS15169 Google LLC"，用于路由变化检测
+                    }
                 else:
-                    # 处理其他可能的文本部分，例如域名
-                    if 'host' not in current_detail or current_detail['host'] == 'N/A':
-                         current_detail['host'] = part
+                    print(f"IP 地理位置 API 返回状态: {data.get('status')}，IP: {data.get('query')}。消息: {data.get('message')}")
+        except requests.exceptions.RequestException as e:
+            GEO_API_ERRORS.inc(endpoint='batch')
+            print(f"批量获取 {len(chunk)} 个 IP 的位置时出错: {e}")
+        except (json.JSONDecodeError, ValueError):
+            GEO_API_ERRORS.inc(endpoint='batch')
+            print("解码批量 IP 位置的 JSON 响应时出错")
+    return locations
+
+def resolve_locations(ip_addresses):
+    """
+    批量解析一组 IP 的地理位置：去重并跳过非公网/无效 IP，
+    先查进程内缓存，再用一次 Redis MGET 读取剩余 IP，只对两级都未命中的 IP 调用批量接口，并通过 pipeline 写回缓存。
+    返回 {ip: 位置字典}。
+    """
+    unique_ips = []
+    seen = set()
+    for ip in ip_addresses:
+        if ip in seen:
+            continue
+        seen.add(ip)
+        if is_global(ip):
+            unique_ips.append(ip)
+
+    locations = {}
+    if not unique_ips:
+        return locations
+
+    if offline_geo_db is not None:
+        # 使用离线库时无需经过缓存
+        for ip in unique_ips:
+            location_data = offline_geo_db.lookup(ip)
+            if location_data:
+                locations[ip] = location_data
+        return locations
+
+    # 第一级: 进程内缓存
+    remaining = []
+    for ip in unique_ips:
+        cached_location = local_location_cache.get(ip)
+        if cached_location is MISSING:
+            remaining.append(ip)
+        elif cached_location:
+            locations[ip] = cached_location
+
+    # 第二级: Redis 缓存，一次 MGET 读取所有剩余 IP
+    misses = remaining
+    if redis_client and remaining:
+        try:
+            cached_values = redis_client.mget([f"ip_location:{ip}" for ip in remaining])
+            misses = []
+            hits = sum(1 for cached_data in cached_values if cached_data)
+            GEO_REDIS_LOOKUPS.inc(hits, result='hit')
+            GEO_REDIS_LOOKUPS.inc(len(remaining) - hits, result='miss')
+            for ip, cached_data in zip(remaining, cached_values):
+                if not cached_data:
+                    misses.append(ip)
+                    continue
+                location_data = decode_cached_location(cached_data)
+                local_location_cache.set(ip, location_data, ttl=None if location_data else GEO_NEGATIVE_CACHE_TTL)
+                if location_data:
+                    locations[ip] = location_data
+        except (redis.exceptions.RedisError, json.JSONDecodeError) as e:
+            if isinstance(e, redis.exceptions.RedisError):
+                REDIS_ERRORS.inc(operation='mget')
+            print(f"批量读取 Redis 缓存出错 ({e.__class__.__name__}): {e}")
+            misses = [ip for ip in remaining if ip not in locations]
+
+    if misses:
+        fetched = get_ip_locations_batch(misses)
+        locations.update(fetched)
+        pipe = redis_client.pipeline(transaction=False) if redis_client else None
+        for ip in misses:
+            # 查询失败的 IP 写入负缓存
+            store_location(ip, fetched.get(ip), pipe=pipe)
+        if pipe is not None:
+            try:
+                pipe.execute()
+            except redis.exceptions.RedisError as e:
+                REDIS_ERRORS.inc(operation='pipeline')
+                print(f"批量写入 Redis 缓存出错 ({e.__class__.__name__}): {e}")
+
+    print(f"本轮地理位置解析: {len(unique_ips)} 个公网 IP，进程内缓存命中 {len(unique_ips) - len(remaining)} 个，"
+          f"Redis 命中 {len(remaining) - len(misses)} 个，API 查询 {len(misses)} 个。进程内缓存统计: {local_location_cache.stats()}")
+    return locations
+
+def attach_locations(parsed_hops, locations):
+    """将 resolve_locations 的结果合并到解析后的跳点列表中，返回带地理位置的跳点列表"""
+    hops_with_location = []
+    for hop in parsed_hops:
+        hop_data = {'hop_number': hop['hop_number'], 'details': []}
+        for detail in hop['details']:
+            # 将详情与地理位置数据组合
+            combined_detail = detail.copy()
+            location_data = locations.get(detail.get('ip'))
+            if location_data:
+                combined_detail['location'] = location_data
+            hop_data['details'].append(combined_detail)
+        hops_with_location.append(hop_data)
+    return hops_with_location
+
+def save_ping_result(server_id, test_time, row, writer):
+    """写入线程中执行: 缓存一条 Ping 结果并累积汇总增量"""
+    row['target_server_id'] = server_id
+    row['test_time'] = test_time
+    writer.add(PingResult, row)
+    result_versions.touch('ping', server_id)
+    result_broadcaster.stage({
+        'type': 'ping',
+        'server_id': server_id,
+        'test_time': pytz.utc.localize(test_time).astimezone(APP_TIMEZONE).isoformat(),
+        'packet_loss_percent': row.get('packet_loss_percent'),
+        'min_rtt_ms': row.get('min_rtt_ms'),
+        'avg_rtt_ms': row.get('avg_rtt_ms'),
+        'max_rtt_ms': row.get('max_rtt_ms'),
+    })
+    writer.rollups.add(server_id, test_time, row.get('packet_loss_percent'),
+                       row.get('min_rtt_ms'), row.get('avg_rtt_ms'), row.get('max_rtt_ms'))
+
+def save_traceroute_result(server_id, hostname, output, hops_with_location, test_time, writer):
+    """写入线程中执行: 路径去重、路由变化检测后缓存一条 Traceroute 结果 (hops_with_location 为 None 表示测试失败)"""
+    row = {'target_server_id': server_id, 'test_time': test_time, 'raw_output': output}
+    event = None
+    if hops_with_location is not None:
+        # 相同路径只保存一次，结果中只记录路径ID和本次的逐跳 RTT
+        row['path_id'], row['hop_rtts'] = path_interner.intern(db.session, hops_with_location, test_time)
+        # 与该服务器上一次的路径比较，有变化时记录路由变化事件 (需在本次结果写入之前)
+        event = route_detector.observe(db.session, server_id, row['path_id'], hops_with_location, test_time)
+        if event is not None:
+            print(f"检测到 {hostname} 的路由变化: 路径 {event.old_path_id} -> {event.new_path_id}")
+    writer.add(TracerouteResult, row)
+    result_versions.touch('traceroute', server_id)
+    result_broadcaster.stage({
+        'type': 'traceroute',
+        'server_id': server_id,
+        'test_time': pytz.utc.localize(test_time).astimezone(APP_TIMEZONE).isoformat(),
+        'path_id': row.get('path_id'),
+        'hop_count': len(hops_with_location) if hops_with_location is not None else None,
+        'route_changed': event is not None,
+    })
 
+def save_probe_run(row, flush_seconds_before, writer):
+    """
+    写入线程中执行: 记录一轮探测的台账。
+    本任务排在该轮所有结果之后，先提交之前的结果，数据库写入耗时即为本轮开始以来写入线程的累计写入耗时。
+    """
+    writer.flush()
+    row['db_write_seconds'] = writer.total_time - flush_seconds_before
+    row['finished_at'] = datetime.utcnow()
+    writer.add(ProbeRun, row)
 
-                i += 1
+# 写入线程记录上一条按服务器调度台账时的累计写入耗时 (只在写入线程中访问)
+last_sweep_flush_seconds = 0.0
 
-            # 将当前跳的信息添加到 hops 列表中
-            # 由于一个跳可能有多个探测的延迟结果，我们将它们都添加到 details 中
-            hops.append({'hop_number': hop_number, 'details': details})
+def save_sweep_run(row, writer):
+    """
+    写入线程中执行: 记录按服务器调度时一轮的台账。
+    各轮的探测在时间上相互重叠，数据库写入耗时取上一轮台账写入以来写入线程的累计写入耗时。
+    """
+    global last_sweep_flush_seconds
+    save_probe_run(row, last_sweep_flush_seconds, writer)
+    last_sweep_flush_seconds = writer.total_time
+
+def slowest_probe_targets(timings):
+    """从 (key, test_type, 耗时秒数, 结果分类) 列表中取耗时最长的 RUN_LEDGER_SLOWEST_TARGETS 项，key 为 (服务器ID, 主机名)"""
+    return [
+        {'server_id': server_id, 'hostname': hostname, 'test_type': test_type, 'seconds': round(seconds, 3), 'outcome': outcome}
+        for (server_id, hostname), test_type, seconds, outcome
+        in heapq.nlargest(RUN_LEDGER_SLOWEST_TARGETS, timings, key=lambda timing: timing[2])
+    ]
+
+def queue_traceroutes(pending_traceroutes, stage_seconds=None):
+    """
+    批量解析一批 Traceroute 中出现的 IP 的地理位置，将结果交给写入线程。
+    传入 stage_seconds 字典时将地理位置解析耗时累加到其中的 'geo' 项。
+    """
+    start = time.perf_counter()
+    all_ips = [detail.get('ip') for _, _, _, parsed_hops, _ in pending_traceroutes for hop in parsed_hops for detail in hop['details']]
+    locations = resolve_locations(all_ips)
+    tasks = [
+        functools.partial(save_traceroute_result, server_id, hostname, output, attach_locations(parsed_hops, locations), test_time)
+        for server_id, hostname, output, parsed_hops, test_time in pending_traceroutes
+    ]
+    if stage_seconds is not None:
+        stage_seconds['geo'] += time.perf_counter() - start
+    for task in tasks:
+        result_queue.put(task)
+    pending_traceroutes.clear()
+
+def queue_probe_result(key, test_type, output, error, test_time, pending_traceroutes=None, stage_seconds=None):
+    """
+    处理一项探测结果并交给写入线程。key 为 (服务器ID, 主机名)。
+    传入 pending_traceroutes 列表时 Traceroute 结果先暂存其中，由调用方按批解析地理位置；否则立即解析。
+    传入 stage_seconds 字典时将解析和地理位置解析的耗时累加到其中的 'parse' 和 'geo' 项。
+    """
+    server_id, hostname = key
+    try:
+        if error is not None:
+            raise error
+
+        start = time.perf_counter()
+        if test_type == 'ping':
+            if isinstance(output, dict):
+                # 原生 ICMP 探测直接返回 PingResult 字段，无需解析文本
+                row = dict(output)
+            else:
+                # 解析 Ping 输出的结构化字段
+                row = {'raw_output': output, **ping_result_fields(output)}
+            if stage_seconds is not None:
+                stage_seconds['parse'] += time.perf_counter() - start
+            result_queue.put(functools.partial(save_ping_result, server_id, test_time, row))
+            print(f"完成 {test_type} 测试 for {hostname}，结果已加入写入队列。")
+
+        elif test_type == 'traceroute':
+            # 解析 Traceroute 输出并处理地理位置，保存到 TracerouteResult 表
+            if isinstance(output, dict):
+                # 流式 Traceroute 在读取时已经完成了解析
+                parsed_hops = output['hops']
+                output = output['raw_output']
+            else:
+                parsed_hops = parse_traceroute_output(output)
+            if stage_seconds is not None:
+                stage_seconds['parse'] += time.perf_counter() - start
+
+            if pending_traceroutes is not None:
+                pending_traceroutes.append((server_id, hostname, output, parsed_hops, test_time))
+            else:
+                queue_traceroutes([(server_id, hostname, output, parsed_hops, test_time)], stage_seconds)
 
-    return hops
+    except Exception as exc:
+        print(f'{hostname} 的 {test_type} 测试产生异常: {exc}')
+        # 处理异常: 根据测试类型创建包含错误消息的结果到对应的表中 (其他结构化字段为 None)
+        if test_type == 'ping':
+            result_queue.put(functools.partial(save_ping_result, server_id, test_time, {'raw_output': f"测试异常: {exc}"}))
+        elif test_type == 'traceroute':
+            result_queue.put(functools.partial(save_traceroute_result, server_id, hostname, f"测试异常: {exc}", None, test_time))
 
 def perform_tests():
-    """执行所有目标服务器的 Ping 和 Traceroute 测试并保存结果到新的表中"""
+    """执行所有目标服务器的 Ping 和 Traceroute 测试并保存结果到新的表中 (SCHEDULER_MODE=cycle 时使用)"""
     # 需要在应用上下文中执行数据库操作
     with app.app_context():
+        started_at = datetime.utcnow()
+        flush_seconds_before = result_queue.stats()['flush_seconds_total']
         servers = TargetServer.query.all()
         
-        # 使用线程池并发执行测试
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_server = {}
-            # 提交每个服务器的 ping 和 traceroute 任务
-            for server in servers:
-                ping_future = executor.submit(run_ping_test, server.hostname)
-                traceroute_future = executor.submit(run_traceroute_test, server.hostname)
-                future_to_server[ping_future] = (server, 'ping')
-                future_to_server[traceroute_future] = (server, 'traceroute')
-
-            # 处理已完成的任务结果
-            for future in as_completed(future_to_server):
-                server, test_type = future_to_server[future]
-                try:
-                    output = future.result()
-                    
-                    if test_type == 'ping':
-                        # 解析 Ping 输出并保存到 PingResult 表
-                        parsed_data = parse_ping_output(output)
-                        new_ping_result = PingResult( # 使用新的 PingResult 模型
-                            target_server_id=server.id,
-                            raw_output=output,
-                            packets_transmitted=parsed_data.get('packets_transmitted'),
-                            packets_received=parsed_data.get('packets_received'),
-                            # 将百分比字符串转换为浮点数（如果可能）
-                            packet_loss_percent=float(parsed_data.get('packet_loss', '0%').strip('%')) if 'packet_loss' in parsed_data and parsed_data['packet_loss'] != 'N/A' else None,
-                            # 将 RTT 字符串转换为浮点数（如果可能）
-                            min_rtt_ms=float(parsed_data.get('min_rtt', 'N/A').split(' ')[0]) if 'min_rtt' in parsed_data and parsed_data['min_rtt'] != 'N/A' else None,
-                            avg_rtt_ms=float(parsed_data.get('avg_rtt', 'N/A').split(' ')[0]) if 'avg_rtt' in parsed_data and parsed_data['avg_rtt'] != 'N/A' else None,
-                            max_rtt_ms=float(parsed_data.get('max_rtt', 'N/A').split(' ')[0]) if 'max_rtt' in parsed_data and parsed_data['max_rtt'] != 'N/A' else None
-                        )
-                        db.session.add(new_ping_result)
-                        print(f"完成 {test_type} 测试 for {server.hostname}，结果已保存到 PingResult。")
-
-                    elif test_type == 'traceroute':
-                        # 解析 Traceroute 输出并处理地理位置，保存到 TracerouteResult 表
-                        parsed_hops = parse_traceroute_output(output)
-                        hops_with_location = []
-                        
-                        # 使用另一个线程池或同步方式处理地理位置查询，调用缓存函数
-                        # 这里为简化，直接在当前循环中调用缓存函数（它内部会处理缓存和 API 调用）
-                        # 如果需要进一步优化 API 调用速率，可以在这里加入小的延时或更复杂的异步处理
-                        
-                        for hop in parsed_hops:
-                            hop_data = {'hop_number': hop['hop_number'], 'details': []}
-                            for detail in hop['details']:
-                                ip = detail.get('ip')
-                                location_data = None
-                                if ip and ip != 'N/A' and ip != '*':
-                                     # 调用缓存函数获取地理位置
-                                     # 注意：get_cached_or_fetch_location 内部已处理私有 IP 和 API 调用
-                                     location_data = get_cached_or_fetch_location(ip)
-
-                                # 将详情与地理位置数据组合
-                                combined_detail = detail.copy()
-                                if location_data:
-                                    combined_detail['location'] = location_data
-                                # else: # 如果没有获取到位置，保留原始 detail 或添加标识（is_private_ip 已在缓存函数内处理）
-                                     # if is_private_ip(ip): # 如果是私有 IP，可以显式添加标识，不过前端处理也行
-                                          # combined_detail['display_location'] = '局域网'
-                                
-                                hop_data['details'].append(combined_detail)
-                            hops_with_location.append(hop_data)
-                        
-                        new_traceroute_result = TracerouteResult( # 使用新的 TracerouteResult 模型
-                            target_server_id=server.id,
-                            raw_output=output,
-                            processed_hops_with_location=hops_with_location # 保存结构化数据
-                        )
-                        db.session.add(new_traceroute_result)
-                        print(f"完成 {test_type} 测试 for {server.hostname}，结果已保存到 TracerouteResult。")
-
-                except Exception as exc:
-                    print(f'{server.hostname} 的 {test_type} 测试产生异常: {exc}')
-                    # 处理异常: 根据测试类型创建包含错误消息的结果到对应的表中
-                    if test_type == 'ping':
-                        new_ping_result = PingResult(
-                            target_server_id=server.id,
-                            raw_output=f"测试异常: {exc}",
-                            # 其他结构化字段为 None
-                        )
-                        db.session.add(new_ping_result)
-                    elif test_type == 'traceroute':
-                         new_traceroute_result = TracerouteResult(
-                              target_server_id=server.id,
-                              raw_output=f"测试异常: {exc}",
-                              processed_hops_with_location=None # 错误时无结构化数据
-                         )
-                         db.session.add(new_traceroute_result)
-
-
-        # 提交所有测试结果到数据库
+        # 使用异步探测引擎并发执行测试，同时运行的子进程数量受 PROBE_CONCURRENCY 限制
+        # 任务键使用 (服务器ID, 主机名)，避免分批提交后访问已过期的 ORM 对象触发重新查询
+        tasks = []
+        for server in servers:
+            tasks.append(((server.id, server.hostname), 'ping', server.hostname))
+            tasks.append(((server.id, server.hostname), 'traceroute', server.hostname))
+        cycle = ProbeCycle(tasks, concurrency=PROBE_CONCURRENCY, runners=probe_runners)
+        # 等待批量解析地理位置的 Traceroute 结果: (服务器ID, 主机名, 原始输出, 解析后的跳点, 测试时间)
+        pending_traceroutes = []
+        # 解析和地理位置解析的累计耗时 (与探测并行进行)，以及每项探测的结果分类
+        stage_seconds = {'parse': 0.0, 'geo': 0.0}
+        outcomes = {}
+
+        # 按完成顺序处理测试结果
+        for key, test_type, output, error in cycle:
+            outcomes[(key, test_type)] = probe_outcome(output, error)
+            queue_probe_result(key, test_type, output, error, datetime.utcnow(), pending_traceroutes, stage_seconds)
+            # 地理位置按批统一解析
+            if len(pending_traceroutes) >= RESULT_FLUSH_BATCH_SIZE:
+                queue_traceroutes(pending_traceroutes, stage_seconds)
+
+        if pending_traceroutes:
+            queue_traceroutes(pending_traceroutes, stage_seconds)
+
+        # 本轮台账排在所有结果之后，由写入线程补上数据库写入耗时和结束时间
+        result_queue.put(functools.partial(save_probe_run, {
+            'started_at': started_at,
+            'scheduler_mode': 'cycle',
+            'server_count': len(servers),
+            'probe_count': len(tasks),
+            'failed_count': sum(1 for outcome in outcomes.values() if outcome == 'failed'),
+            'timeout_count': sum(1 for outcome in outcomes.values() if outcome == 'timeout'),
+            'probe_seconds': cycle.wall_time,
+            'parse_seconds': stage_seconds['parse'],
+            'geo_seconds': stage_seconds['geo'],
+            'slowest_targets': slowest_probe_targets(
+                [(key, test_type, seconds, outcomes.get((key, test_type))) for key, test_type, seconds in cycle.timings]),
+        }, flush_seconds_before))
+        stats = result_queue.stats()
+        print(f"所有测试任务完成，结果已交给写入线程。共 {len(tasks)} 项探测，本轮探测耗时 {cycle.wall_time:.2f} 秒 "
+              f"(其中解析 {stage_seconds['parse']:.2f} 秒，地理位置解析 {stage_seconds['geo']:.2f} 秒)。"
+              f"写入队列积压 {stats['queued']} 项，累计分 {stats['flushes']} 批写入 {stats['rows_written']} 条结果，"
+              f"写入耗时 {stats['flush_seconds_total']:.3f} 秒 (单批最长 {stats['flush_seconds_max']:.3f} 秒)。")
+        CYCLE_DURATION.observe(cycle.wall_time)
+        if cycle.wall_time > TEST_INTERVAL_SECONDS:
+            CYCLE_OVERRUNS.inc()
+            print(f"警告: 本轮探测耗时超过测试间隔 {TEST_INTERVAL_SECONDS} 秒，可调大 PROBE_CONCURRENCY。")
+
+def load_probe_targets():
+    """按服务器调度器的任务列表: 每台服务器的 Ping 和 Traceroute 及各自的间隔"""
+    with app.app_context():
+        targets = []
+        for server in TargetServer.query.all():
+            key = (server.id, server.hostname)
+            targets.append((key, 'ping', server.hostname, server.ping_interval_seconds or TEST_INTERVAL_SECONDS))
+            targets.append((key, 'traceroute', server.hostname, server.traceroute_interval_seconds or TEST_INTERVAL_SECONDS))
+        db.session.remove()
+        return targets
+
+def record_scheduler_run(test_type, seconds):
+    """记录按服务器调度时一次执行的耗时 (由调度器调用)"""
+    SCHEDULER_RUN_DURATION.observe(seconds, test_type=test_type)
+
+def record_scheduler_sweep(sweep):
+    """按服务器调度时一轮的探测全部结束后调用 (在调度器的线程池中执行): 记录耗时，并在该轮结果之后写入台账"""
+    SCHEDULER_SWEEP_DURATION.observe(sweep.duration)
+    outcomes = [outcome for _, _, _, outcome in sweep.timings]
+    result_queue.put(functools.partial(save_sweep_run, {
+        'started_at': sweep.started_at,
+        'scheduler_mode': 'per-server',
+        'server_count': len({key for key, _, _, _ in sweep.timings}),
+        'probe_count': len(sweep.timings),
+        'failed_count': outcomes.count('failed'),
+        'timeout_count': outcomes.count('timeout'),
+        'probe_seconds': sum(seconds for _, _, seconds, _ in sweep.timings),
+        'parse_seconds': sweep.stage_seconds['parse'],
+        'geo_seconds': sweep.stage_seconds['geo'],
+        'slowest_targets': slowest_probe_targets(sweep.timings),
+    }))
+
+# 按服务器分别调度的探测调度器 (SCHEDULER_MODE=per-server 时在 __main__ 中启动)，每 TEST_INTERVAL_SECONDS 秒统计一轮
+probe_scheduler = ProbeScheduler(
+    load_probe_targets, queue_probe_result, runners=probe_runners, concurrency=PROBE_CONCURRENCY,
+    jitter_fraction=SCHEDULER_JITTER, sync_interval=SCHEDULER_SYNC_SECONDS,
+    sweep_interval=TEST_INTERVAL_SECONDS, on_sweep=record_scheduler_sweep, observe_run=record_scheduler_run,
+)
+metrics.counter_callback('pting_scheduler_overlap_skipped_total', '上一次执行尚未结束而跳过的探测次数 (SCHEDULER_MODE=per-server)',
+                         lambda: {(): probe_scheduler.skipped})
+metrics.counter_callback('pting_scheduler_probes_started_total', '按服务器调度器已开始执行的探测次数',
+                         lambda: {(): probe_scheduler.started})
+metrics.gauge_callback('pting_scheduler_lag_seconds', '按服务器调度器的调度延迟 (计划时间到实际开始执行的秒数)',
+                       lambda: {(stat,): probe_scheduler.stats()[f'lag_seconds_{stat}'] for stat in ('last', 'max', 'avg')},
+                       ['stat'])
+metrics.gauge_callback('pting_scheduler_probes', '按服务器调度器中正在执行和等待并发名额的探测数',
+                       lambda: {(state,): probe_scheduler.stats()[state] for state in ('running', 'waiting')}, ['state'])
+
+@app.cli.command('build-geo-db')
+@click.argument('csv_path')
+@click.argument('output_path', required=False)
+def build_geo_db_command(csv_path, output_path):
+    """将区间格式的 CSV (起始IP,结束IP,国家,城市,纬度,经度) 编译为离线地理位置库"""
+    output_path = output_path or GEO_OFFLINE_DB_PATH
+    v4_count, v6_count, record_count = build_database(csv_path, output_path)
+    print(f"已生成离线地理位置库 {output_path}: IPv4 区间 {v4_count} 个，IPv6 区间 {v6_count} 个，位置记录 {record_count} 条。")
+
+@app.cli.command('backfill-rollups')
+@click.option('--batch-size', default=5000, show_default=True, help='每批读取的 PingResult 行数')
+def backfill_rollups_command(batch_size):
+    """根据已有的 PingResult 重建分钟/小时/天汇总表 (会先清空汇总表，建议在调度器停止时执行)"""
+    deleted = PingRollup.query.delete()
+    print(f"已清空 {deleted} 条汇总记录，开始回填...")
+    rollups = PingRollupAccumulator()
+    processed = 0
+    query = db.session.query(
+        PingResult.target_server_id, PingResult.test_time, PingResult.packet_loss_percent,
+        PingResult.min_rtt_ms, PingResult.avg_rtt_ms, PingResult.max_rtt_ms
+    ).order_by(PingResult.id).execution_options(yield_per=batch_size)
+    for row in query:
+        rollups.add(*row)
+        processed += 1
+        if processed % batch_size == 0:
+            # 分批写入，避免累积器占用过多内存
+            rollups.flush(db.session)
+            db.session.flush()
+            print(f"已处理 {processed} 条 Ping 结果...")
+    rollups.flush(db.session)
+    db.session.commit()
+    print(f"回填完成，共处理 {processed} 条 Ping 结果。")
+
+def run_retention_job():
+    """按保留策略分批清理过期数据"""
+    with app.app_context():
+        start = time.monotonic()
+        try:
+            counts = run_retention(db.session, retention_policies, batch_size=RETENTION_BATCH_SIZE)
+        except Exception as e:
+            db.session.rollback()
+            print(f"数据保留清理失败: {e}")
+            return
+        if any(counts.values()):
+            invalidate_results_cache()
+        summary = ', '.join(f"{name}: {count}" for name, count in counts.items())
+        print(f"数据保留清理完成，耗时 {time.monotonic() - start:.2f} 秒 ({summary})。")
+
+@app.cli.command('retention')
+@click.option('--compact', is_flag=True, help='将迁移前写入的未压缩原始输出改写为压缩格式')
+@click.option('--vacuum', is_flag=True, help='清理后执行 VACUUM 回收磁盘空间 (仅 SQLite，会锁库)')
+def retention_command(compact, vacuum):
+    """立即按保留策略清理过期数据"""
+    if any(policy.enabled for policy in retention_policies):
+        run_retention_job()
+    else:
+        print("未配置任何保留策略 (RETENTION_*_DAYS)，跳过清理。")
+    if compact:
+        rewritten = compact_legacy_rows(db.session, PingResult, ['raw_output'], batch_size=RETENTION_BATCH_SIZE)
+        rewritten += compact_legacy_rows(db.session, TracerouteResult, ['raw_output', 'processed_hops_with_location'],
+                                         batch_size=RETENTION_BATCH_SIZE)
+        print(f"已将 {rewritten} 条旧数据改写为压缩格式。")
+    if vacuum:
+        if db.engine.dialect.name != 'sqlite':
+            print("VACUUM 仅支持 SQLite，已跳过。")
+        else:
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.exec_driver_sql('VACUUM')
+            print("VACUUM 完成。")
+
+@app.cli.command('backfill-legacy-results')
+@click.option('--batch-size', default=1000, show_default=True, help='每批读取并提交的 TestResult 行数')
+@click.option('--restart', is_flag=True, help='忽略已记录的进度，从头开始 (已转换的结果会被跳过)')
+def backfill_legacy_results_command(batch_size, restart):
+    """将旧的 TestResult 结果转换为 PingResult / TracerouteResult，可中断后继续"""
+    progress = db.session.get(BackfillProgress, LEGACY_BACKFILL_NAME)
+    if progress is not None and progress.last_id and not restart:
+        print(f"从上次的进度继续 (已处理到 ID {progress.last_id}，共 {progress.processed} 条)...")
+    progress = backfill_legacy_results(
+        db.session, db.engine, batch_size=batch_size, restart=restart,
+        report=lambda progress: print(f"已处理 {progress.processed} 条 (ID {progress.last_id})，写入 {progress.written} 条，跳过 {progress.skipped} 条..."),
+    )
+    invalidate_results_cache()
+    print(f"回填完成，共处理 {progress.processed} 条旧结果，写入 {progress.written} 条，跳过 {progress.skipped} 条。")
+
+@app.cli.command('intern-paths')
+@click.option('--batch-size', default=500, show_default=True, help='每批转换的 TracerouteResult 行数')
+def intern_paths_command(batch_size):
+    """将路径去重之前保存完整跳点的 Traceroute 结果转换为路径ID + 逐跳 RTT"""
+    interner = PathInterner()
+    converted = 0
+    while True:
+        results = TracerouteResult.query.filter(
+            TracerouteResult.path_id.is_(None),
+            TracerouteResult.processed_hops_with_location.isnot(None),
+        ).order_by(TracerouteResult.id).limit(batch_size).all()
+        if not results:
+            break
+        for result in results:
+            result.path_id, result.hop_rtts = interner.intern(db.session, result.processed_hops_with_location, result.test_time)
+            result.processed_hops_with_location = None
         db.session.commit()
-        print("所有测试任务完成并保存结果。")
+        converted += len(results)
+        print(f"已转换 {converted} 条 Traceroute 结果...")
+    if converted:
+        invalidate_results_cache()
+    print(f"转换完成，共 {converted} 条 Traceroute 结果，{TraceroutePath.query.count()} 条不同路径。")
 
 # 初始化 APScheduler
 scheduler = BackgroundScheduler()
+# 任务因上一次执行尚未结束而被跳过时计数
+scheduler.add_listener(lambda event: CYCLE_SKIPPED.inc() if event.job_id == 'perform_tests' else None, EVENT_JOB_MAX_INSTANCES)
 
 # 配置周期性任务 (任务将在调度器启动时添加)
 # 我们将调度器启动逻辑移到 __main__ 块中，以防止在调试模式下重复启动。
@@ -808,8 +1466,19 @@ if __name__ == '__main__':
         # 配置周期性任务
         # 在添加任务前检查任务是否已存在 (在某些场景下 main 块可能多次执行)
         if not scheduler.get_jobs():
-             scheduler.add_job(func=perform_tests, trigger="interval", seconds=TEST_INTERVAL_SECONDS)
-             print(f"定时任务 '{perform_tests.__name__}' 已添加到调度器，间隔 {TEST_INTERVAL_SECONDS} 秒。") # 添加打印确认任务已添加
+             if SCHEDULER_MODE == 'cycle':
+                 # 上一轮尚未结束时跳过本轮，错过的多次执行合并为一次
+                 scheduler.add_job(func=perform_tests, trigger="interval", seconds=TEST_INTERVAL_SECONDS,
+                                   max_instances=1, coalesce=True, id='perform_tests')
+                 print(f"定时任务 '{perform_tests.__name__}' 已添加到调度器，间隔 {TEST_INTERVAL_SECONDS} 秒。") # 添加打印确认任务已添加
+             else:
+                 probe_scheduler.start()
+                 atexit.register(probe_scheduler.stop)
+                 print(f"按服务器调度的探测调度器已启动，默认间隔 {TEST_INTERVAL_SECONDS} 秒。")
+             if any(policy.enabled for policy in retention_policies):
+                 scheduler.add_job(func=run_retention_job, trigger="interval", seconds=RETENTION_INTERVAL_SECONDS,
+                                   max_instances=1, coalesce=True)
+                 print(f"数据保留清理任务已添加到调度器，间隔 {RETENTION_INTERVAL_SECONDS} 秒。")
 
         # 启动调度器
         if not scheduler.running:
@@ -0,0 +1,187 @@
+"""
+/api/results 响应路径的基准测试: 每页响应的字节数和耗时。
+
+在临时 SQLite 数据库中通过写入线程写入合成的 Ping / Traceroute 结果 (原始输出取自 benchmarks/corpus，
+Traceroute 带有合成的地理位置)，然后用 Flask 测试客户端请求结果接口，比较以下几种响应方式:
+
+    baseline   标准库 json、逐条换算时区、全部字段、不压缩 (优化前的响应方式)
+    fast       orjson (已安装时)、整页换算一次时区、全部字段、不压缩
+    fast+gzip  同上，gzip 压缩
+    fast+br    同上，brotli 压缩 (已安装 brotli 时)
+    list+gzip  报表页实际请求的字段 (不含 raw_output)，gzip 压缩
+
+每次请求前清空响应缓存，测量的是缓存未命中时生成一页的耗时:
+
+    python benchmarks/bench_api.py
+    python benchmarks/bench_api.py --servers 20 --results 500 --per-page 10,100 --requests 200
+    python benchmarks/bench_api.py --record benchmarks/results/api.jsonl
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_DIR = os.path.join(ROOT, 'benchmarks', 'corpus')
+# 报表页 (static/js/reports.js) 列表请求的字段
+LIST_FIELDS = {
+    'ping': 'id,test_time,server_hostname,server_description,packet_loss_percent,min_rtt_ms,avg_rtt_ms,max_rtt_ms',
+    'traceroute': 'id,test_time,path_id,processed_hops',
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_corpus(name):
+    with open(os.path.join(CORPUS_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def populate(bench_app, servers, results_per_server):
+    """写入 servers 台服务器，每台 results_per_server 条 Ping 和 Traceroute 结果 (经写入线程，与实际写入路径相同)"""
+    with bench_app.app.app_context():
+        bench_app.db.drop_all()
+        bench_app.db.create_all()
+        bench_app.db.session.execute(
+            bench_app.TargetServer.__table__.insert(),
+            [{'hostname': f"target-{i}.bench.example", 'description': 'benchmark'} for i in range(servers)],
+        )
+        bench_app.db.session.commit()
+        server_ids = [server.id for server in bench_app.TargetServer.query.order_by(bench_app.TargetServer.id)]
+
+    ping_output = read_corpus('ping_iputils.txt')
+    ping_row = bench_app.ping_result_fields(ping_output)
+    traceroute_output = read_corpus('traceroute_linux_names.txt')
+    parsed_hops = bench_app.parse_traceroute_output(traceroute_output)
+    rng = random.Random(1)
+    start = datetime.utcnow() - timedelta(minutes=results_per_server)
+    for index in range(results_per_server):
+        test_time = start + timedelta(minutes=index)
+        for server_id in server_ids:
+            # 每台服务器在几条路径之间切换，地理位置按 IP 合成
+            variant = rng.randrange(3)
+            locations = {
+                detail.get('ip'): {'country': 'Testland', 'city': f"Bench-{variant}", 'lat': 30.0 + variant, 'lon': 120.0,
+                                   'asn': f"AS{64512 + variant} Bench Net"}
+                for hop in parsed_hops for detail in hop['details'] if detail.get('ip')
+            }
+            row = dict(ping_row, raw_output=ping_output)
+            bench_app.result_queue.put(functools.partial(bench_app.save_ping_result, server_id, test_time, row))
+            bench_app.result_queue.put(functools.partial(
+                bench_app.save_traceroute_result, server_id, f"target-{server_id}", traceroute_output,
+                bench_app.attach_locations(parsed_hops, locations), test_time))
+    bench_app.result_queue.join()
+    return server_ids
+
+
+def measure(bench_app, client, url, headers, requests):
+    """请求 url requests 次 (每次前清空响应缓存)，返回 (响应字节数, 每次毫秒数)"""
+    size = None
+    started = time.perf_counter()
+    for _ in range(requests):
+        bench_app.results_response_cache.clear()
+        response = client.get(url, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} 返回 {response.status_code}")
+        size = len(response.data)
+    return size, (time.perf_counter() - started) / requests * 1000
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--servers', type=int, default=20, help='合成的目标服务器数量')
+    arg_parser.add_argument('--results', type=int, default=200, help='每台服务器每种类型的结果数')
+    arg_parser.add_argument('--per-page', default='10,100', help='以逗号分隔的每页条数')
+    arg_parser.add_argument('--requests', type=int, default=100, help='每种方式的请求次数')
+    arg_parser.add_argument('--record', help='将结果追加到该 JSON Lines 文件')
+    args = arg_parser.parse_args()
+    page_sizes = [int(size) for size in args.per_page.split(',') if size.strip()]
+
+    work_dir = tempfile.mkdtemp(prefix='bench-api-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    # 非 UTC 时区，时区换算的开销与实际部署一致
+    os.environ.setdefault('TIMEZONE', 'Asia/Shanghai')
+    sys.path.insert(0, ROOT)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as bench_app
+    from flask.json.provider import DefaultJSONProvider
+    import response_encoding
+
+    class PerRowTimeFormatter(response_encoding.LocalTimeFormatter):
+        """优化前的时区换算: 逐条换算"""
+        def __init__(self, tz, times):
+            super().__init__(tz, [])
+
+    fast_json, per_page_formatter = bench_app.app.json, bench_app.LocalTimeFormatter
+    variants = [
+        ('baseline', DefaultJSONProvider(bench_app.app), PerRowTimeFormatter, False, None),
+        ('fast', fast_json, per_page_formatter, False, None),
+        ('fast+gzip', fast_json, per_page_formatter, False, 'gzip'),
+    ]
+    if 'br' in response_encoding.AVAILABLE_ENCODINGS:
+        variants.append(('fast+br', fast_json, per_page_formatter, False, 'br'))
+    variants.append(('list+gzip', fast_json, per_page_formatter, True, 'gzip'))
+
+    results = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            server_ids = populate(bench_app, args.servers, args.results)
+        client = bench_app.app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['authenticated'] = True
+
+        print(f"{args.servers} 台服务器，每台每种类型 {args.results} 条结果，JSON: {response_encoding.JSON_BACKEND}，"
+              f"压缩: {', '.join(response_encoding.AVAILABLE_ENCODINGS)}，时区: {bench_app.APP_TIMEZONE}")
+        print(f"{'类型':<10} {'每页':>4} {'方式':<10} {'字节':>9} {'毫秒/页':>8} {'字节比':>7} {'耗时比':>7}")
+        for test_type in ('ping', 'traceroute'):
+            for per_page in page_sizes:
+                baseline = None
+                for name, json_provider, formatter, projected, encoding in variants:
+                    bench_app.app.json = json_provider
+                    bench_app.LocalTimeFormatter = formatter
+                    bench_app.RESPONSE_COMPRESSION = encoding is not None
+                    url = f"/api/results/{server_ids[0]}/{test_type}?per_page={per_page}"
+                    if projected:
+                        url += f"&fields={LIST_FIELDS[test_type]}"
+                    headers = {'Accept-Encoding': encoding} if encoding else {}
+                    size, ms = measure(bench_app, client, url, headers, args.requests)
+                    baseline = baseline or (size, ms)
+                    results.append({'test_type': test_type, 'per_page': per_page, 'variant': name, 'bytes': size, 'ms': ms})
+                    print(f"{test_type:<12} {per_page:>6} {name:<12} {size:>9} {ms:>10.2f} "
+                          f"{baseline[0] / size:>8.1f}x {baseline[1] / ms:>8.2f}x")
+    finally:
+        bench_app.app.json, bench_app.LocalTimeFormatter = fast_json, per_page_formatter
+        bench_app.result_queue.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.record:
+        os.makedirs(os.path.dirname(os.path.abspath(args.record)), exist_ok=True)
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'time': datetime.utcnow().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'json_backend': response_encoding.JSON_BACKEND,
+                'options': {key: value for key, value in vars(args).items() if key != 'record'},
+                'results': results,
+            }, ensure_ascii=False) + '\n')
+        print(f"结果已追加到 {args.record}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+完整探测周期 (perform_tests) 的端到端基准测试。
+
+在临时 SQLite 数据库中创建 N 台合成的 TargetServer，用 benchmarks/fakebin 下的 ping/traceroute 替身代替真实命令，
+并在本地启动 ip-api 批量接口的替身和 fakeredis (未安装时使用 --redis 指定的本地 Redis，或不使用 Redis)，
+对每个规模运行若干轮 perform_tests，报告本轮耗时、每秒探测数、每轮地理位置查询数和数据库写入耗时:
+
+    python benchmarks/bench_cycle.py
+    python benchmarks/bench_cycle.py --sizes 100,1000 --cycles 3 --probe-delay 0.2 --concurrency 100
+    python benchmarks/bench_cycle.py --record benchmarks/results/cycle.jsonl
+
+每个规模的第一轮地理位置缓存为空 (冷启动)，之后各轮可以命中进程内缓存和 Redis。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKEBIN_DIR = os.path.join(ROOT, 'benchmarks', 'fakebin')
+
+
+class FakeGeoHandler(BaseHTTPRequestHandler):
+    """ip-api.com 批量接口的替身: 对每个查询返回固定的成功结果，并统计请求数和查询的 IP 数"""
+    requests = 0
+    queried_ips = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'[]')
+        with self.lock:
+            FakeGeoHandler.requests += 1
+            FakeGeoHandler.queried_ips += len(payload)
+        body = json.dumps([
+            {'status': 'success', 'query': item['query'], 'country': 'Testland', 'city': 'Bench',
+             'lat': 0.0, 'lon': 0.0, 'as': f"AS{64512 + sum(map(ord, item['query'])) % 1000} Bench Net"}
+            for item in payload
+        ]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.requests = 0
+            cls.queried_ips = 0
+
+
+def start_fake_geo_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGeoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_redis_client(redis_url):
+    """优先使用 fakeredis；未安装时使用 redis_url 指定的 Redis (为空则不使用 Redis)"""
+    try:
+        import fakeredis
+        return fakeredis.FakeStrictRedis(decode_responses=True), 'fakeredis'
+    except ImportError:
+        pass
+    if not redis_url:
+        return None, 'none'
+    import redis
+    client = redis.StrictRedis.from_url(redis_url, decode_responses=True)
+    client.ping()
+    return client, redis_url
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_environment(args, work_dir, geo_url):
+    """在导入 app 之前设置配置: 临时数据库、替身命令、本地地理位置接口"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ['PATH'] = FAKEBIN_DIR + os.pathsep + os.environ.get('PATH', '')
+    os.environ['IP_API_BATCH_URL'] = geo_url
+    os.environ['GEO_PROVIDER'] = 'ip-api'
+    os.environ['PING_BACKEND'] = 'subprocess'
+    os.environ['SCHEDULER_MODE'] = 'cycle'
+    os.environ['PROBE_CONCURRENCY'] = str(args.concurrency)
+    os.environ['BENCH_PROBE_DELAY'] = str(args.probe_delay)
+    os.environ['BENCH_TRACEROUTE_HOPS'] = str(args.hops)
+    os.environ['BENCH_IP_POOL'] = str(args.ip_pool)
+    os.environ['BENCH_PING_LOSS'] = str(args.loss)
+
+
+def reset_database(bench_app, size):
+    """重建表结构并写入 size 台合成服务器"""
+    with bench_app.app.app_context():
+        bench_app.db.drop_all()
+        bench_app.db.create_all()
+        bench_app.db.session.execute(
+            bench_app.TargetServer.__table__.insert(),
+            [{'hostname': f"target-{i}.bench.example", 'description': 'benchmark'} for i in range(size)],
+        )
+        bench_app.db.session.commit()
+    bench_app.reset_result_state()
+    bench_app.local_location_cache.clear()
+    if bench_app.redis_client is not None:
+        bench_app.redis_client.flushdb()
+
+
+def run_cycle(bench_app, verbose):
+    """执行一轮 perform_tests 并等待写入线程完成，返回本轮的统计"""
+    FakeGeoHandler.reset()
+    before = bench_app.result_queue.stats()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with output:
+        bench_app.perform_tests()
+        probes_done = time.perf_counter()
+        bench_app.result_queue.join()
+    finished = time.perf_counter()
+    after = bench_app.result_queue.stats()
+    return {
+        'probe_seconds': probes_done - started,
+        'cycle_seconds': finished - started,
+        'geo_requests': FakeGeoHandler.requests,
+        'geo_ips': FakeGeoHandler.queried_ips,
+        'db_flushes': after['flushes'] - before['flushes'],
+        'db_rows': after['rows_written'] - before['rows_written'],
+        'db_write_seconds': after['flush_seconds_total'] - before['flush_seconds_total'],
+        'db_flush_seconds_max': after['flush_seconds_max'],
+        'tasks_failed': after['tasks_failed'] - before['tasks_failed'],
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--sizes', default='100,1000,10000', help='以逗号分隔的目标服务器数量')
+    arg_parser.add_argument('--cycles', type=int, default=2, help='每个规模运行的轮数 (第一轮为冷缓存)')
+    arg_parser.add_argument('--concurrency', type=int, default=50, help='PROBE_CONCURRENCY')
+    arg_parser.add_argument('--probe-delay', type=float, default=0.05, help='替身命令每次探测的耗时 (秒)')
+    arg_parser.add_argument('--hops', type=int, default=10, help='替身 traceroute 输出的跳数')
+    arg_parser.add_argument('--ip-pool', type=int, default=5000, help='替身 traceroute 使用的公网地址池大小')
+    arg_parser.add_argument('--loss', type=int, default=0, help='替身 ping 整体丢包的百分比概率')
+    arg_parser.add_argument('--redis', default='', help='未安装 fakeredis 时使用的 Redis URL，例如 redis://localhost:6379/15')
+    arg_parser.add_argument('--record', help='将结果追加到该 JSON Lines 文件')
+    arg_parser.add_argument('--verbose', action='store_true', help='显示 perform_tests 的逐项输出')
+    args = arg_parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+
+    work_dir = tempfile.mkdtemp(prefix='bench-cycle-')
+    geo_server = start_fake_geo_server()
+    prepare_environment(args, work_dir, f"http://127.0.0.1:{geo_server.server_port}/batch")
+    sys.path.insert(0, ROOT)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as bench_app
+    bench_app.redis_client, redis_backend = make_redis_client(args.redis)
+
+    print(f"并发 {args.concurrency}，替身探测耗时 {args.probe_delay} 秒，{args.hops} 跳，地址池 {args.ip_pool}，"
+          f"Redis: {redis_backend}，测试间隔 {bench_app.TEST_INTERVAL_SECONDS} 秒")
+    print(f"{'目标数':>7} {'轮次':>4} {'本轮耗时':>9} {'探测/秒':>9} {'地理请求':>8} {'查询IP':>7} "
+          f"{'写入批次':>8} {'写入行数':>8} {'写入耗时':>9}")
+    results = []
+    try:
+        for size in sizes:
+            reset_database(bench_app, size)
+            for cycle_number in range(1, args.cycles + 1):
+                stats = run_cycle(bench_app, args.verbose)
+                stats.update({'targets': size, 'cycle': cycle_number, 'probes_per_second': 2 * size / stats['cycle_seconds']})
+                results.append(stats)
+                warning = '  超过测试间隔' if stats['cycle_seconds'] > bench_app.TEST_INTERVAL_SECONDS else ''
+                print(f"{size:>10} {cycle_number:>6} {stats['cycle_seconds']:>11.2f}s {stats['probes_per_second']:>11.1f} "
+                      f"{stats['geo_requests']:>12} {stats['geo_ips']:>10} {stats['db_flushes']:>12} {stats['db_rows']:>12} "
+                      f"{stats['db_write_seconds']:>12.3f}s{warning}")
+                if stats['tasks_failed']:
+                    print(f"    警告: {stats['tasks_failed']} 个写入任务失败")
+    finally:
+        bench_app.result_queue.stop()
+        geo_server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.record:
+        os.makedirs(os.path.dirname(os.path.abspath(args.record)), exist_ok=True)
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'time': datetime.utcnow().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'options': {key: value for key, value in vars(args).items() if key not in ('record', 'verbose')},
+                'redis': redis_backend,
+                'results': results,
+            }, ensure_ascii=False) + '\n')
+        print(f"结果已追加到 {args.record}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Ping / Traceroute 解析器吞吐量基准测试。
+
+对 benchmarks/corpus 下的样本输出 (ping_*.txt 和 traceroute_*.txt) 重复调用解析函数，
+打印每个样本的单次解析耗时和总体吞吐量。指定 --record 时将结果追加到 JSON Lines 文件，便于跟踪变化:
+
+    python benchmarks/bench_parsers.py
+    python benchmarks/bench_parsers.py --iterations 20000 --record benchmarks/results/parsers.jsonl
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import timeit
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parsers import parse_ping_output, parse_traceroute_output  # noqa: E402
+
+CORPUS_DIR = os.path.join(ROOT, 'benchmarks', 'corpus')
+PARSERS = {
+    'ping': parse_ping_output,
+    'traceroute': parse_traceroute_output,
+}
+
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    """返回 [(样本名, 解析器类型, 输出文本)]，按文件名排序"""
+    samples = []
+    for name in sorted(os.listdir(corpus_dir)):
+        kind = name.split('_', 1)[0]
+        if kind in PARSERS and name.endswith('.txt'):
+            with open(os.path.join(corpus_dir, name), encoding='utf-8') as f:
+                samples.append((name, kind, f.read()))
+    return samples
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(iterations, repeat):
+    results = {}
+    for name, kind, output in load_corpus():
+        parser = PARSERS[kind]
+        # 取多次重复中的最小值，减少其他进程造成的干扰
+        best = min(timeit.repeat(lambda: parser(output), number=iterations, repeat=repeat))
+        results[name] = {'kind': kind, 'us_per_parse': best / iterations * 1e6, 'lines': output.count('\n')}
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--iterations', type=int, default=5000, help='每次计时中每个样本的解析次数')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='计时重复次数，取最小值')
+    arg_parser.add_argument('--record', help='将结果追加到该 JSON Lines 文件')
+    args = arg_parser.parse_args()
+
+    results = run(args.iterations, args.repeat)
+    totals = {}
+    for name, result in results.items():
+        print(f"{name:36s} {result['us_per_parse']:9.2f} us/次  {result['lines'] / result['us_per_parse'] * 1e6:12.0f} 行/秒")
+        total = totals.setdefault(result['kind'], [0.0, 0])
+        total[0] += result['us_per_parse']
+        total[1] += 1
+    summary = {kind: count / (us * 1e-6) for kind, (us, count) in totals.items()}
+    for kind, per_second in summary.items():
+        print(f"{kind}: {per_second:,.0f} 次/秒 (样本平均)")
+
+    if args.record:
+        os.makedirs(os.path.dirname(os.path.abspath(args.record)), exist_ok=True)
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'time': datetime.utcnow().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'iterations': args.iterations,
+                'per_second': summary,
+                'samples': results,
+            }, ensure_ascii=False) + '\n')
+        print(f"结果已追加到 {args.record}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import json
+import zlib
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+# 压缩数据的前缀。旧的未压缩文本中不会出现 NUL 字节，可以据此区分压缩数据与旧数据
+COMPRESSED_PREFIX = b'\x00Z'
+# 短于该长度的数据压缩收益很小，直接以 UTF-8 字节保存
+MIN_COMPRESS_SIZE = 64
+COMPRESSION_LEVEL = 6
+
+
+def compress_text(text):
+    """将字符串编码为字节，足够长且压缩后更小时使用 zlib 压缩"""
+    data = text.encode('utf-8')
+    if len(data) >= MIN_COMPRESS_SIZE:
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        if len(compressed) + len(COMPRESSED_PREFIX) < len(data):
+            return COMPRESSED_PREFIX + compressed
+    return data
+
+
+def decompress_text(value):
+    """
+    还原 compress_text 保存的数据。
+    迁移前写入的旧数据可能以字符串 (SQLite 中的 TEXT) 或未压缩的字节形式返回，都原样解码。
+    """
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value.startswith(COMPRESSED_PREFIX):
+        value = zlib.decompress(value[len(COMPRESSED_PREFIX):])
+    return value.decode('utf-8')
+
+
+class CompressedText(TypeDecorator):
+    """以 zlib 压缩的二进制形式存储文本，读写时对模型透明"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_text(value)
+
+
+class CompressedJSON(TypeDecorator):
+    """以 zlib 压缩的 JSON 存储结构化数据，读写时对模型透明"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return json.loads(decompress_text(value))
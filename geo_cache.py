@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+# 缓存未命中时 get() 返回的哨兵对象，用来与负缓存 (值为 None) 区分
+MISSING = object()
+
+
+class TTLLRUCache:
+    """
+    进程内有容量上限的 TTL/LRU 缓存，线程安全。
+    值为 None 的条目表示负缓存 (最近查询失败)，通常使用更短的 TTL。
+    记录命中、未命中、淘汰和过期次数，可通过 stats() 读取。
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """返回缓存的值 (负缓存为 None)，未命中或已过期时返回 MISSING"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """写入缓存，ttl 为空时使用默认 TTL；超出容量时淘汰最久未使用的条目"""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """返回缓存计数器的快照"""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,213 @@
+import bisect
+import csv
+import functools
+import ipaddress
+import json
+import mmap
+import socket
+import struct
+import sys
+from array import array
+
+# 离线地理位置库文件格式:
+#   头部 '<8sIIII': 魔数, IPv4 区间数, IPv6 区间数, 位置记录数, 记录数据长度
+#   IPv4 区间起点/终点/记录序号 (各为 uint32 数组，小端)
+#   IPv4 一级索引 (uint32 数组，65537 项): 第 p 项为起点 >= p << 16 的第一个区间序号，用于缩小二分查找范围
+#   IPv6 区间起点/终点 (各为 16 字节大端整数) 和记录序号 (uint32 数组)
+#   位置记录偏移 (uint32 数组，记录数 + 1 项) 和 JSON 编码的位置记录数据
+# 所有区间按起点升序排列且互不重叠，查询时对起点数组做二分查找。
+MAGIC = b'PTGEO001'
+HEADER = struct.Struct('<8sIIII')
+IPV4_MAX = 0xFFFFFFFF
+# IPv4 一级索引按地址高 16 位划分
+PREFIX_SHIFT = 16
+PREFIX_COUNT = (IPV4_MAX >> PREFIX_SHIFT) + 2
+
+
+def _parse_ip(value):
+    """将 CSV 中的 IP 字段 (点分/冒号格式或整数) 转换为 ipaddress 对象"""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return ipaddress.IPv4Address(number) if number <= IPV4_MAX else ipaddress.IPv6Address(number)
+    return ipaddress.ip_address(value)
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _uint32_array(values):
+    """构造小端 uint32 数组"""
+    result = array('I', values)
+    if result.itemsize != 4:
+        result = array('L', values)
+    if sys.byteorder != 'little':
+        result.byteswap()
+    return result
+
+
+def build_database(csv_path, output_path):
+    """
+    将区间格式的 CSV 编译为离线地理位置库文件。
+    CSV 每行: 起始IP,结束IP,国家,城市,纬度,经度 (后四列可以为空)，IP 可以是点分/冒号格式或整数。
+    返回 (IPv4 区间数, IPv6 区间数, 位置记录数)。
+    """
+    ranges_v4 = []
+    ranges_v6 = []
+    record_index = {}
+    records = []
+
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].startswith('#'):
+                continue
+            try:
+                start = _parse_ip(row[0])
+                end = _parse_ip(row[1])
+            except ValueError:
+                # 跳过表头或格式错误的行
+                continue
+            if start.version != end.version or int(end) < int(start):
+                continue
+            location = {
+                'country': row[2] if len(row) > 2 and row[2] else None,
+                'city': row[3] if len(row) > 3 and row[3] else None,
+                'lat': _parse_float(row[4]) if len(row) > 4 else None,
+                'lon': _parse_float(row[5]) if len(row) > 5 else None,
+            }
+            key = (location['country'], location['city'], location['lat'], location['lon'])
+            if key not in record_index:
+                record_index[key] = len(records)
+                records.append(location)
+            target = ranges_v4 if start.version == 4 else ranges_v6
+            target.append((int(start), int(end), record_index[key]))
+
+    ranges_v4.sort()
+    ranges_v6.sort()
+
+    blob = bytearray()
+    offsets = [0]
+    for location in records:
+        blob += json.dumps(location, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        offsets.append(len(blob))
+
+    with open(output_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(ranges_v4), len(ranges_v6), len(records), len(blob)))
+        f.write(_uint32_array(r[0] for r in ranges_v4).tobytes())
+        f.write(_uint32_array(r[1] for r in ranges_v4).tobytes())
+        f.write(_uint32_array(r[2] for r in ranges_v4).tobytes())
+        v4_starts = [r[0] for r in ranges_v4]
+        f.write(_uint32_array(bisect.bisect_left(v4_starts, p << PREFIX_SHIFT) for p in range(PREFIX_COUNT)).tobytes())
+        f.write(b''.join(r[0].to_bytes(16, 'big') for r in ranges_v6))
+        f.write(b''.join(r[1].to_bytes(16, 'big') for r in ranges_v6))
+        f.write(_uint32_array(r[2] for r in ranges_v6).tobytes())
+        f.write(_uint32_array(offsets).tobytes())
+        f.write(bytes(blob))
+
+    return len(ranges_v4), len(ranges_v6), len(records)
+
+
+class _FixedWidthKeys:
+    """把内存映射中的定长大端整数数组包装为可供 bisect 使用的序列 (bytes 按字典序比较即按数值比较)"""
+
+    def __init__(self, buffer, offset, width, count):
+        self.buffer = buffer
+        self.offset = offset
+        self.width = width
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start = self.offset + index * self.width
+        return self.buffer[start:start + self.width]
+
+
+class OfflineGeoDB:
+    """
+    基于内存映射区间库的离线 IP 地理位置查询，支持 IPv4 和 IPv6。
+    查询只做一次二分查找，不访问网络；lookup() 的返回格式与 get_ip_locations_batch 中的位置字典相同。
+    traceroute 跳点 IP 重复率很高，lookup() 额外带有 cache_size 条的 LRU 记忆化。
+    """
+
+    def __init__(self, path, cache_size=65536):
+        self.path = path
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.v4_count, self.v6_count, self.record_count, blob_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} 不是有效的离线地理位置库文件")
+
+        offset = HEADER.size
+        self._v4_starts, offset = self._uint32_view(offset, self.v4_count)
+        self._v4_ends, offset = self._uint32_view(offset, self.v4_count)
+        self._v4_records, offset = self._uint32_view(offset, self.v4_count)
+        self._v4_prefix_index, offset = self._uint32_view(offset, PREFIX_COUNT)
+        self._v6_starts = _FixedWidthKeys(self._mmap, offset, 16, self.v6_count)
+        offset += 16 * self.v6_count
+        self._v6_ends = _FixedWidthKeys(self._mmap, offset, 16, self.v6_count)
+        offset += 16 * self.v6_count
+        self._v6_records, offset = self._uint32_view(offset, self.v6_count)
+        self._record_offsets, offset = self._uint32_view(offset, self.record_count + 1)
+        self._blob_offset = offset
+        self._records = {}
+
+    def _uint32_view(self, offset, count):
+        """返回 (uint32 序列, 下一段偏移)；小端机器上直接使用内存映射，无需复制"""
+        end = offset + 4 * count
+        if sys.byteorder == 'little':
+            view = memoryview(self._mmap)[offset:end].cast('I')
+        else:
+            view = array('I', self._mmap[offset:end])
+            view.byteswap()
+        return view, end
+
+    def _record(self, index):
+        location = self._records.get(index)
+        if location is None:
+            start = self._blob_offset + self._record_offsets[index]
+            end = self._blob_offset + self._record_offsets[index + 1]
+            location = json.loads(self._mmap[start:end].decode('utf-8'))
+            self._records[index] = location
+        return location
+
+    def _lookup(self, ip_address):
+        """查询 IP 的地理位置，返回 {'country', 'city', 'lat', 'lon'}；不在库中或不是有效 IP 时返回 None"""
+        try:
+            packed = socket.inet_pton(socket.AF_INET, ip_address)
+        except (OSError, TypeError):
+            packed = None
+        if packed is not None:
+            value = int.from_bytes(packed, 'big')
+            # 先用一级索引确定候选区间范围，再在范围内二分查找；起点在该前缀之前的一个区间也可能覆盖该地址
+            prefix = value >> PREFIX_SHIFT
+            low = max(self._v4_prefix_index[prefix] - 1, 0)
+            high = self._v4_prefix_index[prefix + 1]
+            index = bisect.bisect_right(self._v4_starts, value, low, high) - 1
+            if index >= 0 and value <= self._v4_ends[index]:
+                return self._record(self._v4_records[index])
+            return None
+
+        try:
+            packed = socket.inet_pton(socket.AF_INET6, ip_address)
+        except (OSError, TypeError):
+            return None
+        index = bisect.bisect_right(self._v6_starts, packed) - 1
+        if index >= 0 and packed <= self._v6_ends[index]:
+            return self._record(self._v6_records[index])
+        return None
+
+    def close(self):
+        # 释放 memoryview 后才能关闭内存映射
+        self.lookup.cache_clear()
+        self._v4_starts = self._v4_ends = self._v4_records = self._v4_prefix_index = None
+        self._v6_records = self._record_offsets = None
+        self._mmap.close()
+        self._file.close()
@@ -0,0 +1,236 @@
+import asyncio
+import itertools
+import math
+import os
+import socket
+import struct
+import time
+
+# ICMP 回显请求/应答类型
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+# 每个包的默认超时时间（秒）和发包间隔（秒）
+DEFAULT_TIMEOUT_SECONDS = 2.0
+DEFAULT_INTERVAL_SECONDS = 1.0
+# 回显请求附带的填充数据，56 字节与系统 ping 默认值一致
+PAYLOAD = b'Pting-icmp-probe'.ljust(56, b'\x00')
+
+
+def icmp_checksum(data):
+    """计算 ICMP 校验和 (RFC 1071)"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(family, ident, seq, payload=PAYLOAD):
+    """构造 ICMP/ICMPv6 回显请求报文"""
+    icmp_type = ICMP_ECHO_REQUEST if family == socket.AF_INET else ICMPV6_ECHO_REQUEST
+    header = struct.pack('!BBHHH', icmp_type, 0, 0, ident, seq)
+    if family == socket.AF_INET6:
+        # ICMPv6 的校验和包含伪首部，由内核负责填写
+        return header + payload
+    checksum = icmp_checksum(header + payload)
+    return struct.pack('!BBHHH', icmp_type, 0, checksum, ident, seq) + payload
+
+
+def parse_echo_reply(family, data):
+    """
+    解析收到的报文，如果是回显应答则返回 (ident, seq)，否则返回 None。
+    原始套接字 (以及部分系统的数据报套接字) 收到的 IPv4 报文带有 IP 首部，需要先跳过。
+    """
+    if family == socket.AF_INET and data and data[0] >> 4 == 4:
+        data = data[(data[0] & 0x0F) * 4:]
+    if len(data) < 8:
+        return None
+    icmp_type, _code, _checksum, ident, seq = struct.unpack('!BBHHH', data[:8])
+    expected = ICMP_ECHO_REPLY if family == socket.AF_INET else ICMPV6_ECHO_REPLY
+    if icmp_type != expected:
+        return None
+    return ident, seq
+
+
+def open_icmp_socket(family):
+    """
+    打开 ICMP 套接字。
+    优先使用无需特权的数据报套接字 (Linux 需 net.ipv4.ping_group_range 允许)，失败时尝试原始套接字。
+    返回 (sock, is_raw)；两者都不可用时抛出 PermissionError。
+    """
+    proto = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+    for sock_type, is_raw in ((socket.SOCK_DGRAM, False), (socket.SOCK_RAW, True)):
+        try:
+            sock = socket.socket(family, sock_type, proto)
+        except OSError:
+            continue
+        sock.setblocking(False)
+        return sock, is_raw
+    raise PermissionError('无法创建 ICMP 套接字 (既不支持数据报套接字也没有原始套接字权限)')
+
+
+def summarize_samples(hostname, address, transmitted, samples):
+    """
+    根据逐包 RTT 样本计算统计数据。
+    samples: [{'seq': 序号, 'rtt_ms': 往返时间或 None(超时)}]
+    返回的键与 PingResult 字段一致，可直接用于构造 PingResult。
+    """
+    rtts = [s['rtt_ms'] for s in samples if s['rtt_ms'] is not None]
+    received = len(rtts)
+    loss = (transmitted - received) * 100.0 / transmitted if transmitted else 100.0
+
+    stats = {
+        'packets_transmitted': transmitted,
+        'packets_received': received,
+        'packet_loss_percent': loss,
+        'min_rtt_ms': None,
+        'avg_rtt_ms': None,
+        'max_rtt_ms': None,
+        'jitter_ms': None,
+        'rtt_samples': samples,
+    }
+    mdev = None
+    if rtts:
+        avg = sum(rtts) / received
+        stats['min_rtt_ms'] = min(rtts)
+        stats['avg_rtt_ms'] = avg
+        stats['max_rtt_ms'] = max(rtts)
+        # 与 iputils ping 的 mdev 相同：RTT 的总体标准差
+        mdev = math.sqrt(max(sum(r * r for r in rtts) / received - avg * avg, 0.0))
+        # 抖动：相邻两次应答 RTT 差值绝对值的平均值
+        if received > 1:
+            stats['jitter_ms'] = sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (received - 1)
+        else:
+            stats['jitter_ms'] = 0.0
+
+    # 生成与系统 ping 相近的文本输出，保存到 raw_output 便于在页面中查看
+    lines = [f"PING {hostname} ({address}) {len(PAYLOAD)} bytes of data (native icmp)."]
+    for sample in samples:
+        if sample['rtt_ms'] is None:
+            lines.append(f"Request timeout for icmp_seq {sample['seq']}")
+        else:
+            lines.append(f"{len(PAYLOAD) + 8} bytes from {address}: icmp_seq={sample['seq']} time={sample['rtt_ms']:.3f} ms")
+    lines.append('')
+    lines.append(f"--- {hostname} ping statistics ---")
+    lines.append(f"{transmitted} packets transmitted, {received} packets received, {loss:g}% packet loss")
+    if rtts:
+        lines.append(f"rtt min/avg/max/mdev = {stats['min_rtt_ms']:.3f}/{stats['avg_rtt_ms']:.3f}/{stats['max_rtt_ms']:.3f}/{mdev:.3f} ms")
+    stats['raw_output'] = '\n'.join(lines) + '\n'
+    return stats
+
+
+class ICMPPinger:
+    """
+    进程内 ICMP 探测器。
+    每个地址族只使用一个套接字，多个主机的 ping 共享同一个套接字和事件循环，
+    通过全局递增的序号把应答分发回对应的请求，从而记录每个包的 RTT 与序号。
+    实例绑定到首次使用时的事件循环，调用 aclose() 后可在新的事件循环中重新使用。
+    """
+
+    def __init__(self, count=4, interval=DEFAULT_INTERVAL_SECONDS, timeout=DEFAULT_TIMEOUT_SECONDS):
+        self.count = count
+        self.interval = interval
+        self.timeout = timeout
+        # 原始套接字模式下用于区分本进程发出的报文；数据报套接字的标识符由内核改写
+        self.ident = os.getpid() & 0xFFFF
+        self._loop = None
+        self._sockets = {}
+        self._pending = {}
+        self._seq = itertools.count()
+
+    def _get_socket(self, family):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._reset()
+            self._loop = loop
+        if family not in self._sockets:
+            sock, is_raw = open_icmp_socket(family)
+            self._sockets[family] = (sock, is_raw)
+            loop.add_reader(sock.fileno(), self._on_readable, family)
+        return self._sockets[family]
+
+    def _next_seq(self, family):
+        # 序号在 16 位空间内循环，跳过仍在等待应答的序号
+        for _ in range(0x10000):
+            seq = next(self._seq) & 0xFFFF
+            if (family, seq) not in self._pending:
+                return seq
+        raise RuntimeError('ICMP 序号已耗尽，等待应答的请求过多')
+
+    def _on_readable(self, family):
+        sock, is_raw = self._sockets[family]
+        while True:
+            try:
+                data, addr = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            received_at = time.perf_counter()
+            reply = parse_echo_reply(family, data)
+            if reply is None:
+                continue
+            ident, seq = reply
+            if is_raw and ident != self.ident:
+                # 原始套接字会收到本机所有 ICMP 报文，忽略其他进程的应答
+                continue
+            pending = self._pending.get((family, seq))
+            if pending is None:
+                continue
+            address, future = pending
+            if addr[0] != address or future.done():
+                continue
+            future.set_result(received_at)
+
+    async def ping(self, hostname):
+        """对单个主机发送 count 个回显请求，返回 summarize_samples 的统计结果"""
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(hostname, None, type=socket.SOCK_DGRAM)
+        family, _, _, _, sockaddr = infos[0]
+        address = sockaddr[0]
+        sock, _is_raw = self._get_socket(family)
+
+        sent = []
+        try:
+            for index in range(self.count):
+                if index:
+                    await asyncio.sleep(self.interval)
+                seq = self._next_seq(family)
+                future = loop.create_future()
+                self._pending[(family, seq)] = (address, future)
+                sent_at = time.perf_counter()
+                sent.append((index + 1, seq, sent_at, future))
+                sock.sendto(build_echo_request(family, self.ident, seq), (address, 0) if family == socket.AF_INET else sockaddr)
+
+            samples = []
+            for display_seq, seq, sent_at, future in sent:
+                remaining = sent_at + self.timeout - time.perf_counter()
+                try:
+                    received_at = await asyncio.wait_for(asyncio.shield(future), max(remaining, 0))
+                    samples.append({'seq': display_seq, 'rtt_ms': (received_at - sent_at) * 1000.0})
+                except asyncio.TimeoutError:
+                    samples.append({'seq': display_seq, 'rtt_ms': None})
+        finally:
+            for _display_seq, seq, _sent_at, future in sent:
+                self._pending.pop((family, seq), None)
+                if not future.done():
+                    future.cancel()
+
+        return summarize_samples(hostname, address, len(sent), samples)
+
+    def _reset(self):
+        for sock, _is_raw in self._sockets.values():
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(sock.fileno())
+            sock.close()
+        self._sockets = {}
+        self._pending = {}
+        self._loop = None
+
+    async def aclose(self):
+        """关闭套接字并解除与当前事件循环的绑定"""
+        self._reset()
@@ -0,0 +1,119 @@
+import bisect
+import functools
+import ipaddress
+import socket
+
+# 地址分类
+GLOBAL = 'global'                # 公网地址，可以查询地理位置
+PRIVATE = 'private'              # 私有网络 (RFC 1918、IPv6 ULA 等)
+LOOPBACK = 'loopback'            # 环回地址
+CGNAT = 'cgnat'                  # 运营商级 NAT 共享地址 (100.64.0.0/10)
+LINK_LOCAL = 'link_local'        # 链路本地地址
+MULTICAST = 'multicast'          # 组播地址
+DOCUMENTATION = 'documentation'  # 文档示例地址
+BENCHMARKING = 'benchmarking'    # 网络设备测试地址
+RESERVED = 'reserved'            # 其他保留地址 (包括广播地址、已废弃的地址块)
+UNSPECIFIED = 'unspecified'      # 未指定地址 ("本网络")
+INVALID = 'invalid'              # 不是有效的 IP 地址 (例如 '*'、'N/A')
+
+# 非公网地址在跳点中显示的位置
+CATEGORY_LABELS = {
+    PRIVATE: '局域网',
+    LOOPBACK: '本机',
+    CGNAT: '运营商内网',
+    LINK_LOCAL: '链路本地',
+    MULTICAST: '组播',
+    DOCUMENTATION: '文档示例地址',
+    BENCHMARKING: '测试地址',
+    RESERVED: '保留地址',
+    UNSPECIFIED: '未指定地址',
+}
+
+# IANA 特殊用途地址块 (IPv4 / IPv6 Special-Purpose Address Registry)，不在表中的地址视为公网地址。
+# 其中标记为全局可达的地址块 (例如 6to4 2002::/16、AS112 192.31.196.0/24) 不在表中。
+SPECIAL_PURPOSE_V4 = [
+    ('0.0.0.0/8', UNSPECIFIED),
+    ('10.0.0.0/8', PRIVATE),
+    ('100.64.0.0/10', CGNAT),
+    ('127.0.0.0/8', LOOPBACK),
+    ('169.254.0.0/16', LINK_LOCAL),
+    ('172.16.0.0/12', PRIVATE),
+    ('192.0.0.0/24', RESERVED),
+    ('192.0.2.0/24', DOCUMENTATION),
+    ('192.88.99.0/24', RESERVED),
+    ('192.168.0.0/16', PRIVATE),
+    ('198.18.0.0/15', BENCHMARKING),
+    ('198.51.100.0/24', DOCUMENTATION),
+    ('203.0.113.0/24', DOCUMENTATION),
+    ('224.0.0.0/4', MULTICAST),
+    ('240.0.0.0/4', RESERVED),  # 包括广播地址 255.255.255.255
+]
+SPECIAL_PURPOSE_V6 = [
+    ('::/128', UNSPECIFIED),
+    ('::1/128', LOOPBACK),
+    ('64:ff9b:1::/48', PRIVATE),
+    ('100::/64', RESERVED),
+    ('2001:2::/48', BENCHMARKING),
+    ('2001:10::/28', RESERVED),
+    ('2001:db8::/32', DOCUMENTATION),
+    ('3fff::/20', DOCUMENTATION),
+    ('5f00::/16', RESERVED),
+    ('fc00::/7', PRIVATE),
+    ('fe80::/10', LINK_LOCAL),
+    ('fec0::/10', RESERVED),
+    ('ff00::/8', MULTICAST),
+]
+# IPv4 映射的 IPv6 地址 (::ffff:0:0/96) 按其中的 IPv4 地址分类
+IPV4_MAPPED_PREFIX = 0xFFFF << 32
+# classify() 缓存的地址数
+CLASSIFY_CACHE_SIZE = 65536
+
+
+def _build_table(blocks):
+    """将 CIDR 列表编译为按起点排序的 (起点数组, 终点数组, 分类数组)，地址块不能重叠"""
+    ranges = sorted(
+        (int(network.network_address), int(network.broadcast_address), category)
+        for network, category in ((ipaddress.ip_network(cidr), category) for cidr, category in blocks)
+    )
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError(f"特殊用途地址块重叠: {previous} / {current}")
+    return [start for start, _, _ in ranges], [end for _, end, _ in ranges], [category for _, _, category in ranges]
+
+
+_V4_STARTS, _V4_ENDS, _V4_CATEGORIES = _build_table(SPECIAL_PURPOSE_V4)
+_V6_STARTS, _V6_ENDS, _V6_CATEGORIES = _build_table(SPECIAL_PURPOSE_V6)
+
+
+def _lookup(value, starts, ends, categories):
+    index = bisect.bisect_right(starts, value) - 1
+    if index >= 0 and value <= ends[index]:
+        return categories[index]
+    return GLOBAL
+
+
+@functools.lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def classify(ip):
+    """返回 IP 地址 (字符串) 的分类，例如 GLOBAL、PRIVATE、CGNAT；不是有效地址时返回 INVALID"""
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        return _lookup(value, _V4_STARTS, _V4_ENDS, _V4_CATEGORIES)
+    except (OSError, TypeError):
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.split('%', 1)[0]), 'big')
+    except (OSError, TypeError, AttributeError):
+        return INVALID
+    if value >> 32 == 0xFFFF:
+        return _lookup(value - IPV4_MAPPED_PREFIX, _V4_STARTS, _V4_ENDS, _V4_CATEGORIES)
+    return _lookup(value, _V6_STARTS, _V6_ENDS, _V6_CATEGORIES)
+
+
+def is_global(ip):
+    """是否为公网地址 (只有公网地址需要查询地理位置)"""
+    return classify(ip) == GLOBAL
+
+
+def display_label(ip):
+    """非公网地址在跳点中显示的位置，公网地址和无效地址返回 None"""
+    return CATEGORY_LABELS.get(classify(ip))
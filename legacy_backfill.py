@@ -0,0 +1,114 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import TargetServer, PingResult, TracerouteResult, TestResult, BackfillProgress
+from parsers import ping_result_fields, parse_traceroute_output
+from paths import PathInterner
+from persistence import ResultWriter
+from rollups import PingRollupAccumulator
+
+# 回填任务在 backfill_progress 表中的名称
+PROGRESS_NAME = 'legacy_test_results'
+
+
+def _existing_keys(session, model, rows):
+    """返回新表中已存在的 (服务器ID, 测试时间)，用于跳过已经转换过 (或迁移前同时写入过) 的结果"""
+    if not rows:
+        return set()
+    times = [row.test_time for row in rows]
+    return set(session.execute(
+        select(model.target_server_id, model.test_time).where(
+            model.target_server_id.in_({row.target_server_id for row in rows}),
+            model.test_time.between(min(times), max(times)),
+        )
+    ).tuples())
+
+
+def _convert_batch(session, writer, interner, rows):
+    """将一批 TestResult 行转换为新表的行并交给 writer (不提交)，返回 (写入数, 跳过数)"""
+    ping_rows = [row for row in rows if row.test_type == 'ping']
+    traceroute_rows = [row for row in rows if row.test_type == 'traceroute']
+    existing = {
+        'ping': _existing_keys(session, PingResult, ping_rows),
+        'traceroute': _existing_keys(session, TracerouteResult, traceroute_rows),
+    }
+    written = 0
+    for row in ping_rows:
+        if not row.result_output or (row.target_server_id, row.test_time) in existing['ping']:
+            continue
+        ping_row = ping_result_fields(row.result_output)
+        ping_row.update(target_server_id=row.target_server_id, test_time=row.test_time, raw_output=row.result_output)
+        writer.add(PingResult, ping_row)
+        writer.rollups.add(row.target_server_id, row.test_time, ping_row['packet_loss_percent'],
+                           ping_row['min_rtt_ms'], ping_row['avg_rtt_ms'], ping_row['max_rtt_ms'])
+        written += 1
+    for row in traceroute_rows:
+        output = row.traceroute_output or row.result_output
+        if (row.target_server_id, row.test_time) in existing['traceroute']:
+            continue
+        # 优先使用当时保存的带地理位置的跳点，否则解析原始输出 (不补查地理位置，避免大量外部请求)
+        hops = row.traceroute_hops_with_location or (parse_traceroute_output(output) if output else None)
+        if not hops and not output:
+            continue
+        traceroute_row = {'target_server_id': row.target_server_id, 'test_time': row.test_time, 'raw_output': output,
+                          'path_id': None, 'hop_rtts': None}
+        if hops:
+            traceroute_row['path_id'], traceroute_row['hop_rtts'] = interner.intern(session, hops, row.test_time)
+        writer.add(TracerouteResult, traceroute_row)
+        written += 1
+    return written, len(rows) - written
+
+
+def backfill_legacy_results(session, engine, batch_size=1000, restart=False, report=None):
+    """
+    将旧的 TestResult 行转换为 PingResult / TracerouteResult (以及 Ping 汇总和去重路径)。
+    按 ID 顺序通过独立的读连接以 yield_per 流式读取，不把全部历史读入内存；每批的转换结果与进度
+    (已处理的最大 ID) 在同一事务中提交，中断后再次执行从上次提交的位置继续，restart=True 时从头开始。
+    新表中已存在相同服务器和测试时间的结果会被跳过，重复执行不会产生重复数据。
+    每批提交后调用 report(进度)，返回最终的 BackfillProgress。
+    """
+    progress = session.get(BackfillProgress, PROGRESS_NAME)
+    if progress is None:
+        progress = BackfillProgress(name=PROGRESS_NAME, last_id=0, processed=0, written=0, skipped=0)
+        session.add(progress)
+    elif restart:
+        progress.last_id = progress.processed = progress.written = progress.skipped = 0
+        progress.started_at = datetime.utcnow()
+    progress.finished_at = None
+    progress.updated_at = datetime.utcnow()
+    session.commit()
+
+    interner = PathInterner()
+    # 每批的行数不会超过 batch_size，写入器不会在批次中途自行提交，保证结果与进度一起提交
+    writer = ResultWriter(session, batch_size=batch_size + 1, rollups=PingRollupAccumulator())
+    statement = select(
+        TestResult.id, TestResult.target_server_id, TestResult.test_type, TestResult.test_time,
+        TestResult.result_output, TestResult.traceroute_output, TestResult.traceroute_hops_with_location,
+    ).join(TargetServer, TargetServer.id == TestResult.target_server_id).where(
+        TestResult.id > progress.last_id
+    ).order_by(TestResult.id)
+
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(statement)
+        for rows in result.partitions():
+            try:
+                written, skipped = _convert_batch(session, writer, interner, rows)
+                progress.last_id = rows[-1].id
+                progress.processed += len(rows)
+                progress.written += written
+                progress.skipped += skipped
+                progress.updated_at = datetime.utcnow()
+                writer.flush()
+            except Exception:
+                # 本批回滚，进程内的路径记录可能指向未提交的路径
+                session.rollback()
+                writer.discard()
+                interner.clear()
+                raise
+            if report is not None:
+                report(progress)
+
+    progress.finished_at = datetime.utcnow()
+    session.commit()
+    return progress
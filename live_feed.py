@@ -0,0 +1,144 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+# 保留最近的事件数，客户端断线重连 (带 Last-Event-ID) 时补发
+DEFAULT_HISTORY_SIZE = 1000
+# 每个订阅者最多积压的事件数，超过时丢弃并通知客户端重新加载
+DEFAULT_SUBSCRIBER_QUEUE_SIZE = 1000
+
+# 订阅者积压溢出，或请求的 Last-Event-ID 已不在历史中、来自重启前的进程时发送的事件，客户端应重新加载数据
+RESET = object()
+
+
+def parse_event_id(value):
+    """解析 "<代数>-<序号>" 格式的事件ID，返回 (代数, 序号)；格式错误时返回 None"""
+    generation, _, number = (value or '').strip().partition('-')
+    if not generation.isdigit() or not number.isdigit():
+        return None
+    return int(generation), int(number)
+
+
+class Subscription:
+    """一个 SSE 连接的订阅，server_id 为 None 时接收所有服务器的事件"""
+
+    def __init__(self, server_id, maxsize):
+        self.server_id = server_id
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def matches(self, event):
+        return self.server_id is None or event['server_id'] == self.server_id
+
+    def offer(self, item):
+        """非阻塞地放入一条事件，积压已满时标记溢出"""
+        if self.overflowed:
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """
+        等待下一条事件，返回 (事件ID 字符串, 事件字典) 或 RESET；超时返回 None。
+        溢出时清空积压并返回 RESET。
+        """
+        if self.overflowed:
+            self.overflowed = False
+            with self._queue.mutex:
+                self._queue.queue.clear()
+            return RESET
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ResultBroadcaster:
+    """
+    新测试结果的进程内广播。写入线程在缓存结果时 stage() 事件，提交后 commit() 一次性分发给所有订阅者，
+    因此客户端只会收到已写入数据库的结果；连接数再多也不需要轮询数据库。
+    事件ID 为 "<代数>-<序号>"，代数取进程启动时间，序号在进程内单调递增；最近的事件保留在历史中，供断线重连的客户端补发。
+    重启后序号从 1 开始，客户端带着重启前的事件ID 重连时因代数不同收到 RESET，而不会被误认为已是最新。
+    """
+
+    def __init__(self, history_size=DEFAULT_HISTORY_SIZE, subscriber_queue_size=DEFAULT_SUBSCRIBER_QUEUE_SIZE):
+        self.subscriber_queue_size = subscriber_queue_size
+        self.generation = time.time_ns()
+        # 历史中的每项为 (序号, (事件ID 字符串, 事件字典))
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._staged = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def stage(self, event):
+        """写入线程中调用: 缓存一条待发布的事件 (event 需包含 server_id)"""
+        self._staged.append(event)
+
+    def discard(self):
+        """写入线程中调用: 当前批次已回滚，丢弃待发布的事件"""
+        self._staged = []
+
+    def commit(self):
+        """写入线程中调用: 当前批次已提交，发布缓存的事件"""
+        if not self._staged:
+            return
+        staged, self._staged = self._staged, []
+        with self._lock:
+            for event in staged:
+                item = (f"{self.generation}-{self._next_id}", event)
+                self._history.append((self._next_id, item))
+                self._next_id += 1
+                for subscription in self._subscribers:
+                    if subscription.matches(event):
+                        subscription.offer(item)
+            self.published += len(staged)
+
+    def subscribe(self, server_id=None, last_event_id=None):
+        """
+        新建订阅。提供 last_event_id (客户端的 Last-Event-ID 字符串) 时先补发历史中更新的事件；
+        该ID 格式错误、来自其他代数 (进程重启前) 或之后的事件已不在历史中时，订阅的第一条为 RESET。
+        """
+        subscription = Subscription(server_id, self.subscriber_queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                parsed = parse_event_id(last_event_id)
+                if parsed is None or parsed[0] != self.generation or parsed[1] >= self._next_id:
+                    subscription.overflowed = True
+                elif self._history and self._history[0][0] > parsed[1] + 1:
+                    subscription.overflowed = True
+                else:
+                    for number, item in self._history:
+                        if number > parsed[1] and subscription.matches(item[1]):
+                            subscription.offer(item)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def latest_event_id(self):
+        """最近发布的事件ID (尚未发布过事件时序号为 0)，随 RESET 发给客户端作为新的 Last-Event-ID"""
+        with self._lock:
+            return f"{self.generation}-{self._next_id - 1}"
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def format_sse(item, reset_event_id=None):
+    """
+    将 (事件ID 字符串, 事件字典) 或 RESET 格式化为 SSE 消息。
+    RESET 带上 reset_event_id (当前最新的事件ID)，客户端重新加载后从该位置继续，之后重连不会再次收到 RESET。
+    """
+    if item is RESET:
+        return f"id: {reset_event_id}\nevent: reset\ndata: {{}}\n\n" if reset_event_id else 'event: reset\ndata: {}\n\n'
+    event_id, event = item
+    return f"id: {event_id}\nevent: result\ndata: {json.dumps(event, ensure_ascii=False, separators=(',', ':'))}\n\n"
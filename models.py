@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from sqlalchemy import JSON
+
+from compressed_types import CompressedText, CompressedJSON
 
 db = SQLAlchemy()
 
@@ -11,6 +12,9 @@ class TargetServer(db.Model):
     hostname = db.Column(db.String(100), unique=True, nullable=False)
     # 服务器描述，可以为空
     description = db.Column(db.String(200), nullable=True)
+    # Ping / Traceroute 测试间隔 (秒)，为空时使用默认的 TEST_INTERVAL_SECONDS
+    ping_interval_seconds = db.Column(db.Integer, nullable=True)
+    traceroute_interval_seconds = db.Column(db.Integer, nullable=True)
 
     def __repr__(self):
         return f"TargetServer('{self.hostname}', '{self.description}')"
@@ -23,8 +27,8 @@ class PingResult(db.Model):
     target_server_id = db.Column(db.Integer, db.ForeignKey('target_server.id'), nullable=False)
     # 测试时间，默认为当前UTC时间
     test_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    # 原始Ping命令输出
-    raw_output = db.Column(db.Text, nullable=True)
+    # 原始Ping命令输出 (压缩存储)
+    raw_output = db.Column(CompressedText, nullable=True)
 
     # 结构化Ping数据字段
     # 发送的包数量
@@ -39,13 +43,54 @@ class PingResult(db.Model):
     avg_rtt_ms = db.Column(db.Float, nullable=True)
     # 最大RTT（毫秒）
     max_rtt_ms = db.Column(db.Float, nullable=True)
+    # 抖动（毫秒），相邻应答 RTT 差值绝对值的平均值，仅原生 ICMP 探测提供
+    jitter_ms = db.Column(db.Float, nullable=True)
+    # 逐包 RTT 样本 [{'seq': 序号, 'rtt_ms': RTT 或 None(超时)}]，仅原生 ICMP 探测提供
+    rtt_samples = db.Column(db.JSON, nullable=True)
 
     # 与 TargetServer 的关系
     server = db.relationship('TargetServer', backref=db.backref('ping_results', lazy=True))
 
+    # 按服务器筛选并按时间排序/游标分页时使用的复合索引，以及不筛选服务器时的时间索引
+    __table_args__ = (
+        db.Index('ix_ping_result_server_time', 'target_server_id', 'test_time', 'id'),
+        db.Index('ix_ping_result_time', 'test_time', 'id'),
+    )
+
     def __repr__(self):
         return f"PingResult('{self.server.hostname}', '{self.test_time}')"
 
+# Ping 结果汇总模型 (按服务器和分钟/小时/天分桶，由 perform_tests 增量维护)
+class PingRollup(db.Model):
+    # 汇总ID，主键
+    id = db.Column(db.Integer, primary_key=True)
+    # 目标服务器ID，外键关联 TargetServer
+    target_server_id = db.Column(db.Integer, db.ForeignKey('target_server.id'), nullable=False)
+    # 汇总粒度（'minute', 'hour', 'day'）
+    granularity = db.Column(db.String(10), nullable=False)
+    # 分桶起始时间（UTC）
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    # 桶内 Ping 测试次数
+    count = db.Column(db.Integer, nullable=False, default=0)
+    # 丢包率之和及有丢包率数据的测试次数，平均丢包率 = loss_sum / loss_count
+    loss_sum = db.Column(db.Float, nullable=False, default=0.0)
+    loss_count = db.Column(db.Integer, nullable=False, default=0)
+    # 平均RTT之和及有RTT数据的测试次数，平均RTT = rtt_sum / rtt_count
+    rtt_sum = db.Column(db.Float, nullable=False, default=0.0)
+    rtt_count = db.Column(db.Integer, nullable=False, default=0)
+    # 最小/最大RTT（毫秒）
+    rtt_min = db.Column(db.Float, nullable=True)
+    rtt_max = db.Column(db.Float, nullable=True)
+    # 平均RTT的对数直方图 {桶序号: 次数}，用于估算百分位数
+    rtt_histogram = db.Column(db.JSON, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('target_server_id', 'granularity', 'bucket_start', name='uq_ping_rollup_bucket'),
+    )
+
+    def __repr__(self):
+        return f"PingRollup('{self.target_server_id}', '{self.granularity}', '{self.bucket_start}')"
+
 # Traceroute 结果模型
 class TracerouteResult(db.Model):
     # Traceroute结果ID，主键
@@ -54,18 +99,131 @@ class TracerouteResult(db.Model):
     target_server_id = db.Column(db.Integer, db.ForeignKey('target_server.id'), nullable=False)
     # 测试时间，默认为当前UTC时间
     test_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    # 原始Traceroute命令输出
-    raw_output = db.Column(db.Text, nullable=True)
+    # 原始Traceroute命令输出 (压缩存储)
+    raw_output = db.Column(CompressedText, nullable=True)
 
-    # 存储带地理位置信息的结构化跳数数据
-    processed_hops_with_location = db.Column(db.JSON, nullable=True)
+    # 存储带地理位置信息的结构化跳数数据 (压缩存储)，仅用于路径去重之前写入的旧数据
+    processed_hops_with_location = db.Column(CompressedJSON, nullable=True)
+    # 本次测试经过的路径，外键关联 TraceroutePath；相同路径的测试共享同一条记录
+    path_id = db.Column(db.Integer, db.ForeignKey('traceroute_path.id'), nullable=True, index=True)
+    # 本次测试的逐次探测 (RTT 及超时)，有响应的探测以下标引用路径中该跳的详情，见 paths.split_hops
+    hop_rtts = db.Column(CompressedJSON, nullable=True)
 
     # 与 TargetServer 的关系
     server = db.relationship('TargetServer', backref=db.backref('traceroute_results', lazy=True))
+    # 与 TraceroutePath 的关系
+    path = db.relationship('TraceroutePath')
+
+    # 按服务器筛选并按时间排序/游标分页时使用的复合索引，以及不筛选服务器时的时间索引
+    __table_args__ = (
+        db.Index('ix_traceroute_result_server_time', 'target_server_id', 'test_time', 'id'),
+        db.Index('ix_traceroute_result_time', 'test_time', 'id'),
+    )
 
     def __repr__(self):
         return f"TracerouteResult('{self.server.hostname}', '{self.test_time}')"
 
+# Traceroute 路径模型，每条不同的路径 (跳序号、主机和 IP 序列) 只保存一次
+class TraceroutePath(db.Model):
+    # 路径ID，主键
+    id = db.Column(db.Integer, primary_key=True)
+    # 路径的规范哈希 (SHA-1)，唯一
+    path_hash = db.Column(db.String(40), unique=True, nullable=False)
+    # 跳数 (最后一个有响应的跳的序号)
+    hop_count = db.Column(db.Integer, nullable=False)
+    # 有响应的跳及其去重的详情 (主机、IP 和地理位置，不含 RTT 和超时的探测) (压缩存储)
+    hops = db.Column(CompressedJSON, nullable=False)
+    # 首次出现时间
+    first_seen = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"TraceroutePath('{self.path_hash}', {self.hop_count})"
+
+# 路由变化事件模型，同一服务器相邻两次 Traceroute 路径不同时记录一条
+class RouteChangeEvent(db.Model):
+    # 事件ID，主键
+    id = db.Column(db.Integer, primary_key=True)
+    # 目标服务器ID，外键关联 TargetServer
+    target_server_id = db.Column(db.Integer, db.ForeignKey('target_server.id'), nullable=False)
+    # 检测到变化的时间 (UTC)
+    detected_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # 变化前后的路径ID，外键关联 TraceroutePath
+    old_path_id = db.Column(db.Integer, db.ForeignKey('traceroute_path.id'), nullable=True)
+    new_path_id = db.Column(db.Integer, db.ForeignKey('traceroute_path.id'), nullable=False)
+    # 逐跳差异: 新增/消失的跳、IP 变化的跳，以及已知时的国家和 ASN 变化
+    diff = db.Column(db.JSON, nullable=False)
+
+    # 与 TargetServer 的关系
+    server = db.relationship('TargetServer', backref=db.backref('route_change_events', lazy=True))
+
+    # 按服务器筛选并按时间排序/游标分页时使用的复合索引，以及不筛选服务器时的时间索引
+    __table_args__ = (
+        db.Index('ix_route_change_event_server_time', 'target_server_id', 'detected_at', 'id'),
+        db.Index('ix_route_change_event_time', 'detected_at', 'id'),
+    )
+
+    def __repr__(self):
+        return f"RouteChangeEvent('{self.target_server_id}', '{self.detected_at}')"
+
+# 探测周期台账，SCHEDULER_MODE=cycle 时每轮 perform_tests 记录一条，per-server 时每 TEST_INTERVAL_SECONDS 记录一条，用于定位变慢的阶段和目标
+class ProbeRun(db.Model):
+    # 记录ID，主键
+    id = db.Column(db.Integer, primary_key=True)
+    # 本轮开始时间和全部结果写入数据库的时间 (UTC)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # 调度方式: 'cycle' 为 perform_tests 的一轮，'per-server' 为按服务器调度时 TEST_INTERVAL_SECONDS 内开始的探测
+    scheduler_mode = db.Column(db.String(20), nullable=False, default='cycle', server_default='cycle')
+    # 目标服务器数、探测项数以及失败和超时的探测数
+    server_count = db.Column(db.Integer, nullable=False, default=0)
+    probe_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    timeout_count = db.Column(db.Integer, nullable=False, default=0)
+    # 各阶段耗时 (秒): 探测子进程 (cycle 为墙钟时间，per-server 为各项探测耗时之和)、解析输出、地理位置解析、数据库写入
+    probe_seconds = db.Column(db.Float, nullable=True)
+    parse_seconds = db.Column(db.Float, nullable=True)
+    geo_seconds = db.Column(db.Float, nullable=True)
+    db_write_seconds = db.Column(db.Float, nullable=True)
+    # 耗时最长的探测: [{'server_id', 'hostname', 'test_type', 'seconds', 'outcome'}, ...]
+    slowest_targets = db.Column(db.JSON, nullable=True)
+
+    # 按时间倒序游标分页时使用的索引
+    __table_args__ = (
+        db.Index('ix_probe_run_started', 'started_at', 'id'),
+    )
+
+    def __repr__(self):
+        return f"ProbeRun('{self.started_at}', {self.probe_count})"
+
+# 数据回填任务的进度，每批转换与进度在同一事务中提交，中断后从上次提交的位置继续
+class BackfillProgress(db.Model):
+    # 回填任务名称，主键
+    name = db.Column(db.String(50), primary_key=True)
+    # 已处理的最大源记录ID
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    # 已处理的源记录数，以及写入和跳过 (已存在或无法转换) 的记录数
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    written = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    # 开始时间、最后一次提交的时间和完成时间 (UTC)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"BackfillProgress('{self.name}', {self.last_id})"
+
+# 多个进程共享的缓存代数。删除或改写结果、修改服务器的进程 (包括 flask 命令) 递增它，
+# Web 进程定期读取，据此使结果接口的 ETag 和响应缓存失效
+class CacheGeneration(db.Model):
+    # 缓存名称，主键
+    name = db.Column(db.String(50), primary_key=True)
+    # 代数，每次失效加一
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"CacheGeneration('{self.name}', {self.generation})"
+
 # 通用测试结果模型 (可能已废弃，但保留注释)
 class TestResult(db.Model):
     # 测试结果ID，主键
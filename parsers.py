@@ -0,0 +1,138 @@
+import re
+
+
+# Ping 统计信息，兼容 iputils ("4 received", "rtt min/avg/max/mdev") 和 BSD/macOS/busybox
+# ("4 packets received", "round-trip min/avg/max[/stddev]") 格式，一次扫描同时匹配包数/丢包行和 RTT 行
+PING_STATS_RE = re.compile(
+    r'(?P<transmitted>\d+) packets transmitted, (?P<received>\d+) (?:packets )?received'
+    r'[^\n]*?(?P<loss>\d+(?:\.\d+)?)% packet loss'
+    r'|(?:rtt|round-trip) min/avg/max(?:/\w+)? = (?P<min>\d+(?:\.\d+)?)/(?P<avg>\d+(?:\.\d+)?)/(?P<max>\d+(?:\.\d+)?)'
+)
+
+
+def parse_ping_output(output):
+    """解析 Ping 命令输出并提取关键信息"""
+    stats = {
+        'packets_transmitted': 0,
+        'packets_received': 0,
+        'packet_loss': 'N/A',
+        'min_rtt': 'N/A',
+        'avg_rtt': 'N/A',
+        'max_rtt': 'N/A',
+    }
+
+    if not output:
+        return stats
+
+    # 统计信息位于 "--- xxx ping statistics ---" 之后，只扫描这一段
+    start = output.rfind('---')
+    for match in PING_STATS_RE.finditer(output, start if start >= 0 else 0):
+        if match.group('transmitted') is not None:
+            stats['packets_transmitted'] = int(match.group('transmitted'))
+            stats['packets_received'] = int(match.group('received'))
+            stats['packet_loss'] = f"{match.group('loss')}%"
+        else:
+            stats['min_rtt'] = f"{match.group('min')} ms"
+            stats['avg_rtt'] = f"{match.group('avg')} ms"
+            stats['max_rtt'] = f"{match.group('max')} ms"
+
+    return stats
+
+
+def _ms_value(value):
+    """将 '12.3 ms' 形式的字符串转换为浮点数，'N/A' 返回 None"""
+    if value == 'N/A':
+        return None
+    return float(value.split(' ')[0])
+
+
+def ping_result_fields(output):
+    """解析 Ping 命令输出，返回可直接用于 PingResult 的结构化字段 (数值类型)"""
+    parsed_data = parse_ping_output(output)
+    packet_loss = parsed_data['packet_loss']
+    return {
+        'packets_transmitted': parsed_data['packets_transmitted'],
+        'packets_received': parsed_data['packets_received'],
+        'packet_loss_percent': float(packet_loss.strip('%')) if packet_loss != 'N/A' else None,
+        'min_rtt_ms': _ms_value(parsed_data['min_rtt']),
+        'avg_rtt_ms': _ms_value(parsed_data['avg_rtt']),
+        'max_rtt_ms': _ms_value(parsed_data['max_rtt']),
+    }
+
+
+# Traceroute 的跳信息行 (以跳数开头，例如 " 3  8.8.8.8  9.1 ms  9.0 ms 8.8.4.4  9.3 ms") 或缩进的续行
+# (BSD/macOS 同一跳的其他响应地址，例如 "    10.0.0.2 (10.0.0.2)  1.234 ms")；续行的跳数分组为空
+TRACEROUTE_LINE_RE = re.compile(r'^(?:[ \t]*(\d+)[ \t]+|[ \t]+)(\S.*?)\r?$', re.M)
+# 跳信息中的记号: 延迟、IPv4/IPv6 地址、超时的 *、主机名 (IP)；按出现频率排列分支，其他记号 (例如 !H、!N 等标记) 忽略。
+# "IP (IP)" 形式中括号内的地址会再次匹配为同一地址
+TRACEROUTE_TOKEN_RE = re.compile(
+    r'(\d+(?:\.\d+)? ms)'
+    r'|(\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F]*:[0-9a-fA-F:.]+)'
+    r'|(\*)'
+    r'|([^\s(]+) \(([^)]+)\)'
+)
+
+
+def _parse_hop_details(hop_data_str):
+    """
+    一次扫描解析一跳的详细信息，返回 details 列表。
+    每个延迟对应一项；出现新的地址后的第一个延迟带上该地址，其余延迟的主机和 IP 为 'N/A'；
+    连续的 * 合并为一项 {'host': '*', 'ip': 'N/A', 'rtt': 'N/A'}。
+    """
+    details = []
+    host = ip = 'N/A'
+    previous_star = False
+    for rtt, address, star, host_name, host_ip in TRACEROUTE_TOKEN_RE.findall(hop_data_str):
+        if rtt:
+            details.append({'host': host, 'ip': ip, 'rtt': rtt})
+            host = ip = 'N/A'
+            previous_star = False
+        elif address:
+            host = ip = address
+            previous_star = False
+        elif star:
+            if not previous_star:
+                details.append({'host': '*', 'ip': 'N/A', 'rtt': 'N/A'})
+            previous_star = True
+        else:
+            host, ip = host_name, host_ip
+            previous_star = False
+    return details
+
+
+def _add_hop(hops, hop_number, hop_data_str):
+    """将一行跳信息合并到 hops 列表，返回新增或更新的跳；无法归属的续行返回 None"""
+    if hop_number:
+        hop = {'hop_number': int(hop_number), 'details': _parse_hop_details(hop_data_str)}
+        hops.append(hop)
+        return hop
+    if hops:
+        details = _parse_hop_details(hop_data_str)
+        if details:
+            hops[-1]['details'].extend(details)
+            return hops[-1]
+    return None
+
+
+def add_traceroute_line(hops, line):
+    """
+    解析一行 Traceroute 输出并合并到 hops 列表: 跳信息行追加为新的一跳，
+    上一跳的缩进续行 (BSD/macOS 多地址格式) 合并到上一跳。返回新增或更新的跳，其他行返回 None。
+    """
+    line_match = TRACEROUTE_LINE_RE.match(line)
+    if line_match is None:
+        return None
+    return _add_hop(hops, *line_match.groups())
+
+
+def parse_traceroute_output(output):
+    """解析 Traceroute 命令输出并提取关键信息"""
+    hops = []
+    if not output:
+        return hops
+
+    # 一次扫描取出所有跳信息行和续行，头部信息 (例如 "traceroute to example.com (x.x.x.x), 30 hops max") 不会匹配
+    for hop_number, hop_data_str in TRACEROUTE_LINE_RE.findall(output):
+        _add_hop(hops, hop_number, hop_data_str)
+
+    return hops
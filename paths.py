@@ -0,0 +1,161 @@
+import hashlib
+import json
+import time
+from datetime import datetime
+
+from models import TraceroutePath
+
+
+# 完全超时 (*) 的一次探测
+TIMEOUT_DETAIL = {'host': '*', 'ip': 'N/A', 'rtt': 'N/A'}
+
+
+def is_responding(detail):
+    """一次探测是否有响应 (带有 IP)，超时 (*) 和同一主机的后续探测 (IP 为 N/A) 不算"""
+    ip = detail.get('ip')
+    return bool(ip) and ip not in ('N/A', '*')
+
+
+def split_hops(hops_with_location):
+    """
+    将带地理位置的跳点列表拆分为 (路径骨架, 本次的逐次探测)。
+    骨架只包含有响应的跳，每跳为按 IP 排序去重的详情 (主机、IP 和地理位置)，因此某次探测超时不会改变骨架；
+    逐次探测为 {'hops': [[跳序号, [探测, ...]], ...]}，有响应的探测为 [骨架中该跳的详情下标, RTT]，
+    超时为 None，其他探测 (例如同一主机的后续探测) 原样保存。
+    """
+    skeleton = []
+    probes = []
+    for hop in hops_with_location:
+        responding = {}
+        for detail in hop['details']:
+            if is_responding(detail) and detail['ip'] not in responding:
+                responding[detail['ip']] = {key: value for key, value in detail.items() if key != 'rtt'}
+        ips = sorted(responding)
+        index_by_ip = {ip: index for index, ip in enumerate(ips)}
+        hop_probes = []
+        for detail in hop['details']:
+            if is_responding(detail):
+                hop_probes.append([index_by_ip[detail['ip']], detail.get('rtt')])
+            elif detail == TIMEOUT_DETAIL:
+                hop_probes.append(None)
+            else:
+                hop_probes.append(dict(detail))
+        if ips:
+            skeleton.append({'hop_number': hop['hop_number'], 'details': [responding[ip] for ip in ips]})
+        probes.append([hop['hop_number'], hop_probes])
+    return skeleton, {'hops': probes}
+
+
+def join_hops(skeleton, probes):
+    """split_hops 的逆操作，还原带 RTT 的跳点列表 (字段顺序与原始数据一致)"""
+    if not isinstance(probes, dict):
+        return _join_legacy_hops(skeleton, probes)
+    details_by_number = {hop['hop_number']: hop['details'] for hop in skeleton}
+    hops = []
+    for hop_number, hop_probes in probes['hops']:
+        path_details = details_by_number.get(hop_number, [])
+        details = []
+        for probe in hop_probes:
+            if probe is None:
+                details.append(dict(TIMEOUT_DETAIL))
+            elif isinstance(probe, dict):
+                details.append(dict(probe))
+            else:
+                index, rtt = probe
+                details.append(_combine_detail(path_details[index], rtt))
+        hops.append({'hop_number': hop_number, 'details': details})
+    return hops
+
+
+def _combine_detail(detail, rtt):
+    combined_detail = {'host': detail.get('host'), 'ip': detail.get('ip'), 'rtt': rtt}
+    if 'location' in detail:
+        combined_detail['location'] = detail['location']
+    return combined_detail
+
+
+def _join_legacy_hops(skeleton, rtts):
+    """还原旧格式的路径: 骨架包含每次探测 (含超时)，RTT 为按 [跳][详情] 对应的二维列表"""
+    return [
+        {'hop_number': hop['hop_number'],
+         'details': [_combine_detail(detail, rtt) for detail, rtt in zip(hop['details'], hop_rtts)]}
+        for hop, hop_rtts in zip(skeleton, rtts or [])
+    ]
+
+
+def result_hops(result):
+    """返回 TracerouteResult 带地理位置和 RTT 的跳点列表，兼容去重前直接保存完整跳点的旧数据"""
+    if result.path_id is not None:
+        return join_hops(result.path.hops, result.hop_rtts)
+    return result.processed_hops_with_location
+
+
+def path_hash(skeleton):
+    """按跳序号和每跳有响应的 IP 计算路径的规范哈希 (不含主机名、RTT、地理位置和超时的探测)，即路由本身的标识"""
+    canonical = [[hop['hop_number'], [detail['ip'] for detail in hop['details']]] for hop in skeleton]
+    return hashlib.sha1(json.dumps(canonical, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def missing_locations(skeleton):
+    """返回骨架中没有地理位置的 (跳下标, 详情下标) 集合"""
+    return {
+        (hop_index, detail_index)
+        for hop_index, hop in enumerate(skeleton)
+        for detail_index, detail in enumerate(hop['details'])
+        if 'location' not in detail
+    }
+
+
+# 进程内记录的已知路径超过该秒数未使用时重新查询数据库。
+# 数据保留清理只删除至少一天未被引用的路径，因此进程内不会引用已被 (其他进程) 删除的路径
+DEFAULT_KNOWN_PATH_MAX_AGE = 3600
+
+
+class PathInterner:
+    """
+    将 Traceroute 路径去重保存到 TraceroutePath 表，相同路径只保存一次。
+    进程内记录 哈希 -> (路径ID, 缺少地理位置的详情, 最近使用时间)，已知路径通常无需查询数据库；
+    本次结果能补全已保存路径中缺失的地理位置，或超过 max_age 秒未使用时才读取数据库。
+    """
+
+    def __init__(self, max_age=DEFAULT_KNOWN_PATH_MAX_AGE):
+        self.max_age = max_age
+        self._known = {}
+
+    def intern(self, session, hops_with_location, seen_at=None):
+        """返回 (路径ID, 本次的逐次探测)；新路径会被添加到会话并 flush 以获得 ID (不提交事务)"""
+        skeleton, probes = split_hops(hops_with_location)
+        digest = path_hash(skeleton)
+        known = self._known.get(digest)
+        now = time.monotonic()
+        if known is not None and now - known[2] <= self.max_age:
+            path_id, missing, _ = known
+            fillable = {
+                (hop_index, detail_index) for hop_index, detail_index in missing
+                if 'location' in skeleton[hop_index]['details'][detail_index]
+            }
+            if not fillable:
+                self._known[digest] = (path_id, missing, now)
+                return path_id, probes
+
+        path = session.query(TraceroutePath).filter_by(path_hash=digest).first()
+        if path is None:
+            path = TraceroutePath(path_hash=digest, hop_count=skeleton[-1]['hop_number'] if skeleton else 0, hops=skeleton,
+                                  first_seen=seen_at or datetime.utcnow())
+            session.add(path)
+            session.flush()
+        else:
+            hops = [{'hop_number': hop['hop_number'], 'details': [dict(d) for d in hop['details']]} for hop in path.hops]
+            changed = False
+            for hop_index, detail_index in missing_locations(hops):
+                detail = skeleton[hop_index]['details'][detail_index]
+                if 'location' in detail:
+                    hops[hop_index]['details'][detail_index]['location'] = detail['location']
+                    changed = True
+            if changed:
+                path.hops = hops
+        self._known[digest] = (path.id, missing_locations(path.hops), now)
+        return path.id, probes
+
+    def clear(self):
+        self._known.clear()
@@ -0,0 +1,206 @@
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+
+
+class ResultWriter:
+    """
+    测试结果的批量写入器。结果以字典形式缓存，每个模型累积到 batch_size 条时
+    用一条批量 INSERT (executemany) 写入并提交，不创建 ORM 对象。
+    rollups 为 PingRollupAccumulator 时，汇总增量与同批结果在同一事务中提交。
+    记录写入的批次数、行数和耗时；提供 on_flush 时每次写入后调用 on_flush(行数, 耗时秒数)。
+    """
+
+    def __init__(self, session, batch_size=200, rollups=None, on_flush=None):
+        self.session = session
+        self.batch_size = batch_size
+        self.rollups = rollups
+        self.on_flush = on_flush
+        self._pending = {}
+        # 写入统计: 批次数、行数、总耗时和单批最长耗时 (秒)
+        self.flush_count = 0
+        # 提交次数 (包括没有结果行的提交)，调用方据此判断任务执行期间写入器是否自行提交过
+        self.commit_count = 0
+        self.total_rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, model, row):
+        """缓存一行结果，该模型缓存的行数达到 batch_size 时立即写入"""
+        rows = self._pending.setdefault(model, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """写入所有缓存的结果并提交事务 (会话中通过 ORM 添加的对象也一并提交)"""
+        start = time.perf_counter()
+        count = 0
+        for model, rows in self._pending.items():
+            if rows:
+                # executemany 要求每行的字段相同，缺少的字段补 None
+                columns = set().union(*rows)
+                rows = [row if len(row) == len(columns) else {column: row.get(column) for column in columns} for row in rows]
+                self.session.execute(insert(model), rows)
+                count += len(rows)
+        self._pending = {}
+        if self.rollups is not None:
+            self.rollups.flush(self.session)
+        self.session.commit()
+        self.commit_count += 1
+        if count:
+            elapsed = time.perf_counter() - start
+            self.flush_count += 1
+            self.total_rows += count
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            if self.on_flush is not None:
+                self.on_flush(count, elapsed)
+
+    def discard(self):
+        """丢弃缓存的结果和汇总增量 (写入失败回滚后调用)"""
+        self._pending = {}
+        if self.rollups is not None:
+            self.rollups.clear()
+
+
+class ResultQueue:
+    """
+    测试结果的后写 (write-behind) 队列。探测流程只把写入任务放入有界内存队列，
+    由唯一的写入线程在自己的应用上下文和会话中取出执行，每批达到 batch_size 项或最早的任务等待超过 max_batch_seconds 时提交；队列满时 put() 阻塞，形成背压。
+    任务为可调用对象 task(writer)，writer 为写入线程持有的 ResultWriter (带 Ping 汇总累积器)。
+    只有一个线程写库，写入线程以外的对象 (例如路径去重和路由变化检测的状态) 只在任务中访问即可保证线程安全。
+    """
+
+    def __init__(self, app, session, rollups_factory=None, on_rollback=None, on_flush=None, maxsize=10000, batch_size=200,
+                 max_batch_seconds=0.5):
+        self.app = app
+        self.session = session
+        self.rollups_factory = rollups_factory
+        # 回滚后调用，用于清除引用了未提交数据的进程内状态 (例如新路径的ID)
+        self.on_rollback = on_rollback
+        # 传给 ResultWriter，每批写入后调用 on_flush(行数, 耗时秒数)
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        # 一批中最早的任务最多等待多久就提交，限制写事务 (及 SQLite 写锁) 的持有时间
+        self.max_batch_seconds = max_batch_seconds
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.writer = None
+        self.tasks_done = 0
+        self.tasks_failed = 0
+
+    def put(self, task):
+        """放入一个写入任务，首次调用时启动写入线程"""
+        if self._thread is None:
+            self.start()
+        self._queue.put(task)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+                self._thread.start()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """返回队列和写入统计"""
+        writer = self.writer
+        return {
+            'queued': self._queue.qsize(),
+            'tasks_done': self.tasks_done,
+            'tasks_failed': self.tasks_failed,
+            'flushes': writer.flush_count if writer else 0,
+            'rows_written': writer.total_rows if writer else 0,
+            'flush_seconds_total': writer.total_time if writer else 0.0,
+            'flush_seconds_max': writer.max_time if writer else 0.0,
+        }
+
+    def join(self):
+        """等待队列中已有的任务全部写入并提交"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self, timeout=10):
+        """写完队列中剩余的任务后停止写入线程"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        with self.app.app_context():
+            rollups = self.rollups_factory() if self.rollups_factory else None
+            self.writer = ResultWriter(self.session, batch_size=self.batch_size, rollups=rollups, on_flush=self.on_flush)
+            # 本批已取出的任务数，以及其中写入器自行提交时已经完整提交的任务数
+            unflushed = 0
+            committed = 0
+            batch_deadline = None
+            while True:
+                try:
+                    # 有未提交的任务时最多等到本批的提交期限
+                    timeout = max(0.0, batch_deadline - time.monotonic()) if unflushed else None
+                    task = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    self._flush(unflushed, committed)
+                    unflushed = committed = 0
+                    continue
+                if task is _STOP:
+                    self._flush(unflushed, committed)
+                    self._queue.task_done()
+                    self.session.remove()
+                    return
+                if not unflushed:
+                    batch_deadline = time.monotonic() + self.max_batch_seconds
+                unflushed += 1
+                commits_before = self.writer.commit_count
+                try:
+                    task(self.writer)
+                except Exception as e:
+                    if self.writer.commit_count != commits_before:
+                        committed = unflushed - 1
+                    # 同一事务中的其他任务可能依赖已回滚的数据，整批未提交的部分丢弃
+                    self._abort(unflushed, e, committed)
+                    unflushed = committed = 0
+                    continue
+                if self.writer.commit_count != commits_before:
+                    # ResultWriter 达到批大小时在本任务中自行提交，之前的任务已完整提交 (本任务可能只提交了一部分)
+                    committed = unflushed - 1
+                # 这里再按任务数和时间兜底，保证事务有界
+                if unflushed >= self.batch_size or time.monotonic() >= batch_deadline:
+                    self._flush(unflushed, committed)
+                    unflushed = committed = 0
+
+    def _flush(self, count, committed=0):
+        try:
+            self.writer.flush()
+        except Exception as e:
+            self._abort(count, e, committed)
+            return
+        self.tasks_done += count
+        self._task_done(count)
+
+    def _abort(self, count, error, committed=0):
+        """回滚本批 count 项任务，其中前 committed 项已由写入器提交，计为完成"""
+        self.session.rollback()
+        self.writer.discard()
+        if self.on_rollback is not None:
+            self.on_rollback()
+        self.tasks_done += committed
+        self.tasks_failed += count - committed
+        print(f"写入测试结果失败，本批 {count - committed} 项已丢弃: {error}")
+        self._task_done(count)
+
+    def _task_done(self, count):
+        for _ in range(count):
+            self._queue.task_done()
+
+
+# 停止写入线程的哨兵
+_STOP = object()
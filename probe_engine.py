@@ -0,0 +1,546 @@
+import asyncio
+import collections
+import functools
+import heapq
+import queue
+import random
+import re
+import socket
+import threading
+import time
+from datetime import datetime
+
+from icmp_pinger import ICMPPinger
+from parsers import add_traceroute_line
+
+# 默认同时运行的探测子进程上限
+DEFAULT_PROBE_CONCURRENCY = 50
+# 单次 ping 的超时时间（秒），给一个宽松的上限防止进程挂死
+PING_TIMEOUT_SECONDS = 30
+# 单次 traceroute 的超时时间（秒）
+TRACEROUTE_TIMEOUT_SECONDS = 60
+# 流式 traceroute 连续多少跳无响应 (* * *) 后提前结束
+DEFAULT_TRACEROUTE_MAX_SILENT_HOPS = 3
+
+# traceroute 头部信息，例如 "traceroute to example.com (93.184.216.34), 30 hops max, 60 byte packets"
+TRACEROUTE_HEADER_RE = re.compile(r'^traceroute to \S+ \(([^)]+)\)')
+
+# 标记事件循环线程已结束的哨兵对象
+_DONE = object()
+
+
+async def run_command_async(command, timeout):
+    """
+    使用 asyncio 子进程执行命令。
+    返回 (returncode, stdout, stderr)；超时时终止进程并抛出 asyncio.TimeoutError。
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        # 超时后必须回收子进程，否则会泄漏进程和文件描述符
+        process.kill()
+        await process.wait()
+        raise
+    return process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+
+async def run_ping_test_async(hostname, count=4):
+    """执行 Ping 测试并返回输出字符串，失败或超时时返回错误描述"""
+    try:
+        returncode, stdout, stderr = await run_command_async(['ping', '-c', str(count), hostname], PING_TIMEOUT_SECONDS)
+        if returncode != 0:
+            # 如果命令执行失败 (例如，主机不可达)
+            return f"Ping 测试失败: {stderr}"
+        return stdout
+    except FileNotFoundError:
+        return "错误: 未找到 ping 命令。请确保已安装 ping。"
+    except asyncio.TimeoutError:
+        return "Ping 测试超时。"
+    except Exception as e:
+        return f"发生未知错误: {e}"
+
+
+async def run_traceroute_test_async(hostname):
+    """执行 Traceroute 测试并返回输出字符串，失败或超时时返回错误描述"""
+    try:
+        returncode, stdout, stderr = await run_command_async(['traceroute', '-n', hostname], TRACEROUTE_TIMEOUT_SECONDS)
+        if returncode != 0:
+            return f"Traceroute 测试失败: {stderr}"
+        return stdout
+    except FileNotFoundError:
+        return "错误: 未找到 traceroute 命令。请确保已安装 traceroute。"
+    except asyncio.TimeoutError:
+        return "Traceroute 测试超时。"
+    except Exception as e:
+        return f"发生未知错误: {e}"
+
+
+def is_silent_hop(hop):
+    """判断一跳是否完全没有响应 (* * *)"""
+    return bool(hop['details']) and all(detail.get('host') == '*' for detail in hop['details'])
+
+
+async def run_traceroute_streaming_async(hostname, max_silent_hops=DEFAULT_TRACEROUTE_MAX_SILENT_HOPS, timeout=TRACEROUTE_TIMEOUT_SECONDS):
+    """
+    流式执行 Traceroute：逐行读取输出并增量解析跳信息。
+    到达目标地址或连续 max_silent_hops 跳无响应时提前结束进程，超时也保留已收集到的路径。
+    返回 {'raw_output': 已读取的输出, 'hops': 已解析的跳列表}；命令不存在或执行失败时返回与 run_traceroute_test_async 相同的错误字符串。
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'traceroute', '-n', hostname,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        return "错误: 未找到 traceroute 命令。请确保已安装 traceroute。"
+    # 并发读取 stderr，避免大量警告写满管道缓冲区后 traceroute 阻塞到超时
+    stderr_task = asyncio.ensure_future(process.stderr.read())
+
+    lines = []
+    hops = []
+    destination = None
+    silent_hops = 0
+    stop_reason = None
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                stop_reason = f"超过 {timeout} 秒"
+                break
+            try:
+                raw_line = await asyncio.wait_for(process.stdout.readline(), remaining)
+            except asyncio.TimeoutError:
+                stop_reason = f"超过 {timeout} 秒"
+                break
+            if not raw_line:
+                break
+            line = raw_line.decode(errors='replace')
+            lines.append(line)
+
+            if destination is None:
+                header_match = TRACEROUTE_HEADER_RE.match(line.strip())
+                if header_match:
+                    destination = header_match.group(1)
+                    continue
+
+            hop_count = len(hops)
+            hop = add_traceroute_line(hops, line)
+            if hop is None:
+                continue
+
+            if destination and any(detail.get('ip') == destination for detail in hop['details']):
+                # 已到达目标地址，后续不会再有新的跳，无需等待进程自行退出
+                break
+            if len(hops) == hop_count:
+                # 上一跳的续行，不计入连续无响应跳数
+                continue
+            silent_hops = silent_hops + 1 if is_silent_hop(hop) else 0
+            if max_silent_hops and silent_hops >= max_silent_hops:
+                stop_reason = f"连续 {silent_hops} 跳无响应"
+                break
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        # 进程退出后管道关闭，读取任务随之结束
+        stderr = await stderr_task
+
+    if stop_reason is None and process.returncode != 0 and not hops:
+        return f"Traceroute 测试失败: {stderr.decode(errors='replace')}"
+
+    raw_output = ''.join(lines)
+    if stop_reason:
+        raw_output += f"[Pting] {stop_reason}，提前结束 traceroute。\n"
+    return {'raw_output': raw_output, 'hops': hops}
+
+
+class NativePingRunner:
+    """
+    使用进程内 ICMPPinger 的 ping 探测函数，返回 PingResult 字段组成的字典而不是命令输出文本。
+    当前环境无法创建 ICMP 套接字时，自动回退到 ping 子进程。
+    """
+
+    def __init__(self, count=4):
+        self.pinger = ICMPPinger(count=count)
+        self.count = count
+        self.unavailable = False
+
+    async def __call__(self, hostname):
+        if not self.unavailable:
+            try:
+                return await self.pinger.ping(hostname)
+            except PermissionError as e:
+                print(f"原生 ICMP 探测不可用，回退到 ping 命令: {e}")
+                self.unavailable = True
+            except socket.gaierror as e:
+                return f"Ping 测试失败: 无法解析主机 {hostname}: {e}"
+        return await run_ping_test_async(hostname, count=self.count)
+
+    async def aclose(self):
+        await self.pinger.aclose()
+
+
+# 测试类型到异步探测函数的映射
+PROBE_RUNNERS = {
+    'ping': run_ping_test_async,
+    'traceroute': run_traceroute_test_async,
+}
+
+# 探测函数返回的错误字符串的前缀 (超时另行判断)
+PROBE_FAILURE_PREFIXES = ('Ping 测试失败', 'Traceroute 测试失败', '错误:', '发生未知错误')
+
+
+def probe_outcome(output, error=None):
+    """将一次探测的结果归类为 'ok'、'timeout' 或 'failed'"""
+    if error is not None:
+        return 'failed'
+    if isinstance(output, dict):
+        # 流式 Traceroute 超时提前结束时会在输出末尾追加 "[Pting] 超过 N 秒，提前结束 traceroute。"
+        return 'timeout' if '[Pting] 超过 ' in (output.get('raw_output') or '') else 'ok'
+    if not isinstance(output, str):
+        return 'ok'
+    if output.endswith('测试超时。'):
+        return 'timeout'
+    if output.startswith(PROBE_FAILURE_PREFIXES):
+        return 'failed'
+    return 'ok'
+
+
+class TimedProbeRunner:
+    """
+    包装一个探测函数，每次探测结束后调用 observe(test_type, 耗时秒数, 结果分类)，
+    结果分类见 probe_outcome()。可以直接替换 PROBE_RUNNERS 中的函数使用。
+    """
+
+    def __init__(self, test_type, runner, observe):
+        self.test_type = test_type
+        self.runner = runner
+        self.observe = observe
+
+    async def __call__(self, hostname):
+        start = time.perf_counter()
+        try:
+            output = await self.runner(hostname)
+        except Exception as exc:
+            self.observe(self.test_type, time.perf_counter() - start, probe_outcome(None, exc))
+            raise
+        self.observe(self.test_type, time.perf_counter() - start, probe_outcome(output))
+        return output
+
+    async def aclose(self):
+        if hasattr(self.runner, 'aclose'):
+            await self.runner.aclose()
+
+
+class ProbeCycle:
+    """
+    一轮探测任务。
+    在独立线程的事件循环中并发执行所有探测，同时运行的子进程数量受 concurrency 限制；
+    迭代该对象时按完成顺序产出 (key, test_type, output, error)，调用方可以边探测边处理结果。
+    迭代结束后 wall_time 为本轮探测的墙钟耗时（秒），timings 为每项探测的 (key, test_type, 耗时秒数) 列表。
+    """
+
+    def __init__(self, tasks, concurrency=DEFAULT_PROBE_CONCURRENCY, runners=None):
+        # tasks: (key, test_type, hostname) 元组列表，key 原样返回给调用方（例如 TargetServer 对象）
+        self.tasks = list(tasks)
+        self.concurrency = max(1, int(concurrency))
+        self.runners = runners or PROBE_RUNNERS
+        self.wall_time = None
+        self.timings = []
+
+    async def _run_one(self, semaphore, results, key, test_type, hostname):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                output, error = await self.runners[test_type](hostname), None
+            except Exception as exc:
+                output, error = None, exc
+            self.timings.append((key, test_type, time.perf_counter() - start))
+            results.put((key, test_type, output, error))
+
+    async def _run_all(self, results):
+        # 信号量必须在事件循环内部创建
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            await asyncio.gather(*(
+                self._run_one(semaphore, results, key, test_type, hostname)
+                for key, test_type, hostname in self.tasks
+            ))
+        finally:
+            # 释放探测函数持有的资源 (例如 NativePingRunner 的套接字)
+            for runner in set(self.runners.values()):
+                if hasattr(runner, 'aclose'):
+                    await runner.aclose()
+
+    def _thread_main(self, results):
+        try:
+            asyncio.run(self._run_all(results))
+        finally:
+            results.put(_DONE)
+
+    def __iter__(self):
+        results = queue.Queue()
+        start = time.perf_counter()
+        thread = threading.Thread(target=self._thread_main, args=(results,), name='probe-engine', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            thread.join()
+            self.wall_time = time.perf_counter() - start
+
+
+class ProbeSweep:
+    """
+    按服务器调度时的一轮: 从 started_at 起 sweep_interval 秒内开始执行的所有探测。
+    本轮的探测全部结束后 duration 为从本轮开始到最后一项探测结束的秒数，
+    timings 为每项探测的 (key, test_type, 探测耗时秒数, 结果分类) 列表，
+    stage_seconds 为各项探测的结果处理中累加的各阶段耗时 (例如 'parse'、'geo')。
+    """
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self._start = time.monotonic()
+        self.timings = []
+        self.stage_seconds = collections.defaultdict(float)
+        self.duration = None
+        # 尚未结束的探测数，以及本轮是否已不再接收新的探测
+        self.pending = 0
+        self.closed = False
+
+
+class ProbeScheduler:
+    """
+    按服务器分别调度的常驻探测调度器。
+    每个 (key, test_type) 按自己的间隔执行，首次启动时同一间隔的任务在整个间隔内均匀错开并加上随机抖动，
+    避免所有探测在同一时刻启动；同一任务的上一次执行尚未结束时跳过本次 (合并到下一次)。
+    load_targets() 返回 (key, test_type, hostname, interval_seconds) 列表，每 sync_interval 秒重新加载一次；
+    on_result(key, test_type, output, error, test_time, stage_seconds=字典) 在线程池中调用，可以执行阻塞操作，
+    向 stage_seconds 中累加的各阶段耗时汇总到该探测所属一轮的 stage_seconds。
+    observe_run(test_type, 秒数) 在每次执行 (探测并处理完结果) 后调用。
+    探测按开始时间每 sweep_interval 秒划分为一轮 (ProbeSweep)，一轮的探测全部结束后在线程池中调用 on_sweep(sweep)。
+    stats() 返回调度延迟 (计划时间到实际开始执行的时间差) 等统计。
+    """
+
+    def __init__(self, load_targets, on_result, runners=None, concurrency=DEFAULT_PROBE_CONCURRENCY,
+                 jitter_fraction=0.1, sync_interval=30, sweep_interval=300, on_sweep=None, observe_run=None):
+        self.load_targets = load_targets
+        self.on_result = on_result
+        self.runners = runners or PROBE_RUNNERS
+        self.concurrency = max(1, int(concurrency))
+        self.jitter_fraction = jitter_fraction
+        self.sync_interval = sync_interval
+        self.sweep_interval = sweep_interval
+        self.on_sweep = on_sweep
+        self.observe_run = observe_run
+        self._sweep = None
+        self._tasks = set()
+        # (key, test_type) -> (hostname, interval_seconds, generation)
+        self._targets = {}
+        self._generation = 0
+        self._heap = []
+        self._running = set()
+        self._thread = None
+        self._loop = None
+        self._stopping = None
+        self.started = 0
+        self.skipped = 0
+        self.waiting = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self._lag_total = 0.0
+
+    def stats(self):
+        return {
+            'targets': len(self._targets),
+            'running': len(self._running),
+            # 已到计划时间但在等待并发名额的任务数
+            'waiting': self.waiting,
+            'started': self.started,
+            'skipped_overlap': self.skipped,
+            'lag_seconds_last': self.lag_last,
+            'lag_seconds_max': self.lag_max,
+            'lag_seconds_avg': self._lag_total / self.started if self.started else 0.0,
+        }
+
+    def _sync(self, targets, now):
+        """合并重新加载的任务列表: 新增任务安排首次执行时间，间隔变化的任务重新安排，已删除的任务作废"""
+        first_sync = not self._targets
+        current = {}
+        new_by_interval = {}
+        for key, test_type, hostname, interval in targets:
+            task_key = (key, test_type)
+            old = self._targets.get(task_key)
+            if old is not None and old[0] == hostname and old[1] == interval:
+                current[task_key] = old
+                continue
+            self._generation += 1
+            current[task_key] = (hostname, interval, self._generation)
+            new_by_interval.setdefault(interval, []).append(task_key)
+        self._targets = current
+
+        for interval, task_keys in new_by_interval.items():
+            slot = interval / len(task_keys)
+            for index, task_key in enumerate(task_keys):
+                if first_sync:
+                    # 均匀分布在整个间隔内，再加上不超过一个时间片的随机抖动
+                    offset = index * slot + random.uniform(0, slot * self.jitter_fraction)
+                else:
+                    # 运行中新增或修改的任务随机落在一个间隔内
+                    offset = random.uniform(0, interval)
+                heapq.heappush(self._heap, (now + offset, self._targets[task_key][2], task_key))
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _rotate_sweep(self):
+        """结束当前一轮 (不再接收新的探测)，开始新的一轮"""
+        previous, self._sweep = self._sweep, ProbeSweep(datetime.utcnow())
+        if previous is not None:
+            previous.closed = True
+            if not previous.pending:
+                self._finish_sweep(previous)
+
+    def _finish_sweep(self, sweep):
+        if not sweep.timings or self._stopping.is_set():
+            return
+        sweep.duration = time.monotonic() - sweep._start
+        if self.on_sweep is not None:
+            self._spawn(self._report_sweep(sweep))
+
+    async def _report_sweep(self, sweep):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.on_sweep, sweep)
+        except Exception as exc:
+            print(f"记录本轮探测统计失败: {exc}")
+
+    async def _run_one(self, semaphore, task_key, hostname, due, sweep):
+        key, test_type = task_key
+        self.waiting += 1
+        acquired = False
+        probe_seconds = None
+        try:
+            async with semaphore:
+                acquired = True
+                self.waiting -= 1
+                lag = max(0.0, time.time() - due)
+                self.started += 1
+                self.lag_last = lag
+                self.lag_max = max(self.lag_max, lag)
+                self._lag_total += lag
+                test_time = datetime.utcnow()
+                start = time.perf_counter()
+                try:
+                    output, error = await self.runners[test_type](hostname), None
+                except Exception as exc:
+                    output, error = None, exc
+                probe_seconds = time.perf_counter() - start
+            # 每次执行使用独立的字典，回到事件循环线程后再汇总，避免线程池中并发修改
+            stage_seconds = collections.defaultdict(float)
+            await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                self.on_result, key, test_type, output, error, test_time, stage_seconds=stage_seconds))
+            for stage, seconds in stage_seconds.items():
+                sweep.stage_seconds[stage] += seconds
+            if self.observe_run is not None:
+                self.observe_run(test_type, time.perf_counter() - start)
+        except Exception as exc:
+            print(f"{hostname} 的 {test_type} 结果处理失败: {exc}")
+        finally:
+            if not acquired:
+                self.waiting -= 1
+            self._running.discard(task_key)
+            if probe_seconds is not None:
+                sweep.timings.append((key, test_type, probe_seconds, probe_outcome(output, error)))
+            sweep.pending -= 1
+            if sweep.closed and not sweep.pending:
+                self._finish_sweep(sweep)
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        next_sync = 0.0
+        self._rotate_sweep()
+        next_sweep = time.time() + self.sweep_interval
+        try:
+            while not self._stopping.is_set():
+                now = time.time()
+                if now >= next_sweep:
+                    self._rotate_sweep()
+                    next_sweep = now + self.sweep_interval
+                if now >= next_sync:
+                    try:
+                        targets = await loop.run_in_executor(None, self.load_targets)
+                        self._sync(targets, now)
+                    except Exception as exc:
+                        print(f"加载探测任务失败: {exc}")
+                    next_sync = now + self.sync_interval
+
+                while self._heap and self._heap[0][0] <= now:
+                    due, generation, task_key = heapq.heappop(self._heap)
+                    target = self._targets.get(task_key)
+                    if target is None or target[2] != generation:
+                        # 任务已删除或已重新安排
+                        continue
+                    hostname, interval, _ = target
+                    next_due = due + interval
+                    if next_due <= now:
+                        # 落后超过一个间隔时合并错过的执行，从现在起重新计时
+                        next_due = now + interval
+                    heapq.heappush(self._heap, (next_due, generation, task_key))
+                    if task_key in self._running:
+                        self.skipped += 1
+                        continue
+                    self._running.add(task_key)
+                    self._sweep.pending += 1
+                    self._spawn(self._run_one(semaphore, task_key, hostname, due, self._sweep))
+
+                wait = min(self._heap[0][0] if self._heap else next_sync, next_sync, next_sweep) - time.time()
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=max(0.01, wait))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for runner in set(self.runners.values()):
+                if hasattr(runner, 'aclose'):
+                    await runner.aclose()
+
+    def _thread_main(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._thread_main, name='probe-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        if self._thread is None:
+            return
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join(timeout)
+        self._thread = None
@@ -0,0 +1,119 @@
+import gzip
+from datetime import timedelta, timezone
+
+import pytz
+from flask.json.provider import DefaultJSONProvider
+
+# orjson 和 brotli 为可选依赖，未安装时分别使用标准库 json 和只提供 gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+# 可协商的压缩方式，按优先级排列
+AVAILABLE_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+# 压缩级别: 在线压缩更看重速度，压缩率已接近最高级别
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+if orjson is not None:
+    # 日期时间交给 Flask 的默认规则处理 (HTTP 日期格式)，与标准库 json 的输出保持一致
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    安装了 orjson 时用它序列化 jsonify 的响应 (直接生成 bytes，不经过 str)，未安装时与 Flask 默认行为相同。
+    orjson 不支持的类型仍按 Flask 的默认规则 (日期、Decimal、UUID 等) 转换。
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS), mimetype=self.mimetype)
+
+
+def negotiate_encoding(accept_encodings):
+    """根据请求的 Accept-Encoding 选择压缩方式 ('br' 或 'gzip')，客户端都不接受时返回 None"""
+    best, best_quality = None, 0
+    for encoding in AVAILABLE_ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    """按 negotiate_encoding 选择的方式压缩响应正文"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime 固定为 0，相同正文压缩结果相同
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def variant_etag(etag, encoding):
+    """压缩后的响应与原始响应是不同的表示，需要不同的 ETag"""
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+def compress_response(response, accept_encodings, min_size):
+    """
+    压缩 JSON 响应 (after_request 中调用)。只处理未压缩、非流式的 200 响应，正文小于 min_size 字节时不压缩。
+    响应带有强 ETag 时改为压缩表示的 ETag。
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None or response.content_length is None or response.content_length < min_size:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(variant_etag(etag, encoding))
+    return response
+
+
+class LocalTimeFormatter:
+    """
+    将一页结果的 UTC 时间 (naive) 转换为本地时区的 ISO 格式字符串。
+    一页结果的时间跨度在一天以内且首尾的 UTC 偏移相同 (没有跨越夏令时切换) 时，整页只做一次时区换算，
+    之后每条只需加上固定偏移；否则逐条换算。
+    """
+
+    def __init__(self, tz, times):
+        self.tz = tz
+        self.fixed_offset = None
+        times = [value for value in times if value is not None and value.tzinfo is None]
+        if times:
+            earliest, latest = min(times), max(times)
+            if latest - earliest <= timedelta(days=1):
+                offset = self._utcoffset(earliest)
+                if offset == self._utcoffset(latest):
+                    self.fixed_offset = (offset, timezone(offset))
+
+    def _utcoffset(self, value):
+        return pytz.utc.localize(value).astimezone(self.tz).utcoffset()
+
+    def __call__(self, value):
+        if self.fixed_offset is not None and value.tzinfo is None:
+            offset, offset_tz = self.fixed_offset
+            return (value + offset).replace(tzinfo=offset_tz).isoformat()
+        if value.tzinfo is None: # 如果是 naive 时间
+            utc_time = pytz.utc.localize(value) # 视为 UTC 并转换为 timezone-aware
+        else:
+            utc_time = value.astimezone(pytz.utc) # 如果已经是 timezone-aware，确保是 UTC
+        return utc_time.astimezone(self.tz).isoformat()
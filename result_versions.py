@@ -0,0 +1,107 @@
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+# 默认每隔多少秒重新读取结果表的最大 ID 和共享的缓存代数
+DEFAULT_CHECK_SECONDS = 5
+
+
+class ResultVersionTracker:
+    """
+    记录每个 (测试类型, 服务器ID) 已提交结果的版本，用于结果接口的 ETag 和响应缓存。
+    版本为 (最新结果ID, 提交时间)：写入线程在提交包含某服务器新结果的一批后，取该结果表当前的最大 ID 作为新版本，
+    因此本进程有新结果提交时版本立即变化。服务器ID 为 None 的版本表示所有服务器。
+    首次请求某个键时以结果表当前的最大 ID 作为初始版本。
+    其他进程 (另一个 Web 进程、flask backfill-legacy-results 等) 写入的结果不经过本进程的写入线程，
+    因此已记录的版本超过 check_seconds 秒后重新读取各结果表的最大 ID (主键索引查询)，有变化时该类型的版本全部重新加载。
+    删除或清理结果、修改服务器等其他改动通过 invalidate() 使所有版本失效；提供 bump_generation 时同时递增
+    多个进程共享的缓存代数 (load_generation 读取)，其他进程在下次检查时发现代数变化，同样使所有版本失效。
+    """
+
+    def __init__(self, latest_id_loaders, load_generation=None, bump_generation=None, check_seconds=DEFAULT_CHECK_SECONDS):
+        # 测试类型 -> 返回该结果表当前最大 ID 的函数
+        self.latest_id_loaders = latest_id_loaders
+        self.load_generation = load_generation
+        self.bump_generation = bump_generation
+        self.check_seconds = check_seconds
+        self._versions = {}
+        self._touched = set()
+        self._lock = threading.Lock()
+        # 上次检查时各结果表的最大 ID、共享的缓存代数和检查时间
+        self._latest_ids = {}
+        self._shared_generation = None
+        self._checked_at = None
+        # 以进程启动时间开头，重启后旧的 ETag 不会误匹配
+        self.generation = time.time_ns()
+
+    def touch(self, test_type, server_id):
+        """写入线程中调用: 当前批次包含该服务器的新结果"""
+        self._touched.add((test_type, server_id))
+
+    def discard(self):
+        """写入线程中调用: 当前批次已回滚"""
+        self._touched.clear()
+
+    def commit(self):
+        """写入线程中调用: 当前批次已提交，更新涉及的服务器和"所有服务器"的版本"""
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, set()
+        committed_at = datetime.utcnow()
+        latest_ids = {test_type: self.latest_id_loaders[test_type]() for test_type in {key[0] for key in touched}}
+        with self._lock:
+            for test_type, server_id in touched:
+                self._versions[(test_type, server_id)] = (latest_ids[test_type], committed_at)
+            for test_type, latest_id in latest_ids.items():
+                self._versions[(test_type, None)] = (latest_id, committed_at)
+                # 本进程的提交不需要在下次检查时再使版本失效
+                self._latest_ids[test_type] = latest_id
+
+    def invalidate(self):
+        """结果被删除或改写、服务器信息变化后调用，使所有版本 (及据此生成的 ETag 和 Last-Modified) 失效"""
+        if self.bump_generation is not None:
+            self.bump_generation()
+        with self._lock:
+            self.generation += 1
+            self._versions.clear()
+            # 下次请求时重新读取共享的缓存代数
+            self._checked_at = None
+
+    def _check(self):
+        """距上次检查超过 check_seconds 秒时，重新读取最大 ID 和共享的缓存代数，使其他进程改动过的版本失效"""
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+                return
+            # 先记录检查时间，并发的请求不会重复查询
+            self._checked_at = now
+        shared_generation = self.load_generation() if self.load_generation is not None else None
+        latest_ids = {test_type: loader() for test_type, loader in self.latest_id_loaders.items()}
+        with self._lock:
+            if shared_generation != self._shared_generation:
+                self._shared_generation = shared_generation
+                self._versions.clear()
+            for test_type, latest_id in latest_ids.items():
+                if self._latest_ids.get(test_type) != latest_id:
+                    self._latest_ids[test_type] = latest_id
+                    for key in [key for key in self._versions if key[0] == test_type]:
+                        del self._versions[key]
+
+    def get(self, test_type, server_id):
+        """返回 (最新结果ID, 提交时间)"""
+        self._check()
+        with self._lock:
+            version = self._versions.get((test_type, server_id))
+        if version is None:
+            version = (self.latest_id_loaders[test_type](), datetime.utcnow())
+            with self._lock:
+                # 查询期间写入线程可能已经更新了版本，以已有的为准
+                version = self._versions.setdefault((test_type, server_id), version)
+        return version
+
+    def etag(self, test_type, server_id, params=()):
+        """根据版本、缓存代数和请求参数生成 ETag"""
+        latest_id, _ = self.get(test_type, server_id)
+        key = repr((test_type, server_id, latest_id, self.generation, self._shared_generation, tuple(params)))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
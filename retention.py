@@ -0,0 +1,130 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import LargeBinary, exists, or_, type_coerce
+from sqlalchemy.orm.attributes import flag_modified
+
+from models import PingResult, TracerouteResult, TraceroutePath, RouteChangeEvent, PingRollup
+
+# 每批处理的行数和批次之间的停顿 (秒)，让出数据库给探测写入和页面查询
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_PAUSE_SECONDS = 0.05
+
+
+class RetentionPolicy:
+    """
+    一条数据保留策略: 对 model 中 time_column 早于 days 天的行，
+    clear_columns 为空时删除整行，否则只将这些字段置为 NULL (保留结构化字段)。
+    criteria 为额外的筛选条件，例如只处理某个汇总粒度。days 为 0 表示不启用。
+    """
+
+    def __init__(self, name, model, days, time_column='test_time', clear_columns=None, criteria=()):
+        self.name = name
+        self.model = model
+        self.days = days
+        self.time_column = getattr(model, time_column)
+        self.clear_columns = [getattr(model, column) for column in (clear_columns or [])]
+        self.criteria = list(criteria)
+
+    @property
+    def enabled(self):
+        return self.days > 0
+
+    def _filters(self, now):
+        filters = [self.time_column < now - timedelta(days=self.days)] + self.criteria
+        if self.clear_columns:
+            # 只处理仍有数据的行，已清理过的行不会被重复扫描
+            filters.append(self.clear_columns[0].isnot(None))
+        return filters
+
+    def apply(self, session, now=None, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE_SECONDS):
+        """分批执行策略，每批单独提交，返回处理的行数"""
+        if not self.enabled:
+            return 0
+        now = now or datetime.utcnow()
+        total = 0
+        while True:
+            ids = [row_id for (row_id,) in session.query(self.model.id).filter(*self._filters(now)).limit(batch_size)]
+            if not ids:
+                break
+            # 删除时再次检查筛选条件 (例如路径仍未被引用)，期间被重新引用的行不会被删除
+            query = session.query(self.model).filter(self.model.id.in_(ids), *self.criteria)
+            if self.clear_columns:
+                query.update({column: None for column in self.clear_columns}, synchronize_session=False)
+            else:
+                query.delete(synchronize_session=False)
+            session.commit()
+            total += len(ids)
+            if len(ids) < batch_size:
+                break
+            time.sleep(pause)
+        return total
+
+
+def build_policies(raw_output_days=0, ping_days=0, traceroute_days=0, minute_rollup_days=0, hour_rollup_days=0):
+    """根据配置构造保留策略列表 (天数为 0 的策略不启用)"""
+    return [
+        RetentionPolicy('ping_raw_output', PingResult, raw_output_days, clear_columns=['raw_output', 'rtt_samples']),
+        RetentionPolicy('traceroute_raw_output', TracerouteResult, raw_output_days, clear_columns=['raw_output']),
+        RetentionPolicy('ping_result', PingResult, ping_days),
+        RetentionPolicy('traceroute_result', TracerouteResult, traceroute_days),
+        # 路由变化事件与 Traceroute 结果保留相同的天数，之后删除不再被结果或事件引用的去重路径
+        RetentionPolicy('route_change_event', RouteChangeEvent, traceroute_days, time_column='detected_at'),
+        RetentionPolicy('traceroute_path', TraceroutePath, traceroute_days, time_column='first_seen', criteria=[
+            ~exists().where(TracerouteResult.path_id == TraceroutePath.id),
+            ~exists().where(or_(RouteChangeEvent.old_path_id == TraceroutePath.id,
+                                RouteChangeEvent.new_path_id == TraceroutePath.id)),
+        ]),
+        RetentionPolicy('ping_rollup_minute', PingRollup, minute_rollup_days, time_column='bucket_start',
+                        criteria=[PingRollup.granularity == 'minute']),
+        RetentionPolicy('ping_rollup_hour', PingRollup, hour_rollup_days, time_column='bucket_start',
+                        criteria=[PingRollup.granularity == 'hour']),
+    ]
+
+
+def run_retention(session, policies, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE_SECONDS):
+    """依次执行所有启用的策略，返回 {策略名: 处理行数}"""
+    now = datetime.utcnow()
+    return {
+        policy.name: policy.apply(session, now=now, batch_size=batch_size, pause=pause)
+        for policy in policies if policy.enabled
+    }
+
+
+def compact_legacy_rows(session, model, column_names, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE_SECONDS):
+    """
+    将迁移前写入的未压缩数据改写为压缩格式。
+    按 id 分批读取原始存储值，只改写与当前编码结果不一致的行，返回改写的行数。
+    """
+    column_types = [getattr(model, name).type for name in column_names]
+    raw_columns = [type_coerce(getattr(model, name), LargeBinary) for name in column_names]
+
+    def is_legacy(value, column_type):
+        if value is None:
+            return False
+        if isinstance(value, str):
+            # SQLite 中迁移前的 TEXT 数据
+            return True
+        value = bytes(value)
+        return column_type.process_bind_param(column_type.process_result_value(value, None), None) != value
+
+    last_id = 0
+    rewritten = 0
+    while True:
+        rows = session.query(model.id, *raw_columns).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        legacy_ids = [
+            row[0] for row in rows
+            if any(is_legacy(value, column_type) for value, column_type in zip(row[1:], column_types))
+        ]
+        if legacy_ids:
+            for instance in session.query(model).filter(model.id.in_(legacy_ids)):
+                for name in column_names:
+                    # 标记为已修改，提交时以压缩格式写回
+                    flag_modified(instance, name)
+            session.commit()
+            rewritten += len(legacy_ids)
+        time.sleep(pause)
+    return rewritten
@@ -0,0 +1,139 @@
+import math
+
+from models import PingRollup
+
+# 支持的汇总粒度
+ROLLUP_GRANULARITIES = ('minute', 'hour', 'day')
+# RTT 直方图采用对数分桶，每个桶的上界是下界的 HISTOGRAM_BASE 倍 (约 10% 精度)
+HISTOGRAM_BASE = 1.1
+_LOG_BASE = math.log(HISTOGRAM_BASE)
+
+
+def bucket_start(test_time, granularity):
+    """返回 test_time 所在汇总桶的起始时间"""
+    if granularity == 'minute':
+        return test_time.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return test_time.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return test_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"不支持的汇总粒度: {granularity}")
+
+
+def histogram_index(rtt_ms):
+    """RTT 所属的直方图桶序号"""
+    return math.floor(math.log(max(rtt_ms, 0.001)) / _LOG_BASE)
+
+
+def merge_histograms(target, source):
+    """将 source 直方图累加到 target (JSON 中的键为字符串)"""
+    for index, count in source.items():
+        target[index] = target.get(index, 0) + count
+    return target
+
+
+def histogram_percentile(histogram, percentile):
+    """根据对数直方图估算 RTT 百分位数 (毫秒)，返回桶的几何中点；直方图为空时返回 None"""
+    if not histogram:
+        return None
+    buckets = sorted((int(index), count) for index, count in histogram.items())
+    total = sum(count for _, count in buckets)
+    rank = percentile / 100.0 * total
+    seen = 0
+    for index, count in buckets:
+        seen += count
+        if seen >= rank:
+            return HISTOGRAM_BASE ** (index + 0.5)
+    return HISTOGRAM_BASE ** (buckets[-1][0] + 0.5)
+
+
+def rollup_to_dict(rollup):
+    """将 PingRollup 转换为带有平均值和百分位数的字典"""
+    return {
+        'bucket_start': rollup.bucket_start,
+        'count': rollup.count,
+        'loss_percent': rollup.loss_sum / rollup.loss_count if rollup.loss_count else None,
+        'min_rtt_ms': rollup.rtt_min,
+        'avg_rtt_ms': rollup.rtt_sum / rollup.rtt_count if rollup.rtt_count else None,
+        'max_rtt_ms': rollup.rtt_max,
+        'p50_rtt_ms': histogram_percentile(rollup.rtt_histogram, 50),
+        'p95_rtt_ms': histogram_percentile(rollup.rtt_histogram, 95),
+        'p99_rtt_ms': histogram_percentile(rollup.rtt_histogram, 99),
+    }
+
+
+class PingRollupAccumulator:
+    """
+    在内存中累积 Ping 结果的分钟/小时/天汇总增量，flush() 时与数据库中已有的汇总行合并。
+    一轮测试只需每个粒度一次查询，而不是每条结果一次读写。
+    """
+
+    def __init__(self, granularities=ROLLUP_GRANULARITIES):
+        self.granularities = granularities
+        self._deltas = {}
+
+    def add(self, target_server_id, test_time, packet_loss_percent=None, min_rtt_ms=None, avg_rtt_ms=None, max_rtt_ms=None):
+        for granularity in self.granularities:
+            key = (target_server_id, granularity, bucket_start(test_time, granularity))
+            delta = self._deltas.get(key)
+            if delta is None:
+                delta = self._deltas[key] = {
+                    'count': 0, 'loss_sum': 0.0, 'loss_count': 0,
+                    'rtt_sum': 0.0, 'rtt_count': 0, 'rtt_min': None, 'rtt_max': None, 'rtt_histogram': {},
+                }
+            delta['count'] += 1
+            if packet_loss_percent is not None:
+                delta['loss_sum'] += packet_loss_percent
+                delta['loss_count'] += 1
+            if avg_rtt_ms is not None:
+                delta['rtt_sum'] += avg_rtt_ms
+                delta['rtt_count'] += 1
+                index = str(histogram_index(avg_rtt_ms))
+                delta['rtt_histogram'][index] = delta['rtt_histogram'].get(index, 0) + 1
+            low = min_rtt_ms if min_rtt_ms is not None else avg_rtt_ms
+            high = max_rtt_ms if max_rtt_ms is not None else avg_rtt_ms
+            if low is not None and (delta['rtt_min'] is None or low < delta['rtt_min']):
+                delta['rtt_min'] = low
+            if high is not None and (delta['rtt_max'] is None or high > delta['rtt_max']):
+                delta['rtt_max'] = high
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def clear(self):
+        self._deltas = {}
+
+    def flush(self, session):
+        """将累积的增量合并到 PingRollup 表 (不提交事务)，并清空累积器"""
+        for granularity in self.granularities:
+            keys = [key for key in self._deltas if key[1] == granularity]
+            if not keys:
+                continue
+            existing = {
+                (row.target_server_id, row.granularity, row.bucket_start): row
+                for row in session.query(PingRollup).filter(
+                    PingRollup.granularity == granularity,
+                    PingRollup.target_server_id.in_({key[0] for key in keys}),
+                    PingRollup.bucket_start.in_({key[2] for key in keys}),
+                )
+            }
+            for key in keys:
+                delta = self._deltas[key]
+                row = existing.get(key)
+                if row is None:
+                    session.add(PingRollup(
+                        target_server_id=key[0], granularity=key[1], bucket_start=key[2], **delta
+                    ))
+                    continue
+                row.count += delta['count']
+                row.loss_sum += delta['loss_sum']
+                row.loss_count += delta['loss_count']
+                row.rtt_sum += delta['rtt_sum']
+                row.rtt_count += delta['rtt_count']
+                if delta['rtt_min'] is not None and (row.rtt_min is None or delta['rtt_min'] < row.rtt_min):
+                    row.rtt_min = delta['rtt_min']
+                if delta['rtt_max'] is not None and (row.rtt_max is None or delta['rtt_max'] > row.rtt_max):
+                    row.rtt_max = delta['rtt_max']
+                # JSON 字段需要赋值新对象才能被识别为已修改
+                row.rtt_histogram = merge_histograms(dict(row.rtt_histogram or {}), delta['rtt_histogram'])
+        self._deltas = {}
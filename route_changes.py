@@ -0,0 +1,132 @@
+import time
+from datetime import datetime
+
+from models import TracerouteResult, RouteChangeEvent
+from paths import result_hops
+
+
+def _responding_ips(hop):
+    """一跳中有响应的 IP (按出现顺序去重)"""
+    ips = []
+    for detail in hop['details']:
+        ip = detail.get('ip')
+        if ip and ip not in ('N/A', '*') and ip not in ips:
+            ips.append(ip)
+    return ips
+
+
+def _location_values(hop, key):
+    """一跳中已知的地理位置字段值 (例如国家或 ASN)，按出现顺序去重"""
+    values = []
+    for detail in hop['details']:
+        value = (detail.get('location') or {}).get(key)
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+def diff_paths(old_hops, new_hops):
+    """
+    按跳序号比较两条路径，一次遍历完成 (O(跳数))。
+    只有一侧有响应的跳 (另一侧为 * 超时) 不视为变化，避免丢包造成误报。
+    返回 {'hops_added', 'hops_removed', 'hops_changed', 'old_hop_count', 'new_hop_count'}；没有变化时三个列表均为空。
+    """
+    old_by_number = {hop['hop_number']: hop for hop in old_hops}
+    new_by_number = {hop['hop_number']: hop for hop in new_hops}
+    hops_added = []
+    hops_removed = []
+    hops_changed = []
+    for hop_number in sorted(old_by_number.keys() | new_by_number.keys()):
+        old_hop = old_by_number.get(hop_number)
+        new_hop = new_by_number.get(hop_number)
+        old_ips = _responding_ips(old_hop) if old_hop else []
+        new_ips = _responding_ips(new_hop) if new_hop else []
+        if old_hop is None:
+            if new_ips:
+                hops_added.append({'hop_number': hop_number, 'ips': new_ips})
+            continue
+        if new_hop is None:
+            if old_ips:
+                hops_removed.append({'hop_number': hop_number, 'ips': old_ips})
+            continue
+        if not old_ips or not new_ips or set(old_ips) == set(new_ips):
+            continue
+        change = {'hop_number': hop_number, 'old_ips': old_ips, 'new_ips': new_ips}
+        # 地理位置已知时记录国家和 ASN 的变化
+        for key, name in (('country', 'country'), ('asn', 'asn')):
+            old_values = _location_values(old_hop, key)
+            new_values = _location_values(new_hop, key)
+            if old_values and new_values and set(old_values) != set(new_values):
+                change[f'old_{name}'] = old_values
+                change[f'new_{name}'] = new_values
+        hops_changed.append(change)
+    return {
+        'hops_added': hops_added,
+        'hops_removed': hops_removed,
+        'hops_changed': hops_changed,
+        'old_hop_count': len(old_hops),
+        'new_hop_count': len(new_hops),
+    }
+
+
+def has_changes(diff):
+    return bool(diff['hops_added'] or diff['hops_removed'] or diff['hops_changed'])
+
+
+# 服务器超过该秒数没有新的 Traceroute 时，下次比较前从数据库重新加载最近的路径 (其旧结果和路径可能已被数据保留清理删除)
+DEFAULT_LAST_PATH_MAX_AGE = 3600
+
+
+class RouteChangeDetector:
+    """
+    增量检测 Traceroute 路径变化。进程内记录每台服务器最近一次的 (路径ID, 跳点, 记录时间)，
+    路径ID相同时直接跳过，不同时才逐跳比较；进程启动后每台服务器只查询一次最近的结果作为初始状态，不扫描历史。
+    """
+
+    def __init__(self, max_age=DEFAULT_LAST_PATH_MAX_AGE):
+        self.max_age = max_age
+        self._last = {}
+
+    def _load_last(self, session, server_id):
+        result = session.query(TracerouteResult).filter(
+            TracerouteResult.target_server_id == server_id,
+            TracerouteResult.path_id.isnot(None),
+        ).order_by(TracerouteResult.test_time.desc(), TracerouteResult.id.desc()).first()
+        if result is None:
+            return None
+        return result.path_id, result_hops(result), time.monotonic()
+
+    def observe(self, session, server_id, path_id, hops, detected_at=None):
+        """
+        记录服务器的新路径 (hops 为带地理位置的跳点，是否包含 RTT 均可)。
+        与上一条路径相比有变化时添加一条 RouteChangeEvent 到会话并返回 (不提交事务)，否则返回 None。
+        需在本次的 TracerouteResult 加入会话之前调用。
+        """
+        now = time.monotonic()
+        last = self._last.get(server_id)
+        if last is None or now - last[2] > self.max_age:
+            last = self._load_last(session, server_id)
+        self._last[server_id] = (path_id, hops, now)
+        if last is None or last[0] == path_id:
+            return None
+
+        diff = diff_paths(last[1], hops)
+        if not has_changes(diff):
+            return None
+        event = RouteChangeEvent(
+            target_server_id=server_id,
+            detected_at=detected_at or datetime.utcnow(),
+            old_path_id=last[0],
+            new_path_id=path_id,
+            diff=diff,
+        )
+        session.add(event)
+        return event
+
+    def forget(self, server_id):
+        """删除服务器后清除其状态"""
+        self._last.pop(server_id, None)
+
+    def clear(self):
+        """清除所有服务器的状态，下次比较时从数据库重新加载"""
+        self._last.clear()
@@ -0,0 +1,119 @@
+import calendar
+from datetime import timedelta
+
+from models import PingResult, PingRollup
+from rollups import ROLLUP_GRANULARITIES, rollup_to_dict
+
+# 时间序列接口支持的分桶方式，'raw' 表示直接读取原始 PingResult 的结构化字段
+SERIES_BUCKETS = ('raw',) + ROLLUP_GRANULARITIES
+# 默认返回的最大点数
+DEFAULT_SERIES_POINTS = 500
+
+
+def choose_bucket(start, end):
+    """根据时间范围自动选择分桶粒度"""
+    span = end - start
+    if span <= timedelta(days=2):
+        return 'raw'
+    if span <= timedelta(days=60):
+        return 'hour'
+    return 'day'
+
+
+def to_epoch_ms(value):
+    """将 (视为 UTC 的) naive datetime 转换为毫秒时间戳"""
+    return calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+
+
+def lttb_indices(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回需要保留的点的下标列表。
+    保留首尾两点，中间每个桶选出与相邻桶构成三角形面积最大的点，从而保留峰值和低谷等形状特征。
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    indices = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 下一个桶的平均点作为三角形的第三个顶点
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= n:
+            next_start, next_end = n - 1, n
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return indices
+
+
+def downsample_columns(columns, threshold, x_key='timestamps', y_key='avg_rtt_ms'):
+    """
+    按 y_key 列的形状对所有列一起做 LTTB 降采样。
+    y 为 None 的点 (例如全部丢包) 在计算面积时按 0 处理，因此断连会作为低谷被保留下来。
+    """
+    xs = columns[x_key]
+    if len(xs) <= threshold:
+        return columns
+    ys = [y if y is not None else 0.0 for y in columns[y_key]]
+    keep = lttb_indices(xs, ys, threshold)
+    return {key: [values[i] for i in keep] for key, values in columns.items()}
+
+
+def query_ping_series(session, server_id, start, end, bucket):
+    """
+    读取一台服务器在 [start, end) 内的 Ping 时间序列，返回列式数据:
+    {'timestamps': [...毫秒], 'avg_rtt_ms': [...], 'min_rtt_ms': [...], 'max_rtt_ms': [...], 'loss_percent': [...], 'count': [...]}
+    bucket 为 'raw' 时只读取结构化字段 (不读取 raw_output)，否则读取预先汇总的 PingRollup，
+    并额外返回 'p50_rtt_ms'、'p95_rtt_ms'、'p99_rtt_ms' 百分位数列。
+    """
+    columns = {'timestamps': [], 'avg_rtt_ms': [], 'min_rtt_ms': [], 'max_rtt_ms': [], 'loss_percent': [], 'count': []}
+    if bucket == 'raw':
+        rows = session.query(
+            PingResult.test_time, PingResult.avg_rtt_ms, PingResult.min_rtt_ms,
+            PingResult.max_rtt_ms, PingResult.packet_loss_percent
+        ).filter(
+            PingResult.target_server_id == server_id,
+            PingResult.test_time >= start,
+            PingResult.test_time < end,
+        ).order_by(PingResult.test_time)
+        for test_time, avg_rtt, min_rtt, max_rtt, loss in rows:
+            columns['timestamps'].append(to_epoch_ms(test_time))
+            columns['avg_rtt_ms'].append(avg_rtt)
+            columns['min_rtt_ms'].append(min_rtt)
+            columns['max_rtt_ms'].append(max_rtt)
+            columns['loss_percent'].append(loss)
+            columns['count'].append(1)
+        return columns
+
+    # 汇总表额外返回由 RTT 直方图估算的百分位数
+    for key in ('p50_rtt_ms', 'p95_rtt_ms', 'p99_rtt_ms'):
+        columns[key] = []
+    rows = session.query(PingRollup).filter(
+        PingRollup.target_server_id == server_id,
+        PingRollup.granularity == bucket,
+        PingRollup.bucket_start >= start,
+        PingRollup.bucket_start < end,
+    ).order_by(PingRollup.bucket_start)
+    for rollup in rows:
+        item = rollup_to_dict(rollup)
+        item['timestamps'] = to_epoch_ms(item.pop('bucket_start'))
+        for key, values in columns.items():
+            values.append(item[key])
+    return columns
@@ -10,6 +10,13 @@ document.addEventListener('DOMContentLoaded', function () {
     const modalCloseButton = tracerouteDetailModal.querySelector('.delete');
     const closeModalButton = document.getElementById('close-modal');
     const tracerouteRawOutputPre = document.getElementById('traceroute-raw-output');
+    const pingChartDiv = document.getElementById('ping-chart');
+    const pingChartRangeSelect = document.getElementById('ping-chart-range');
+    const liveStatus = document.getElementById('live-status');
+
+    // Current page of each results table, used to decide whether live updates should refresh it
+    // 各结果表格当前的页码，用于判断实时更新时是否需要刷新
+    const currentPages = { ping: 1, traceroute: 1 };
 
     // Function to open the modal
     // 打开模态框的函数
@@ -18,9 +25,46 @@ document.addEventListener('DOMContentLoaded', function () {
         tracerouteDetailModal.classList.add('is-active');
     }
 
+    // List requests leave raw_output out; the modal fetches it for one result when opened
+    // 列表请求不包含 raw_output，打开模态框时再按需获取单条结果的原始输出
+    const PING_LIST_FIELDS = 'id,test_time,server_hostname,server_description,packet_loss_percent,min_rtt_ms,avg_rtt_ms,max_rtt_ms';
+    const TRACEROUTE_LIST_FIELDS = 'id,test_time,path_id,processed_hops';
+
+    // Incremented on every open/close so a late response cannot reopen or overwrite the modal
+    // 每次打开或关闭时递增，避免较晚返回的响应重新打开或覆盖模态框
+    let rawOutputRequest = 0;
+
+    // Function to fetch and show the raw output of a result in the modal
+    // 获取单条结果的原始输出并在模态框中显示的函数
+    function openRawOutput(testType, resultId) {
+        const request = ++rawOutputRequest;
+        openModal('加载原始输出中...');
+        fetch(`/api/results/${testType}/${resultId}/raw`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                if (request !== rawOutputRequest) {
+                    return;
+                }
+                openModal(data.raw_output !== null ? data.raw_output : '原始输出已按数据保留策略清理。');
+            })
+            .catch(error => {
+                console.error('Error fetching raw output:', error);
+                if (request !== rawOutputRequest) {
+                    return;
+                }
+                openModal('加载原始输出时出错。');
+            });
+    }
+
     // Function to close the modal
     // 关闭模态框的函数
     function closeModal() {
+        rawOutputRequest++;
         tracerouteDetailModal.classList.remove('is-active');
         tracerouteRawOutputPre.textContent = ''; // 关闭时清空内容
     }
@@ -52,6 +96,7 @@ document.addEventListener('DOMContentLoaded', function () {
             const selectedServerId = serverSelect.value;
             if (target === 'ping') {
                  fetchAndDisplayPingResults(selectedServerId);
+                 fetchAndDisplayPingChart(selectedServerId);
             } else if (target === 'traceroute') {
                  fetchAndDisplayTracerouteResults(selectedServerId); // 调用 traceroute 函数
             }
@@ -60,16 +105,21 @@ document.addEventListener('DOMContentLoaded', function () {
 
     // Function to fetch and display Ping results
     // 获取并显示 Ping 结果的函数
-    function fetchAndDisplayPingResults(serverId, page = 1, perPage = 10) {
+    function fetchAndDisplayPingResults(serverId, page = 1, perPage = 10, quiet = false) {
+        currentPages.ping = page;
         let apiUrl = '/api/results/';
         if (serverId) {
             apiUrl += `${serverId}/`;
         }
-        apiUrl += `ping?page=${page}&per_page=${perPage}`;
+        apiUrl += `ping?page=${page}&per_page=${perPage}&fields=${PING_LIST_FIELDS}`;
 
         // Show loading message
         // 显示加载消息
-        pingResultsTableDiv.innerHTML = '<p>加载 Ping 结果中...</p>';
+        // Live refreshes keep the current table until the new data arrives
+        // 实时刷新时保留当前表格直到新数据返回，避免闪烁
+        if (!quiet) {
+            pingResultsTableDiv.innerHTML = '<p>加载 Ping 结果中...</p>';
+        }
 
         fetch(apiUrl)
             .then(response => {
@@ -120,7 +170,7 @@ document.addEventListener('DOMContentLoaded', function () {
                     
                     // Ping 的查看详细按钮，使用 openModal 函数
                     // View raw output button for Ping, use openModal function
-                    tableHtml += `<td><button class="button is-small is-info is-light view-raw-output" data-output="${encodeURIComponent(result.raw_output)}">查看详细</button></td>`; 
+                    tableHtml += `<td><button class="button is-small is-info is-light view-raw-output" data-result-id="${result.id}">查看详细</button></td>`; 
                     tableHtml += '</tr>';
                 });
 
@@ -131,9 +181,8 @@ document.addEventListener('DOMContentLoaded', function () {
                 // 为 Ping 的查看原始输出按钮添加事件监听器
                 pingResultsTableDiv.querySelectorAll('.view-raw-output').forEach(button => {
                     button.addEventListener('click', () => {
-                         const rawOutput = decodeURIComponent(button.dataset.output);
-                         openModal(rawOutput); // 调用 openModal 显示 Ping 的原始输出
-                         // Call openModal to display raw output for Ping
+                         openRawOutput('ping', button.dataset.resultId); // 获取并显示 Ping 的原始输出
+                         // Fetch and display raw output for Ping
                     });
                 });
 
@@ -148,18 +197,107 @@ document.addEventListener('DOMContentLoaded', function () {
             });
     }
 
+    // Function to fetch and draw the Ping chart from the columnar series API
+    // 从列式时间序列接口获取数据并绘制 Ping 图表的函数
+    function fetchAndDisplayPingChart(serverId) {
+        if (!serverId) {
+            pingChartDiv.innerHTML = '<p>选择单个服务器以查看 Ping 图表。</p>';
+            return;
+        }
+        const days = parseInt(pingChartRangeSelect.value) || 1;
+        const to = Math.floor(Date.now() / 1000);
+        const from = to - days * 86400;
+        const apiUrl = `/api/series/${serverId}/ping?from=${from}&to=${to}&points=${Math.max(pingChartDiv.clientWidth, 300)}`;
+
+        pingChartDiv.innerHTML = '<p>加载 Ping 图表中...</p>';
+
+        fetch(apiUrl)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(series => {
+                if (!series.timestamps || series.timestamps.length === 0) {
+                    pingChartDiv.innerHTML = '<p>所选时间范围内暂无 Ping 数据。</p>';
+                    return;
+                }
+                pingChartDiv.innerHTML = renderPingChartSvg(series);
+            })
+            .catch(error => {
+                console.error('Error fetching ping series:', error);
+                pingChartDiv.innerHTML = '<p class="has-text-danger">加载 Ping 图表时出错。</p>';
+            });
+    }
+
+    // Build an SVG chart: min/max band, average RTT line and packet loss markers
+    // 构建 SVG 图表: 最小/最大 RTT 区域、平均 RTT 折线和丢包标记
+    function renderPingChartSvg(series) {
+        const width = Math.max(pingChartDiv.clientWidth, 300);
+        const height = 220;
+        const padding = {left: 50, right: 10, top: 10, bottom: 25};
+        const xs = series.timestamps;
+        const xMin = series.from;
+        const xMax = series.to;
+        const yValues = series.max_rtt_ms.concat(series.avg_rtt_ms).filter(v => v !== null);
+        const yMax = yValues.length ? Math.max(...yValues) * 1.1 : 1;
+        const x = t => padding.left + (t - xMin) / (xMax - xMin) * (width - padding.left - padding.right);
+        const y = v => height - padding.bottom - v / yMax * (height - padding.top - padding.bottom);
+
+        let avgPath = '';
+        let bandTop = [];
+        let bandBottom = [];
+        let lossMarks = '';
+        xs.forEach((t, i) => {
+            const avg = series.avg_rtt_ms[i];
+            if (avg !== null) {
+                avgPath += `${avgPath && series.avg_rtt_ms[i - 1] !== null ? 'L' : 'M'}${x(t).toFixed(1)},${y(avg).toFixed(1)}`;
+            }
+            if (series.min_rtt_ms[i] !== null && series.max_rtt_ms[i] !== null) {
+                bandTop.push(`${x(t).toFixed(1)},${y(series.max_rtt_ms[i]).toFixed(1)}`);
+                bandBottom.unshift(`${x(t).toFixed(1)},${y(series.min_rtt_ms[i]).toFixed(1)}`);
+            }
+            const loss = series.loss_percent[i];
+            if (loss === null || loss > 0) {
+                lossMarks += `<line x1="${x(t).toFixed(1)}" x2="${x(t).toFixed(1)}" y1="${padding.top}" y2="${height - padding.bottom}" stroke="#f14668" stroke-opacity="${loss === null ? 0.8 : Math.min(loss / 100 + 0.2, 0.8)}"><title>丢包 ${loss === null ? 'N/A' : loss.toFixed(1) + '%'}</title></line>`;
+            }
+        });
+
+        let svg = `<svg width="${width}" height="${height}" xmlns="http://www.w3.org/2000/svg">`;
+        svg += lossMarks;
+        if (bandTop.length) {
+            svg += `<polygon points="${bandTop.concat(bandBottom).join(' ')}" fill="#3e8ed0" fill-opacity="0.15"></polygon>`;
+        }
+        svg += `<path d="${avgPath}" fill="none" stroke="#3e8ed0" stroke-width="1.5"></path>`;
+        // Axes labels
+        // 坐标轴标签
+        svg += `<text x="5" y="${padding.top + 10}" font-size="11">${yMax.toFixed(0)} ms</text>`;
+        svg += `<text x="5" y="${height - padding.bottom}" font-size="11">0 ms</text>`;
+        svg += `<text x="${padding.left}" y="${height - 5}" font-size="11">${escapeHTML(new Date(xMin).toLocaleString())}</text>`;
+        svg += `<text x="${width - padding.right}" y="${height - 5}" font-size="11" text-anchor="end">${escapeHTML(new Date(xMax).toLocaleString())}</text>`;
+        svg += '</svg>';
+        svg += `<p class="is-size-7">分桶: ${escapeHTML(series.bucket)}，显示 ${xs.length} / ${series.total_points} 个点</p>`;
+        return svg;
+    }
+
     // Function to fetch and display Traceroute results
     // 获取并显示 Traceroute 结果的函数
-    function fetchAndDisplayTracerouteResults(serverId, page = 1, perPage = 10) {
+    function fetchAndDisplayTracerouteResults(serverId, page = 1, perPage = 10, quiet = false) {
+        currentPages.traceroute = page;
         let apiUrl = '/api/results/';
         if (serverId) {
             apiUrl += `${serverId}/`;
         }
-        apiUrl += `traceroute?page=${page}&per_page=${perPage}`;
+        apiUrl += `traceroute?page=${page}&per_page=${perPage}&fields=${TRACEROUTE_LIST_FIELDS}`;
 
         // Show loading message
         // 显示加载消息
-        tracerouteResultsTableDiv.innerHTML = '<p>加载 Traceroute 结果中...</p>';
+        // Live refreshes keep the current table until the new data arrives
+        // 实时刷新时保留当前表格直到新数据返回，避免闪烁
+        if (!quiet) {
+            tracerouteResultsTableDiv.innerHTML = '<p>加载 Traceroute 结果中...</p>';
+        }
 
         fetch(apiUrl)
             .then(response => {
@@ -264,7 +402,7 @@ document.addEventListener('DOMContentLoaded', function () {
                               // Add a button to view raw output only for the first hop of a result
                               // 只在结果的第一个跳中添加查看原始输出按钮
                               if (hopIndex === 0) {
-                                   tableHtml += `<td rowspan="${totalHopsInResult}"><button class="button is-small is-info view-raw-output" data-output="${encodeURIComponent(result.raw_output)}">查看详细</button></td>`;
+                                   tableHtml += `<td rowspan="${totalHopsInResult}"><button class="button is-small is-info view-raw-output" data-result-id="${result.id}">查看详细</button></td>`;
                               }
 
                               tableHtml += '</tr>';
@@ -272,7 +410,7 @@ document.addEventListener('DOMContentLoaded', function () {
                     } else {
                          // 处理 processed_hops 为空的情况，例如测试失败
                          // Handle case where processed_hops is empty, e.g., test failed
-                         tableHtml += `<tr><td colspan="6">无法显示 Traceroute 详细结果。原始输出: ${escapeHTML(result.raw_output)}</td></tr>`;
+                         tableHtml += `<tr><td colspan="6">无法显示 Traceroute 详细结果。<button class="button is-small is-info view-raw-output" data-result-id="${result.id}">查看原始输出</button></td></tr>`;
                     }
                 });
 
@@ -283,8 +421,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 // 为 Traceroute 的查看原始输出按钮添加事件监听器
                 tracerouteResultsTableDiv.querySelectorAll('.view-raw-output').forEach(button => {
                     button.addEventListener('click', () => {
-                         const rawOutput = decodeURIComponent(button.dataset.output);
-                         openModal(rawOutput);
+                         openRawOutput('traceroute', button.dataset.resultId);
                     });
                 });
 
@@ -415,10 +552,17 @@ document.addEventListener('DOMContentLoaded', function () {
 
     if (initialTarget === 'ping') {
         fetchAndDisplayPingResults(initialServerId);
+        fetchAndDisplayPingChart(initialServerId);
     } else if (initialTarget === 'traceroute') {
         fetchAndDisplayTracerouteResults(initialServerId);
     }
 
+    // Reload the chart when the time range changes
+    // 时间范围改变时重新加载图表
+    pingChartRangeSelect.addEventListener('change', () => {
+        fetchAndDisplayPingChart(serverSelect.value);
+    });
+
     // Add event listener for server select change
     // 为服务器选择框添加事件监听器
     serverSelect.addEventListener('change', (event) => {
@@ -432,8 +576,76 @@ document.addEventListener('DOMContentLoaded', function () {
         // 获取并显示选定服务器和当前活动标签页的数据，从第一页开始
         if (currentTestType === 'ping') {
             fetchAndDisplayPingResults(selectedServerId, 1); // Start from page 1
+            fetchAndDisplayPingChart(selectedServerId);
         } else if (currentTestType === 'traceroute') {
              fetchAndDisplayTracerouteResults(selectedServerId, 1); // Start from page 1
         }
+        // Follow live updates of the selected server only
+        // 实时更新只跟随选定的服务器
+        connectLiveStream(selectedServerId);
     });
+
+    // Live updates: new results are pushed by /api/stream (Server-Sent Events).
+    // Events arrive in batches as the writer commits, so the first page of the active table
+    // is refreshed at most once per LIVE_REFRESH_DELAY_MS; the refresh revalidates with the
+    // results API's ETag and is served from its response cache, so open tabs add almost no DB load.
+    // 实时更新: 新结果由 /api/stream (Server-Sent Events) 推送。
+    // 写入线程按批提交，事件成批到达，因此每 LIVE_REFRESH_DELAY_MS 最多刷新一次活动表格的第一页；
+    // 刷新请求经结果接口的 ETag 和响应缓存，多开页面几乎不增加数据库负载。
+    const LIVE_REFRESH_DELAY_MS = 2000;
+    let liveSource = null;
+    const pendingLiveRefresh = { ping: null, traceroute: null };
+
+    function setLiveStatus(text, className) {
+        liveStatus.textContent = `实时更新: ${text}`;
+        liveStatus.className = `tag ${className}`;
+    }
+
+    function scheduleLiveRefresh(testType) {
+        if (pendingLiveRefresh[testType] !== null) {
+            return;
+        }
+        pendingLiveRefresh[testType] = setTimeout(() => {
+            pendingLiveRefresh[testType] = null;
+            const activeTab = document.querySelector('.tabs li.is-active');
+            // Only refresh the visible table, and only when the user is looking at the newest page
+            // 只刷新可见的表格，且只在用户查看最新一页时刷新
+            if (!activeTab || activeTab.dataset.tab !== testType || currentPages[testType] !== 1) {
+                return;
+            }
+            if (testType === 'ping') {
+                fetchAndDisplayPingResults(serverSelect.value, 1, 10, true);
+            } else {
+                fetchAndDisplayTracerouteResults(serverSelect.value, 1, 10, true);
+            }
+        }, LIVE_REFRESH_DELAY_MS);
+    }
+
+    function connectLiveStream(serverId) {
+        if (!window.EventSource) {
+            setLiveStatus('浏览器不支持', 'is-light');
+            return;
+        }
+        if (liveSource) {
+            liveSource.close();
+        }
+        liveSource = new EventSource(serverId ? `/api/stream?server_id=${serverId}` : '/api/stream');
+        setLiveStatus('连接中', 'is-light');
+        liveSource.addEventListener('open', () => setLiveStatus('已连接', 'is-success is-light'));
+        // EventSource reconnects by itself and resends Last-Event-ID
+        // EventSource 会自动重连并带上 Last-Event-ID
+        liveSource.addEventListener('error', () => setLiveStatus('重连中', 'is-warning is-light'));
+        liveSource.addEventListener('result', (event) => {
+            const result = JSON.parse(event.data);
+            scheduleLiveRefresh(result.type);
+        });
+        // Events were missed (too far behind, or the server restarted); reload both tables
+        // 错过了部分事件 (积压过多或服务器已重启)，重新加载两个表格
+        liveSource.addEventListener('reset', () => {
+            scheduleLiveRefresh('ping');
+            scheduleLiveRefresh('traceroute');
+        });
+    }
+
+    connectLiveStream(serverSelect.value);
 }); 
\ No newline at end of file